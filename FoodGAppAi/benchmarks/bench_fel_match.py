@@ -0,0 +1,211 @@
+"""
+Microbenchmarks for the FEL matching and scaling primitives in main.py:
+normalize_text, fel_find_match (one workload per stage: exact, alias,
+tokenset, contains, fuzzy, miss), lookup_fel cache behaviour, scale_row,
+find_appropriate_portion and calculate_atwater_kcal.
+
+fel_find_match runs against synthetic FEL tables of 40 (the shipped
+fel_data.csv), 1k, 10k and 100k rows. Synthetic rows are appended after the
+real ones and the query target sits 3/4 of the way down the table, so
+linear scans pay for most of the table. Each timing is a timeit
+autorange/repeat with GC off. The report gives the min and median
+per-call time. The linear stages take seconds per call at 100k rows,
+so the full run takes several minutes; use --sizes for a quick check.
+
+    python benchmarks/bench_fel_match.py --out fel_bench.json
+    python benchmarks/bench_fel_match.py --sizes 40,1000 --repeat 7
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+import main  # noqa: E402
+
+ADJECTIVES = ["ginisang", "inihaw", "pritong", "nilagang", "tostadong", "sinangag", "adobong", "ginataang"]
+DISHES = ["adobo", "sinigang", "tinola", "kare", "bistek", "menudo", "afritada", "caldereta", "lechon", "pancit",
+          "lumpia", "bibingka", "puto", "turon", "paksiw", "nilaga", "bulalo", "sisig", "dinuguan", "pochero"]
+SYLLABLES = ["ba", "ka", "la", "ma", "na", "pa", "sa", "ta", "di", "gu", "ho", "ri", "so", "tu", "yo", "wi"]
+CATEGORIES = ["Vegetable", "Fruit", "Rice_A", "Meat_LowFat", "Meat_MediumFat", "Meat_HighFat", "Soup", "Noodles",
+              "Dessert", "Seafood", "Bread", "Egg"]
+COLUMNS = ["FoodId", "FoodGramAmount", "Carbs", "Protein", "Fat", "Calories", "FoodCategoryId", "Source"]
+
+# Used when the table has no synthetic rows (the shipped 40-row FEL)
+REAL_QUERIES = {
+    "exact": "pancit bihon",
+    "alias": "bitter gourd",
+    "tokenset": "bihon pancit",
+    "contains": "inakbet",
+    "fuzzy": "pinakbte",
+    "miss": "zzqx wvut",
+}
+NORMALIZE_INPUTS = ["Pork Adobo", "Sago't Gulaman (w/ syrup)!!", "  Rice   (White cooked) ", "Halo-Halo"]
+
+
+def pseudo_word(i: int) -> str:
+    """Unique, consonant-initial, pronounceable token for synthetic row i."""
+    out = []
+    i += len(SYLLABLES) ** 2  # at least three syllables
+    while i:
+        i, r = divmod(i, len(SYLLABLES))
+        out.append(SYLLABLES[r])
+    return "".join(out)
+
+
+def synthetic_rows(count: int, rnd: random.Random) -> list:
+    rows = []
+    for i in range(count):
+        protein, fat, carbs = rnd.uniform(0, 30), rnd.uniform(0, 25), rnd.uniform(0, 60)
+        rows.append({
+            "FoodId": f"{rnd.choice(ADJECTIVES)} {rnd.choice(DISHES)} {pseudo_word(i)}",
+            "FoodGramAmount": 100,
+            "Carbs": round(carbs, 1),
+            "Protein": round(protein, 1),
+            "Fat": round(fat, 1),
+            "Calories": main.calculate_atwater_kcal(protein, fat, carbs),
+            "FoodCategoryId": rnd.choice(CATEGORIES),
+            "Source": "FEL",
+        })
+    return rows
+
+
+def build_table(size: int, seed: int, workdir: str):
+    """Write a FEL CSV of `size` rows and load it through main.load_dataset."""
+    with open(os.path.join(ROOT, main.DATA_FILE), newline="") as f:
+        real = [{k: r[k] for k in COLUMNS} for r in csv.DictReader(f)][:size]
+    rows = real + synthetic_rows(size - len(real), random.Random(seed))
+    path = os.path.join(workdir, f"fel_{size}.csv")
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return main.load_dataset.__wrapped__(path), len(real)
+
+
+def stage_queries(df, real_rows: int) -> dict:
+    if len(df) == real_rows:
+        return dict(REAL_QUERIES)
+    target = real_rows + (len(df) - real_rows) * 3 // 4
+    adj, dish, token = df["Food"].iloc[target].split()
+    mutated = token[:2] + token[3] + token[2] + token[4:]
+    return {
+        "exact": f"{adj} {dish} {token}",
+        "alias": REAL_QUERIES["alias"],
+        "tokenset": f"{dish} {token}",
+        "contains": token[1:],
+        "fuzzy": f"{adj} {dish} {mutated}",
+        "miss": REAL_QUERIES["miss"],
+    }
+
+
+def time_call(fn, repeat: int) -> dict:
+    timer = timeit.Timer(fn)
+    loops, _ = timer.autorange()
+    runs = [t / loops for t in timer.repeat(repeat=repeat, number=loops)]
+    return {
+        "loops": loops,
+        "us_min": round(min(runs) * 1e6, 3),
+        "us_median": round(statistics.median(runs) * 1e6, 3),
+    }
+
+
+def bench_find_match(df, real_rows: int, repeat: int) -> dict:
+    results = {}
+    for stage, query in stage_queries(df, real_rows).items():
+        _, path = main.fel_find_match(query)
+        expected = None if stage == "miss" else f"FEL-{stage}"
+        if path != expected:
+            raise SystemExit(f"{len(df)} rows: {stage} query {query!r} resolved via {path}, expected {expected}")
+        results[stage] = {"query": query, **time_call(lambda q=query: main.fel_find_match(q), repeat)}
+    return results
+
+
+def bench_lookup_fel(df, repeat: int, seed: int) -> dict:
+    query = df["Food"].iloc[len(df) * 3 // 4]
+
+    def cold():
+        main.lookup_fel.cache_clear()
+        main.lookup_fel(query)
+
+    main.lookup_fel.cache_clear()
+    main.lookup_fel(query)
+    report = {
+        "cold": time_call(cold, repeat),
+        "warm": time_call(lambda: main.lookup_fel(query), repeat),
+    }
+
+    # Zipf-ish traffic over more distinct names than the cache holds
+    rnd = random.Random(seed)
+    names = df["Food"].tolist()
+    distinct = names[: min(len(names), 4 * main.lookup_fel.cache_info().maxsize)]
+    weights = [1 / (rank + 1) for rank in range(len(distinct))]
+    workload = rnd.choices(distinct, weights, k=5000)
+    main.lookup_fel.cache_clear()
+    elapsed = timeit.timeit(lambda: [main.lookup_fel(q) for q in workload], number=1)
+    info = main.lookup_fel.cache_info()
+    report["zipf"] = {
+        "calls": len(workload),
+        "distinct_names": len(distinct),
+        "hit_rate": round(info.hits / len(workload), 3),
+        "us_per_call": round(elapsed / len(workload) * 1e6, 3),
+    }
+    main.lookup_fel.cache_clear()
+    return report
+
+
+def bench_primitives(df, repeat: int) -> dict:
+    row = df.iloc[len(df) // 2]
+    row_dict = row.to_dict()
+    report = {
+        "normalize_text": time_call(lambda: [main.normalize_text(s) for s in NORMALIZE_INPUTS], repeat),
+        "scale_row_series": time_call(lambda: main.scale_row(row, 150.0), repeat),
+        "scale_row_dict": time_call(lambda: main.scale_row(row_dict, 150.0), repeat),
+        "find_appropriate_portion": time_call(lambda: main.find_appropriate_portion(row, 500), repeat),
+        "calculate_atwater_kcal": time_call(lambda: main.calculate_atwater_kcal(12.5, 8.0, 30.2), repeat),
+    }
+    report["normalize_text"]["inputs"] = len(NORMALIZE_INPUTS)
+    return report
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="40,1000,10000,100000")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="write the JSON report here as well as stdout")
+    args = ap.parse_args()
+
+    report = {"python": platform.python_version(), "repeat": args.repeat, "seed": args.seed, "tables": {}}
+    original = main.fel, main.fel_exact
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            for size in (int(s) for s in args.sizes.split(",")):
+                df, real_rows = build_table(size, args.seed, workdir)
+                main.fel = df
+                main.fel_exact = main.compile_exact_index(df, main.fel_aliases)
+                main.lookup_fel.cache_clear()
+                report["tables"][str(size)] = {
+                    "rows": len(df),
+                    "fel_find_match": bench_find_match(df, real_rows, args.repeat),
+                    "lookup_fel": bench_lookup_fel(df, args.repeat, args.seed),
+                }
+                if "primitives" not in report:
+                    report["primitives"] = bench_primitives(df, args.repeat)
+        finally:
+            main.fel, main.fel_exact = original
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
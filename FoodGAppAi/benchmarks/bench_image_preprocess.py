@@ -0,0 +1,82 @@
+"""
+/describe_image payload benchmark over the sample photos in uploads/.
+
+For every image it reports the bytes that would be sent to Gemini before
+(raw upload, base64) and after preprocess_image(), plus preprocessing time.
+With --live (and GEMINI_SECRET_KEY set) it also times the full Gemini call
+for the raw and the preprocessed payload.
+
+    python benchmarks/bench_image_preprocess.py [--live] [--repeat 5]
+"""
+import argparse
+import base64
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import main  # noqa: E402
+
+PROMPT = (
+    "Identify the food in this image. Respond only in the format: Food Name - Category. "
+    "If it is not food, respond: No food detected."
+)
+
+
+def time_gemini(data: bytes, mime: str, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        main.call_gemini([PROMPT, {"mime_type": mime, "data": data}])
+        samples.append(time.perf_counter() - start)
+    return round(statistics.median(samples) * 1000, 1)
+
+
+def run(paths, repeat: int, live: bool) -> list:
+    rows = []
+    for path in paths:
+        with open(path, "rb") as f:
+            raw = f.read()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            processed, mime = main.preprocess_image(raw)
+            timings.append(time.perf_counter() - start)
+        row = {
+            "file": os.path.basename(path),
+            "raw_bytes": len(raw),
+            "raw_b64_bytes": len(base64.b64encode(raw)),
+            "sent_bytes": len(processed),
+            "sent_mime": mime,
+            "reduction": round(1 - len(processed) / len(raw), 3),
+            "preprocess_ms": round(statistics.median(timings) * 1000, 2),
+        }
+        if live:
+            row["gemini_raw_ms"] = time_gemini(raw, main.sniff_image_mime(raw) or "image/jpeg", repeat)
+            row["gemini_sent_ms"] = time_gemini(processed, mime, repeat)
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--images", default=os.path.join(ROOT, "uploads", "*"))
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--live", action="store_true", help="also time real Gemini calls")
+    args = ap.parse_args()
+
+    rows = run(sorted(glob.glob(args.images)), args.repeat, args.live)
+    total_raw = sum(r["raw_bytes"] for r in rows)
+    total_sent = sum(r["sent_bytes"] for r in rows)
+    print(json.dumps({
+        "max_dim": main.IMAGE_MAX_DIM,
+        "jpeg_quality": main.IMAGE_JPEG_QUALITY,
+        "images": rows,
+        "total_raw_bytes": total_raw,
+        "total_sent_bytes": total_sent,
+    }, indent=2))
@@ -0,0 +1,75 @@
+"""
+Logging overhead benchmark for /get_nutritional_info.
+
+Each configuration runs in its own subprocess (logging is configured at
+import) with stderr redirected to a real file, and posts FEL-only queries
+through the Flask test client with external lookups disabled.
+
+  verbose_sync  text, synchronous handler, lookup logs at DEBUG, no sampling
+                (roughly the old per-item log volume)
+  default       JSON lines, QueueHandler sink, lookup logs sampled at 10%
+  quiet         JSON lines, QueueHandler sink, lookup logs at WARNING
+
+    python benchmarks/bench_logging.py --requests 2000 --items 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIGS = {
+    "verbose_sync": {"LOG_FORMAT": "text", "LOG_ASYNC": "0", "LOG_LOOKUP_SAMPLE_RATE": "1",
+                     "LOG_LEVELS": "meal-backend.lookup=DEBUG,werkzeug=WARNING"},
+    "default": {},
+    "quiet": {"LOG_LEVELS": "meal-backend.lookup=WARNING,werkzeug=WARNING"},
+}
+FOODS = ["adobo (pork)", "rice (white cooked)", "kangkong", "banana (latundan)", "egg (boiled)",
+         "pancit canton", "taho", "fish (bangus)"]
+
+
+def child(requests_n: int, items_n: int):
+    sys.path.insert(0, ROOT)
+    import main
+
+    main.USDA_API_KEY = None
+    main.API_NINJAS_KEY = None
+    client = main.app.test_client()
+    payload = {"items": [{"foodName": FOODS[i % len(FOODS)], "grams": 150} for i in range(items_n)]}
+    for _ in range(50):  # warm caches
+        client.post("/get_nutritional_info", json=payload)
+    start = time.perf_counter()
+    for _ in range(requests_n):
+        client.post("/get_nutritional_info", json=payload)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"seconds": round(elapsed, 3), "rps": round(requests_n / elapsed, 1),
+                      "ms_per_request": round(elapsed / requests_n * 1000, 3)}))
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--items", type=int, default=5)
+    ap.add_argument("--child", action="store_true")
+    args = ap.parse_args()
+
+    if args.child:
+        child(args.requests, args.items)
+        sys.exit(0)
+
+    report = {"requests": args.requests, "items_per_request": args.items, "configs": {}}
+    for name, overrides in CONFIGS.items():
+        env = dict(os.environ, **overrides)
+        with tempfile.NamedTemporaryFile("w+b", suffix=".log") as log_file:
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", "--requests", str(args.requests), "--items", str(args.items)],
+                env=env, stdout=subprocess.PIPE, stderr=log_file, text=True, check=True
+            )
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            result["log_bytes"] = os.path.getsize(log_file.name)
+        report["configs"][name] = result
+    print(json.dumps(report, indent=2))
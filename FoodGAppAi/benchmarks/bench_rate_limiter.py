@@ -0,0 +1,113 @@
+"""
+Rate limiter benchmark: drives MemoryStore.rate_hit with two workloads and
+reports throughput plus the memory held by the limiter:
+
+  fan_out   N distinct user ids (1M by default), --hits-per-user each
+  repeat    --repeat-users ids hitting --repeat-hits times each, round-robin,
+            so every window is full and the per-call cost of a busy key shows
+
+The original list-of-datetimes limiter is run on the same workloads for
+comparison.
+
+    python benchmarks/bench_rate_limiter.py --users 1000000 --max-keys 100000
+    python benchmarks/bench_rate_limiter.py --users 0 --repeat-users 1000 --repeat-hits 500
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import MemoryStore  # noqa: E402
+
+
+def legacy_limiter():
+    rate_limiter = defaultdict(list)
+
+    def hit(user_id, max_requests=10, window_minutes=5):
+        now = datetime.now()
+        cutoff = now - timedelta(minutes=window_minutes)
+        rate_limiter[user_id] = [t for t in rate_limiter[user_id] if t > cutoff]
+        if len(rate_limiter[user_id]) >= max_requests:
+            return False
+        rate_limiter[user_id].append(now)
+        return True
+
+    return hit, rate_limiter.__len__
+
+
+def sliding_window_limiter(max_keys):
+    store = MemoryStore(max_rate_keys=max_keys)
+    return (lambda user_id: store.rate_hit(user_id, 10, 300)), store.rate_size
+
+
+def drive(hit, users, hits_per_user):
+    for i in range(users):
+        key = f"user-{i}"
+        for _ in range(hits_per_user):
+            hit(key)
+
+
+def drive_round_robin(hit, users, hits_per_user):
+    keys = [f"user-{i}" for i in range(users)]
+    for _ in range(hits_per_user):
+        for key in keys:
+            hit(key)
+
+
+def measure(factory, users, hits_per_user, driver=drive) -> dict:
+    # Timing and memory are taken in separate passes: tracemalloc slows
+    # allocation-heavy code by an order of magnitude.
+    hit, size = factory()
+    start = time.perf_counter()
+    driver(hit, users, hits_per_user)
+    elapsed = time.perf_counter() - start
+    calls = users * hits_per_user
+
+    tracemalloc.start()
+    hit, size = factory()
+    driver(hit, users, hits_per_user)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "calls": calls,
+        "seconds": round(elapsed, 3),
+        "calls_per_sec": round(calls / elapsed),
+        "us_per_call": round(elapsed / calls * 1e6, 3),
+        "keys_held": size(),
+        "traced_mb_current": round(current / 1e6, 1),
+        "traced_mb_peak": round(peak / 1e6, 1),
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=1_000_000)
+    ap.add_argument("--max-keys", type=int, default=100_000)
+    ap.add_argument("--hits-per-user", type=int, default=1)
+    ap.add_argument("--repeat-users", type=int, default=1000)
+    ap.add_argument("--repeat-hits", type=int, default=200)
+    ap.add_argument("--skip-legacy", action="store_true")
+    args = ap.parse_args()
+
+    limiters = {"sliding_window": lambda: sliding_window_limiter(args.max_keys)}
+    if not args.skip_legacy:
+        limiters["legacy_list"] = legacy_limiter
+    workloads = {
+        "fan_out": (args.users, args.hits_per_user, drive),
+        "repeat": (args.repeat_users, args.repeat_hits, drive_round_robin),
+    }
+
+    report = {"max_keys": args.max_keys}
+    for name, (users, hits, driver) in workloads.items():
+        if not users or not hits:
+            continue
+        report[name] = {"users": users, "hits_per_user": hits}
+        for label, factory in limiters.items():
+            report[name][label] = measure(factory, users, hits, driver)
+    print(json.dumps(report, indent=2))
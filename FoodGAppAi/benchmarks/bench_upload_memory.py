@@ -0,0 +1,120 @@
+"""
+Peak-RSS benchmark for /describe_image uploads.
+
+Each mode runs in a fresh subprocess (ru_maxrss is a process high-water mark)
+and posts the same image from N concurrent threads through the Flask test
+client, with Gemini stubbed out. "legacy" replays the previous handler
+(file.read(), preprocess the in-memory bytes, base64 + str decode);
+"streaming" is the current endpoint.
+The image cache is disabled so every request does the full work.
+
+    python benchmarks/bench_upload_memory.py --concurrency 8
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_IMAGE = os.path.join(ROOT, "uploads", "Lagare - Live Birth Cert (Front).jpg")
+
+
+def rss_mb() -> float:
+    # Linux reports KiB, macOS bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def child(mode: str, image: str, concurrency: int):
+    os.environ["IMAGE_CACHE_SIZE"] = "1"
+    sys.path.insert(0, ROOT)
+    import base64
+    import io
+    import main
+    from flask import jsonify, request
+
+    class _Reply:
+        text = "Adobo - Meat"
+
+    class _Model:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def generate_content(self, contents, request_options=None):
+            return _Reply()
+
+    main.genai.GenerativeModel = _Model
+    main.image_cache.get = lambda key: None
+    barrier = threading.Barrier(concurrency)
+
+    @main.app.route("/_legacy_describe_image", methods=["POST"])
+    def legacy_describe_image():
+        file_data = request.files["file"].read()
+        processed, mime_type = main.preprocess_image(file_data)
+        img_data = base64.b64encode(processed).decode()
+        barrier.wait()  # hold every copy alive at once, like concurrent slow calls
+        main.genai.GenerativeModel("stub").generate_content(["prompt", {"mime_type": mime_type, "data": img_data}])
+        return jsonify({"description": "Adobo - Meat"})
+
+    original = main.call_gemini
+
+    def held_call_gemini(contents, timeout=None):
+        barrier.wait()
+        return original(contents, timeout)
+
+    main.call_gemini = held_call_gemini
+    main.GEMINI_MAX_CONCURRENCY = concurrency
+    main.gemini_slots = threading.BoundedSemaphore(concurrency * 2)
+    main.gemini_executor = main.ThreadPoolExecutor(max_workers=concurrency)
+
+    with open(image, "rb") as f:
+        payload = f.read()
+    url = "/_legacy_describe_image" if mode == "legacy" else "/describe_image"
+    client = main.app.test_client()
+    baseline = rss_mb()
+    codes = []
+
+    def post():
+        r = client.post(url, data={"file": (io.BytesIO(payload), "meal.jpg")})
+        codes.append(r.status_code)
+
+    threads = [threading.Thread(target=post) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    peak = rss_mb()
+    print(json.dumps({
+        "mode": mode,
+        "upload_bytes": len(payload),
+        "concurrency": concurrency,
+        "status_codes": sorted(set(codes)),
+        "baseline_rss_mb": round(baseline, 1),
+        "peak_rss_mb": round(peak, 1),
+        "peak_delta_per_upload_mb": round((peak - baseline) / concurrency, 2),
+    }))
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--image", default=DEFAULT_IMAGE)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--child", choices=["legacy", "streaming"])
+    args = ap.parse_args()
+
+    if args.child:
+        child(args.child, args.image, args.concurrency)
+        sys.exit(0)
+
+    results = []
+    for mode in ("legacy", "streaming"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", mode, "--image", args.image,
+             "--concurrency", str(args.concurrency)],
+            capture_output=True, text=True, check=True
+        )
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,89 @@
+"""
+Alias table evaluation: replays a food-name query log through
+fel_find_match with and without the FEL alias table (fel_aliases.csv).
+It reports how many lookups each configuration sends to USDA/API Ninjas,
+plus the matching stage mix and time spent.
+
+    python benchmarks/eval_aliases.py benchmarks/sample_queries.txt
+    python benchmarks/eval_aliases.py queries.txt --aliases other_aliases.csv --show-changes
+
+The log holds one query per line, optionally prefixed by "count<TAB>".
+A FEL match with no FEL micronutrients still fetches micronutrients
+externally; that call happens either way, so only full external lookups
+are counted.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+import main  # noqa: E402
+
+
+def read_log(path: str) -> list:
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            count, sep, query = line.partition("\t")
+            if sep and count.strip().isdigit():
+                queries.append((query.strip(), int(count)))
+            else:
+                queries.append((line.strip(), 1))
+    return queries
+
+
+def replay(queries: list, exact_index: dict) -> dict:
+    main.fel_exact = exact_index
+    paths, resolved = Counter(), {}
+    start = time.perf_counter()
+    for query, _ in queries:
+        row, path = main.fel_find_match(query)
+        resolved[query] = (path or "external", None if row is None else row["Food_raw"])
+    elapsed = time.perf_counter() - start
+    for query, count in queries:
+        paths[resolved[query][0]] += count
+    total = sum(count for _, count in queries)
+    return {
+        "lookups": total,
+        "external_calls": paths["external"],
+        "external_rate": round(paths["external"] / total, 4) if total else 0.0,
+        "paths": dict(paths.most_common()),
+        "match_ms_per_distinct_query": round(elapsed / len(queries) * 1000, 3) if queries else 0.0,
+    }, resolved
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("log", help="query log, one query per line, optional 'count<TAB>' prefix")
+    ap.add_argument("--aliases", default=main.ALIAS_FILE)
+    ap.add_argument("--show-changes", action="store_true", help="list queries whose match changed")
+    args = ap.parse_args()
+
+    queries = read_log(args.log)
+    aliases = main.load_aliases(args.aliases)
+    original = main.fel_exact
+    try:
+        without, before = replay(queries, main.compile_exact_index(main.fel, {}))
+        with_aliases, after = replay(queries, main.compile_exact_index(main.fel, aliases))
+    finally:
+        main.fel_exact = original
+
+    report = {
+        "log": args.log,
+        "distinct_queries": len(queries),
+        "aliases": len(aliases),
+        "without_aliases": without,
+        "with_aliases": with_aliases,
+        "external_calls_eliminated": without["external_calls"] - with_aliases["external_calls"],
+    }
+    if args.show_changes:
+        report["changes"] = {q: {"before": before[q], "after": after[q]} for q, _ in queries if before[q] != after[q]}
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,279 @@
+"""
+End-to-end load test: boots main:app under gunicorn (gthread, as in app.yaml)
+against benchmarks/stub_servers.py, drives a weighted request mix from a pool
+of client threads and writes per-endpoint latency percentiles and RPS to JSON.
+
+    python benchmarks/load_test.py --duration 30 --clients 32 --out run.json
+    python benchmarks/load_test.py --gemini-latency 1.5 --error-rate gemini=0.05 --out slow.json
+    python benchmarks/load_test.py --compare before.json after.json
+
+Nothing leaves the machine: USDA, API Ninjas and Gemini all resolve to the stub.
+429 (rate limits) and 503 (Gemini shed) are counted as "shed", not errors.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+import stub_servers  # noqa: E402
+
+FEL_FOODS = ["Ampalaya", "Kangkong", "Adobo (Pork)", "Tinola (Chicken)", "Sinigang (Pork)", "Rice (White cooked)",
+             "Pancit Canton", "Halo-Halo", "mango", "bread (pandesal)"]
+MISS_FOODS = ["quinoa salad", "greek yogurt", "almond butter", "kimchi fried rice", "beef pho", "avocado toast"]
+CHAT_MESSAGES = ["Is pork adobo healthy?", "How much protein is in chicken tinola?",
+                 "What should I eat to lose weight?", "Is brown rice better than white rice?",
+                 "How many calories in halo-halo?", "Suggest a low sodium Filipino breakfast"]
+FOOD_IMAGES = ["adobo.jpg", "bbq10.jpg", "photo.jpg", "porksisig3.jpg", "porksisig7.jpg"]
+
+DEFAULT_MIX = "nutrition_hit=40,nutrition_miss=15,recommendations=15,chat=20,describe_image=10"
+# Also available for --mix: parse_meal
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[idx]
+
+
+class Scenario:
+    """Builds one request of the mix; every call returns (endpoint, method, kwargs)."""
+
+    def __init__(self, rnd: random.Random, users: int):
+        self.rnd = rnd
+        self.users = users
+        self.images = []
+        for name in FOOD_IMAGES:
+            path = os.path.join(ROOT, "uploads", name)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    self.images.append((name, f.read()))
+
+    def _items(self, names):
+        return [{"foodName": self.rnd.choice(names), "grams": self.rnd.choice([80, 100, 150, 200])}
+                for _ in range(self.rnd.randint(1, 4))]
+
+    def nutrition_hit(self):
+        return "/get_nutritional_info", "POST", {"json": {"items": self._items(FEL_FOODS)}}
+
+    def nutrition_miss(self):
+        # A fresh suffix now and then defeats the external cache, like new foods in production
+        names = MISS_FOODS + [f"{self.rnd.choice(MISS_FOODS)} {uuid.uuid4().hex[:4]}"]
+        return "/get_nutritional_info", "POST", {"json": {"items": self._items(names)}}
+
+    def recommendations(self):
+        body = {"weight": self.rnd.uniform(45, 110), "height_cm": self.rnd.uniform(150, 190)}
+        if self.rnd.random() < 0.5:
+            body["max_results"] = 4
+        return "/get_food_recommendations", "POST", {"json": body}
+
+    def chat(self):
+        body = {"message": self.rnd.choice(CHAT_MESSAGES), "userId": f"load-{self.rnd.randrange(self.users)}"}
+        return "/api/chat", "POST", {"json": body}
+
+    def parse_meal(self):
+        parts = [f"{self.rnd.choice(['1', '2', 'half a', '1 cup', '200g'])} {self.rnd.choice(FEL_FOODS + MISS_FOODS)}"
+                 for _ in range(self.rnd.randint(1, 4))]
+        return "/parse_meal", "POST", {"json": {"text": ", ".join(parts)}}
+
+    def describe_image(self):
+        if not self.images:
+            return self.chat()
+        name, data = self.rnd.choice(self.images)
+        return "/describe_image", "POST", {"files": {"file": (name, data, "image/jpeg")}}
+
+
+def parse_mix(spec: str) -> list:
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if not hasattr(Scenario, name.strip()):
+            raise SystemExit(f"unknown scenario {name!r}")
+        mix.append((name.strip(), float(weight or 1)))
+    return mix
+
+
+def run_clients(base_url: str, mix: list, clients: int, duration: float, users: int, seed: int) -> dict:
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    samples = {name: [] for name in names}
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def worker(idx: int):
+        rnd = random.Random(seed + idx)
+        scenario = Scenario(rnd, users)
+        session = requests.Session()
+        local = []
+        while time.perf_counter() < stop_at:
+            name = rnd.choices(names, weights)[0]
+            path, method, kwargs = getattr(scenario, name)()
+            t0 = time.perf_counter()
+            try:
+                status = session.request(method, base_url + path, timeout=60, **kwargs).status_code
+            except requests.RequestException:
+                status = 0
+            local.append((name, time.perf_counter() - t0, status))
+        with lock:
+            for name, elapsed, status in local:
+                samples[name].append((elapsed, status))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    report = {}
+    for name, rows in samples.items():
+        ok = sorted(e for e, s in rows if 200 <= s < 400)
+        report[name] = summarize(ok, rows, wall)
+    report["_all"] = summarize(sorted(e for rows in samples.values() for e, s in rows if 200 <= s < 400),
+                               [row for rows in samples.values() for row in rows], wall)
+    return report
+
+
+def summarize(ok_latencies: list, rows: list, wall: float) -> dict:
+    shed = sum(1 for _, s in rows if s in (429, 503))
+    errors = sum(1 for _, s in rows if not 200 <= s < 400 and s not in (429, 503))
+    return {
+        "requests": len(rows),
+        "ok": len(ok_latencies),
+        "shed": shed,
+        "errors": errors,
+        "rps": round(len(rows) / wall, 2) if wall else 0.0,
+        "p50_ms": round(percentile(ok_latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(ok_latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(ok_latencies, 99) * 1000, 2),
+        "max_ms": round((ok_latencies[-1] if ok_latencies else 0.0) * 1000, 2),
+    }
+
+
+def wait_healthy(base_url: str, proc: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"gunicorn exited with {proc.returncode}")
+        try:
+            if requests.get(base_url + "/health", timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    raise SystemExit("app did not become healthy in time")
+
+
+def run(args) -> dict:
+    stub_port = free_port()
+    latency = {"usda": args.usda_latency, "ninjas": args.ninjas_latency, "gemini": args.gemini_latency}
+    config = stub_servers.StubConfig(latency, args.jitter, stub_servers.parse_service_map(args.error_rate), args.seed)
+    stub = stub_servers.start(stub_port, config)
+    stub_url = f"http://127.0.0.1:{stub_port}"
+
+    app_port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "USDA_URL": f"{stub_url}/fdc/v1/foods/search",
+        "NINJAS_URL": f"{stub_url}/v1/nutrition",
+        "USDA_API_KEY": "stub",
+        "API_NINJAS_KEY": "stub",
+        "GEMINI_SECRET_KEY": "stub",
+        "GEMINI_API_ENDPOINT": stub_url,
+        "LOG_LEVEL": env.get("LOG_LEVEL", "WARNING"),
+    })
+    for item in args.env or []:
+        key, _, value = item.partition("=")
+        env[key] = value
+    cmd = ["gunicorn", "-b", f"127.0.0.1:{app_port}", "--worker-class", "gthread",
+           "--threads", str(args.threads), "--workers", str(args.workers), "main:app"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                            stderr=None if args.verbose else subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{app_port}"
+    try:
+        wait_healthy(base_url, proc)
+        if args.warmup:
+            run_clients(base_url, parse_mix(args.mix), args.clients, args.warmup, args.users, args.seed + 10_000)
+        results = run_clients(base_url, parse_mix(args.mix), args.clients, args.duration, args.users, args.seed)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        stub.shutdown()
+
+    return {
+        "config": {
+            "duration_s": args.duration, "clients": args.clients, "workers": args.workers, "threads": args.threads,
+            "mix": args.mix, "users": args.users, "latency_s": latency, "jitter": args.jitter,
+            "error_rate": args.error_rate or [], "env": args.env or [], "seed": args.seed,
+        },
+        "stub_calls": dict(config.counts),
+        "endpoints": results,
+    }
+
+
+def compare(old_path: str, new_path: str) -> None:
+    with open(old_path) as f:
+        old = json.load(f)["endpoints"]
+    with open(new_path) as f:
+        new = json.load(f)["endpoints"]
+    print(f"{'endpoint':<18}{'metric':<8}{'old':>10}{'new':>10}{'change':>9}")
+    for name in sorted(set(old) | set(new)):
+        for metric in ("rps", "p50_ms", "p95_ms", "p99_ms", "errors"):
+            a = old.get(name, {}).get(metric, 0)
+            b = new.get(name, {}).get(metric, 0)
+            change = f"{(b - a) / a * 100:+.1f}%" if a else "n/a"
+            print(f"{name:<18}{metric:<8}{a:>10}{b:>10}{change:>9}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--duration", type=float, default=20)
+    ap.add_argument("--warmup", type=float, default=3)
+    ap.add_argument("--clients", type=int, default=16)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--users", type=int, default=500, help="distinct chat user ids")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="scenario=weight,...")
+    ap.add_argument("--usda-latency", type=float, default=0.08)
+    ap.add_argument("--ninjas-latency", type=float, default=0.06)
+    ap.add_argument("--gemini-latency", type=float, default=0.8)
+    ap.add_argument("--jitter", type=float, default=0.25)
+    ap.add_argument("--error-rate", action="append", help="service=fraction (usda, ninjas, gemini)")
+    ap.add_argument("--env", action="append", help="KEY=VALUE passed to the app")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--out", help="write the JSON report here as well as stdout")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    ap.add_argument("--verbose", action="store_true", help="show gunicorn stderr")
+    args = ap.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
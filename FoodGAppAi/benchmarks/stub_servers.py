@@ -0,0 +1,168 @@
+"""
+Local stand-ins for the external services main.py talks to, on one port:
+
+  GET  /fdc/v1/foods/search                USDA FoodData Central search
+  GET  /v1/nutrition                       API Ninjas nutrition
+  POST /v1beta/models/<model>:generateContent   Gemini REST (text and image)
+
+Responses are deterministic per query. Latency and error injection are set
+per service (usda / ninjas / gemini), e.g.
+
+    python benchmarks/stub_servers.py --port 8900 \\
+        --latency usda=0.08 --latency gemini=1.2 --jitter 0.3 --error-rate gemini=0.02
+
+Point the app at it with USDA_URL, NINJAS_URL and GEMINI_API_ENDPOINT.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DISHES = ["Pork Adobo - Meat", "Chicken Tinola - Soup", "Pancit Canton - Noodles", "Pork Sisig - Meat",
+          "Rice (White cooked) - Rice", "Halo-Halo - Dessert", "No food detected"]
+CHAT_REPLIES = [
+    "Adobo is tasty but salty, so pair it with lots of vegetables and a smaller cup of rice!",
+    "Try brown rice instead of white for more fiber - it keeps you full longer.",
+    "Grilled bangus is a great lean protein; go easy on the dipping sauce.",
+]
+
+
+def _seed(text: str) -> int:
+    return int(hashlib.sha256(text.encode("utf-8", "ignore")).hexdigest()[:8], 16)
+
+
+def usda_payload(query: str) -> dict:
+    rnd = random.Random(_seed(query))
+    nutrients = {
+        "Protein": rnd.uniform(1, 30), "Total lipid (fat)": rnd.uniform(0, 25),
+        "Carbohydrate, by difference": rnd.uniform(0, 60), "Sugars, total including NLEA": rnd.uniform(0, 20),
+        "Fiber, total dietary": rnd.uniform(0, 8), "Sodium, Na": rnd.uniform(0, 900),
+        "Vitamin C, total ascorbic acid": rnd.uniform(0, 40), "Calcium, Ca": rnd.uniform(0, 200),
+        "Iron, Fe": rnd.uniform(0, 5), "Potassium, K": rnd.uniform(0, 600), "Cholesterol": rnd.uniform(0, 90),
+    }
+    return {"foods": [{"description": query.upper(),
+                       "foodNutrients": [{"nutrientName": k, "value": round(v, 2)} for k, v in nutrients.items()]}]}
+
+
+def ninjas_payload(query: str) -> list:
+    rnd = random.Random(_seed(query))
+    return [{"name": query, "protein_g": round(rnd.uniform(1, 30), 1), "fat_total_g": round(rnd.uniform(0, 25), 1),
+             "carbohydrates_total_g": round(rnd.uniform(0, 60), 1), "sugar_g": round(rnd.uniform(0, 20), 1),
+             "fiber_g": round(rnd.uniform(0, 8), 1), "sodium_mg": round(rnd.uniform(0, 900)),
+             "potassium_mg": round(rnd.uniform(0, 600)), "cholesterol_mg": round(rnd.uniform(0, 90))}]
+
+
+def gemini_payload(body: dict) -> dict:
+    parts = [p for c in body.get("contents", []) for p in c.get("parts", [])]
+    prompt = " ".join(p.get("text", "") for p in parts if "text" in p)
+    images = [p for p in parts if "inlineData" in p or "inline_data" in p]
+    if images:
+        seeds = [_seed(json.dumps(p)[:256]) for p in images]
+        if "numbered" in prompt:
+            text = "\n".join(f"{i}. {DISHES[s % (len(DISHES) - 1)]}" for i, s in enumerate(seeds, 1))
+        elif "estimated edible grams" in prompt:
+            text = f"{DISHES[seeds[0] % (len(DISHES) - 1)]} - 150g\nRice (White cooked) - Rice - 160g"
+        else:
+            text = DISHES[seeds[0] % len(DISHES)]
+    elif "Condense" in prompt:
+        text = "User is tracking Filipino meals and wants lower-sodium options."
+    else:
+        text = CHAT_REPLIES[_seed(prompt) % len(CHAT_REPLIES)]
+    return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"},
+                            "finishReason": "STOP", "index": 0}],
+            "usageMetadata": {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(text) // 4}}
+
+
+class StubConfig:
+    def __init__(self, latency=None, jitter=0.0, error_rate=None, seed=1):
+        self.latency = latency or {}
+        self.jitter = jitter
+        self.error_rate = error_rate or {}
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def delay_and_fail(self, service: str) -> bool:
+        with self._lock:
+            self.counts[service] = self.counts.get(service, 0) + 1
+            base = self.latency.get(service, 0.0)
+            delay = max(0.0, base * (1 + self._rnd.uniform(-self.jitter, self.jitter)))
+            fail = self._rnd.random() < self.error_rate.get(service, 0.0)
+        if delay:
+            time.sleep(delay)
+        return fail
+
+
+def make_handler(config: StubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query).get("query", [""])[0]
+            if url.path.endswith("/foods/search"):
+                service, payload = "usda", usda_payload(query)
+            elif url.path.endswith("/nutrition"):
+                service, payload = "ninjas", ninjas_payload(re.sub(r"^\d+\s*g\s+", "", query))
+            elif url.path == "/stats":
+                return self._send(200, config.counts)
+            else:
+                return self._send(404, {"error": "not found"})
+            if config.delay_and_fail(service):
+                return self._send(500, {"error": "injected failure"})
+            self._send(200, payload)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if ":generateContent" not in self.path:
+                return self._send(404, {"error": "not found"})
+            if config.delay_and_fail("gemini"):
+                return self._send(503, {"error": {"code": 503, "message": "injected failure", "status": "UNAVAILABLE"}})
+            self._send(200, gemini_payload(body))
+
+    return Handler
+
+
+def parse_service_map(values) -> dict:
+    result = {}
+    for value in values or []:
+        service, _, number = value.partition("=")
+        result[service.strip()] = float(number)
+    return result
+
+
+def start(port: int, config: StubConfig) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8900)
+    ap.add_argument("--latency", action="append", help="service=seconds (usda, ninjas, gemini)")
+    ap.add_argument("--error-rate", action="append", help="service=fraction")
+    ap.add_argument("--jitter", type=float, default=0.25, help="+/- fraction applied to latency")
+    args = ap.parse_args()
+    cfg = StubConfig(parse_service_map(args.latency), args.jitter, parse_service_map(args.error_rate))
+    srv = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(cfg))
+    print(f"stub servers listening on http://127.0.0.1:{args.port}", flush=True)
+    srv.serve_forever()
@@ -0,0 +1,135 @@
+"""
+Build the offline USDA FoodData Central index used by lookup_usda.
+
+Takes the public FDC bulk downloads (https://fdc.nal.usda.gov/download-datasets):
+the JSON files (FoodData_Central_sr_legacy_food_json_*.json,
+FoodData_Central_foundation_food_json_*.json) or the CSV folders (food.csv,
+nutrient.csv, food_nutrient.csv), unzipped or as the .zip itself. Several
+sources can be combined in one index.
+
+    python fdc_import.py FoodData_Central_sr_legacy_food_json_2018-04.zip \\
+        FoodData_Central_foundation_food_csv_2024-10-31.zip --out fdc_index.db
+
+The index is written to a temporary file and swapped into place, so a
+running app keeps reading the old one until it restarts.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+import zipfile
+
+from fdc_index import FDC_NUTRIENTS, FDC_INDEX_DB, FdcIndex
+
+# data_type values in the CSV release and dataType values in the JSON release
+DEFAULT_DATA_TYPES = ("sr_legacy_food", "foundation_food", "SR Legacy", "Foundation")
+WANTED = set(FDC_NUTRIENTS)
+
+
+class Source:
+    """Uniform file access over a directory, a single file or a .zip archive."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.zip = zipfile.ZipFile(path) if zipfile.is_zipfile(path) else None
+        if self.zip:
+            self.names = self.zip.namelist()
+        elif os.path.isdir(path):
+            self.names = [os.path.relpath(os.path.join(d, f), path) for d, _, fs in os.walk(path) for f in fs]
+        else:
+            self.names = [os.path.basename(path)]
+
+    def find(self, basename: str):
+        for name in self.names:
+            if os.path.basename(name) == basename:
+                return name
+        return None
+
+    def open(self, name: str):
+        if self.zip:
+            return io.TextIOWrapper(self.zip.open(name), encoding="utf-8", newline="")
+        if os.path.isdir(self.path):
+            return open(os.path.join(self.path, name), encoding="utf-8", newline="")
+        return open(self.path, encoding="utf-8", newline="")
+
+
+def read_json(source: Source, data_types):
+    for name in source.names:
+        if not name.endswith(".json"):
+            continue
+        with source.open(name) as f:
+            payload = json.load(f)
+        foods = next((v for v in payload.values() if isinstance(v, list)), []) if isinstance(payload, dict) else payload
+        for food in foods:
+            if food.get("dataType") not in data_types:
+                continue
+            values = {}
+            for entry in food.get("foodNutrients", []):
+                nutrient_name = (entry.get("nutrient") or {}).get("name", "").lower()
+                if nutrient_name in WANTED and entry.get("amount") is not None:
+                    values[nutrient_name] = entry["amount"]
+            yield food["fdcId"], food.get("description", ""), food.get("dataType"), values
+
+
+def read_csv(source: Source, data_types):
+    names = {b: source.find(b) for b in ("food.csv", "nutrient.csv", "food_nutrient.csv")}
+    if None in names.values():
+        missing = [b for b, n in names.items() if n is None]
+        raise SystemExit(f"{source.path}: missing {', '.join(missing)}")
+
+    with source.open(names["nutrient.csv"]) as f:
+        nutrient_ids = {row["id"]: row["name"].lower() for row in csv.DictReader(f) if row["name"].lower() in WANTED}
+
+    foods = {}
+    with source.open(names["food.csv"]) as f:
+        for row in csv.DictReader(f):
+            if row["data_type"] in data_types:
+                foods[row["fdc_id"]] = (row["description"], row["data_type"], {})
+
+    # food_nutrient.csv is by far the largest file; stream it
+    with source.open(names["food_nutrient.csv"]) as f:
+        for row in csv.DictReader(f):
+            food = foods.get(row["fdc_id"])
+            nutrient_name = nutrient_ids.get(row["nutrient_id"])
+            if food is not None and nutrient_name and row["amount"]:
+                food[2][nutrient_name] = float(row["amount"])
+
+    for fdc_id, (description, data_type, values) in foods.items():
+        yield fdc_id, description, data_type, values
+
+
+def read_source(path: str, data_types):
+    source = Source(path)
+    if source.find("food_nutrient.csv"):
+        return read_csv(source, data_types)
+    return read_json(source, data_types)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("sources", nargs="+", help="FDC bulk download: .zip, .json or unzipped CSV folder")
+    ap.add_argument("--out", default=FDC_INDEX_DB)
+    ap.add_argument("--data-types", default=",".join(DEFAULT_DATA_TYPES),
+                    help="comma-separated FDC data types to keep")
+    args = ap.parse_args()
+
+    data_types = set(t.strip() for t in args.data_types.split(","))
+
+    def all_foods():
+        for path in args.sources:
+            yield from read_source(path, data_types)
+
+    tmp = f"{args.out}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    start = time.perf_counter()
+    count = FdcIndex.build(tmp, all_foods())
+    if not count:
+        os.remove(tmp)
+        sys.exit("No foods matched; check --data-types against the download")
+    os.replace(tmp, args.out)
+    print(f"Indexed {count} foods into {args.out} ({os.path.getsize(args.out) / 1e6:.1f} MB) "
+          f"in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,108 @@
+"""
+Offline USDA FoodData Central index shared by main.lookup_usda and
+fdc_import.py.
+
+Each food holds its per-100g FDC_NUTRIENTS vector as a packed float64 blob;
+descriptions are searchable through an FTS5 table. Kept free of app imports
+so the importer can build an index without starting the Flask app.
+"""
+import os
+import re
+import sqlite3
+import threading
+from array import array
+
+# USDA nutrient names (lowercased). Values are per 100g.
+USDA_MACRO_FIELDS = ("protein", "total lipid (fat)", "carbohydrate, by difference")
+USDA_SUGAR_FIELDS = (
+    "sugars, total including nlea",
+    "sugars, total",
+    "sugars, added",
+    "total sugars",
+    "sugar",
+    "sugars"
+)
+USDA_MICRO_MAP = {
+    "fiber, total dietary": ("Fiber", "g"),
+    "sodium, na": ("Sodium", "mg"),
+    "vitamin c, total ascorbic acid": ("Vit C", "mg"),
+    "vitamin a, rae": ("Vit A", "mcg"),
+    "calcium, ca": ("Calcium", "mg"),
+    "iron, fe": ("Iron", "mg"),
+    "potassium, k": ("Potassium", "mg"),
+    "cholesterol": ("Cholesterol", "mg")
+}
+FDC_NUTRIENTS = USDA_MACRO_FIELDS + USDA_SUGAR_FIELDS + tuple(USDA_MICRO_MAP)
+FDC_INDEX_DB = os.getenv("FDC_INDEX_DB", "fdc_index.db")
+# Same tokens as main.normalize_text
+TOKEN_SPLIT_RE = re.compile(r"[^\w\s]")
+
+
+def _number(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class FdcIndex:
+    """Read-only SQLite/FTS5 index over FDC descriptions and nutrient vectors."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            names = [r[0] for r in conn.execute("SELECT name FROM nutrients ORDER BY position")]
+            self.rows = conn.execute("SELECT COUNT(*) FROM foods").fetchone()[0]
+        if tuple(names) != FDC_NUTRIENTS:
+            raise ValueError(f"{path} was built for a different nutrient list; re-run fdc_import.py")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True,
+                                                      check_same_thread=False)
+        return conn
+
+    @staticmethod
+    def build(path: str, foods):
+        """Write an index from (fdc_id, description, data_type, {nutrient: per_100g}) tuples."""
+        conn = sqlite3.connect(path)
+        conn.executescript(
+            "CREATE TABLE nutrients (position INTEGER PRIMARY KEY, name TEXT);"
+            "CREATE TABLE foods (fdc_id INTEGER PRIMARY KEY, description TEXT, data_type TEXT, nutrients BLOB);"
+            "CREATE VIRTUAL TABLE foods_fts USING fts5(description, content='foods', content_rowid='fdc_id', "
+            "tokenize='porter unicode61');"
+        )
+        conn.executemany("INSERT INTO nutrients VALUES (?, ?)", enumerate(FDC_NUTRIENTS))
+        count = 0
+        for fdc_id, description, data_type, values in foods:
+            vector = array("d", (_number(values.get(n)) for n in FDC_NUTRIENTS))
+            conn.execute("INSERT OR REPLACE INTO foods VALUES (?, ?, ?, ?)",
+                         (int(fdc_id), description, data_type, vector.tobytes()))
+            count += 1
+        conn.execute("INSERT INTO foods_fts(foods_fts) VALUES ('rebuild')")
+        conn.commit()
+        conn.execute("VACUUM")
+        conn.close()
+        return count
+
+    def search(self, food_name: str):
+        """Best-ranked food whose description contains every query token, or None."""
+        tokens = TOKEN_SPLIT_RE.sub(" ", str(food_name or "").lower()).split()
+        if not tokens:
+            return None
+        query = " AND ".join(f'"{t}"' for t in tokens)
+        row = self._conn().execute(
+            "SELECT f.description, f.nutrients FROM foods_fts JOIN foods f ON f.fdc_id = foods_fts.rowid "
+            "WHERE foods_fts MATCH ? ORDER BY bm25(foods_fts) LIMIT 1",
+            (query,)
+        ).fetchone()
+        if row is None:
+            return None
+        vector = array("d")
+        vector.frombytes(row[1])
+        return row[0], dict(zip(FDC_NUTRIENTS, vector))
+
+    def stats(self) -> dict:
+        return {"path": self.path, "rows": self.rows}
@@ -1,36 +1,750 @@
+import io
 import os
+import sys
 import uuid
+import hashlib
+import tempfile
+import json
+import sqlite3
 import logging
-from datetime import datetime, timedelta
+import atexit
+import copy
+import itertools
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from datetime import datetime, timezone
 from functools import lru_cache
 import re
+import time
+import random
+import bisect
+import heapq
+import functools
+import contextvars
 import difflib
-from collections import defaultdict
+import threading
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 import google.generativeai as genai
+from cachetools import TTLCache
+import numpy as np
 import pandas as pd
 import requests
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, g, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from dotenv import load_dotenv
 import mimetypes
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from fdc_index import FDC_INDEX_DB, USDA_MICRO_MAP, USDA_SUGAR_FIELDS, FdcIndex
 
 load_dotenv()
 
 # -------------------------------------------------------------------
-# Chat system data structures
+# Logging
 # -------------------------------------------------------------------
-conversation_history = defaultdict(list)
-rate_limiter = defaultdict(list)
-daily_chat_limiter = defaultdict(lambda: {"date": None, "count": 0})
+# Records are queued by the calling thread and written by a background
+# QueueListener, so request threads never block on log I/O.
+#   LOG_FORMAT              json (default, one object per line) or text
+#   LOG_LEVEL               root level (INFO)
+#   LOG_LEVELS              per-logger overrides, e.g. "meal-backend.lookup=DEBUG,werkzeug=WARNING"
+#   LOG_LOOKUP_SAMPLE_RATE  fraction of sub-WARNING per-item lookup logs kept (0.1)
+#   LOG_ASYNC               0 writes synchronously from the caller (debugging)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "werkzeug=WARNING")
+LOG_LOOKUP_SAMPLE_RATE = float(os.getenv("LOG_LOOKUP_SAMPLE_RATE", "0.1"))
+LOG_ASYNC = os.getenv("LOG_ASYNC", "1") != "0"
+
+# Request-scoped trace state (see "Request tracing"); log records pick up the trace id
+_active_trace = contextvars.ContextVar("active_trace", default=None)
+_active_span = contextvars.ContextVar("active_span", default=None)
+
+_STANDARD_LOG_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record; extra={...} fields become top-level keys"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_LOG_ATTRS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SampleFilter(logging.Filter):
+    """Keep every WARNING+ record and one in round(1/rate) of the rest"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self._seen = itertools.count()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        return bool(self.every) and next(self._seen) % self.every == 0
+
+
+class RequestContextFilter(logging.Filter):
+    """Tag records with the active trace id (runs in the caller, before queueing)"""
+
+    def filter(self, record):
+        trace = _active_trace.get()
+        if trace is not None:
+            record.trace_id = trace.trace_id
+        return True
+
+
+class AsyncLogHandler(QueueHandler):
+    def prepare(self, record):
+        # Resolve the message now (args may change later) but keep the
+        # traceback separate so the sink formatter can structure it.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging():
+    if LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s :: %(message)s")
+    sink = logging.StreamHandler()
+    sink.setFormatter(formatter)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    if LOG_ASYNC:
+        log_queue = queue.SimpleQueue()
+        handler = AsyncLogHandler(log_queue)
+        listener = QueueListener(log_queue, sink, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+    else:
+        handler = sink
+    handler.addFilter(RequestContextFilter())
+    root.addHandler(handler)
+
+    for spec in filter(None, (part.strip() for part in LOG_LEVELS.split(","))):
+        name, _, level = spec.partition("=")
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+
+configure_logging()
+log = logging.getLogger("meal-backend")
+# High-frequency per-item lookup logs (sampled) and chat request logs
+lookup_log = logging.getLogger("meal-backend.lookup")
+lookup_log.addFilter(SampleFilter(LOG_LOOKUP_SAMPLE_RATE))
+chat_log = logging.getLogger("meal-backend.chat")
 
 # -------------------------------------------------------------------
-# Logging
+# Metrics (Prometheus text format on /metrics)
 # -------------------------------------------------------------------
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s %(name)s :: %(message)s"
-)
-log = logging.getLogger("meal-backend")
+# Hot paths only bump in-process counters/buckets; formatting happens when
+# /metrics is scraped. Values are per process (one series set per worker).
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label(name: str, value) -> str:
+    value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'{name}="{value}"'
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label: str):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, label_value, amount: float = 1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{{{_label(self.label, k)}}} {v}" for k, v in items)
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # label value -> [per-bucket counts (+Inf last), sum, count]
+
+    def observe(self, label_value, value: float):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._series.items())
+        for label_value, (counts, total, count) in items:
+            label = _label(self.label, label_value)
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{label}}} {count}")
+        return lines
+
+
+stage_seconds = Histogram("foodgapp_stage_seconds", "Latency of internal processing stages", "stage")
+request_seconds = Histogram("foodgapp_request_seconds", "HTTP request latency by endpoint", "endpoint")
+lookup_path_total = Counter("foodgapp_lookup_path_total", "unified_lookup results by LookupPath", "path")
+cache_events_total = Counter("foodgapp_cache_events_total", "Cache lookups by cache and outcome", "event")
+chat_route_total = Counter("foodgapp_chat_route_total", "Chat replies by how they were produced", "route")
+
+
+class observe_stage:
+    """
+    Context manager / decorator recording elapsed wall time under a stage name.
+    When the current request is being traced it also opens a span (with the
+    optional attrs) nested under whichever span is active.
+    """
+    __slots__ = ("stage", "attrs", "start", "span", "token")
+
+    def __init__(self, stage: str, attrs: dict = None):
+        self.stage = stage
+        self.attrs = attrs
+        self.span = None
+
+    def __enter__(self):
+        trace = _active_trace.get()
+        if trace is not None:
+            self.span = trace.start_span(self.stage, self.attrs)
+            self.token = _active_span.set(self.span)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        end = time.perf_counter()
+        stage_seconds.observe(self.stage, end - self.start)
+        if self.span is not None:
+            self.span.end = end
+            if exc_type is not None:
+                self.span.attrs["error"] = exc_type.__name__
+            _active_span.reset(self.token)
+        return False
+
+    def __call__(self, fn):
+        stage = self.stage
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with observe_stage(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+# -------------------------------------------------------------------
+# Request tracing (opt-in: ?trace=1 / ?trace=json or X-Debug-Trace header)
+# -------------------------------------------------------------------
+# A traced request collects a span tree from observe_stage plus point events
+# (cache hits). The response gets a Server-Timing header; trace=json also
+# embeds the spans in the JSON body. TRACE_EXPORT_FILE appends each trace as
+# one OTLP/JSON line for offline analysis.
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE")
+TRACE_MODES = ("1", "true", "json")  # any other value leaves tracing off
+SERVER_TIMING_UNSAFE = re.compile(r"[^\w.-]")
+trace_export_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "start", "end", "attrs")
+
+    def __init__(self, name: str, parent_id, attrs: dict = None):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+        self.end = None
+        self.attrs = dict(attrs) if attrs else {}
+
+
+class RequestTrace:
+    def __init__(self, name: str):
+        self.trace_id = uuid.uuid4().hex
+        self.start_ns = time.time_ns()
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self.spans = []
+        self.root = self.start_span(name, parent=None)
+
+    def start_span(self, name: str, attrs: dict = None, parent=False) -> Span:
+        if parent is False:
+            parent = _active_span.get() or self.root
+        span = Span(name, parent.span_id if parent is not None else None, attrs)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def finish(self):
+        self.root.end = time.perf_counter()
+        for span in self.spans:
+            if span.end is None:
+                span.end = self.root.end
+
+    def _ms(self, t: float) -> float:
+        return round((t - self.origin) * 1000, 3)
+
+    def server_timing(self) -> str:
+        totals = OrderedDict()
+        for span in self.spans[1:]:
+            dur, count = totals.get(span.name, (0.0, 0))
+            totals[span.name] = (dur + (span.end - span.start) * 1000, count + 1)
+        parts = [f'{SERVER_TIMING_UNSAFE.sub("_", name)};dur={dur:.2f};desc="x{count}"'
+                 for name, (dur, count) in totals.items()]
+        parts.append(f"total;dur={(self.root.end - self.root.start) * 1000:.2f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> dict:
+        return {
+            "traceId": self.trace_id,
+            "spans": [{
+                "name": s.name,
+                "spanId": s.span_id,
+                "parentSpanId": s.parent_id,
+                "startMs": self._ms(s.start),
+                "durationMs": round((s.end - s.start) * 1000, 3),
+                "attributes": s.attrs
+            } for s in self.spans]
+        }
+
+    def to_otlp(self) -> dict:
+        def unix_nano(t: float) -> str:
+            return str(self.start_ns + int((t - self.origin) * 1e9))
+
+        def attributes(attrs: dict) -> list:
+            return [{"key": k, "value": {"stringValue": str(v)}} for k, v in attrs.items()]
+
+        return {"resourceSpans": [{
+            "resource": {"attributes": attributes({"service.name": "foodgapp-ai"})},
+            "scopeSpans": [{
+                "scope": {"name": "meal-backend"},
+                "spans": [{
+                    "traceId": self.trace_id,
+                    "spanId": s.span_id,
+                    "parentSpanId": s.parent_id or "",
+                    "name": s.name,
+                    "kind": 2 if s.parent_id is None else 1,
+                    "startTimeUnixNano": unix_nano(s.start),
+                    "endTimeUnixNano": unix_nano(s.end),
+                    "attributes": attributes(s.attrs)
+                } for s in self.spans]
+            }]
+        }]}
+
+
+def trace_event(name: str, **attrs):
+    """Zero-duration span (e.g. a cache hit) on the active trace, if any"""
+    trace = _active_trace.get()
+    if trace is not None:
+        span = trace.start_span(name, attrs)
+        span.end = span.start
+
+
+def submit_in_context(executor, fn, *args):
+    """executor.submit that carries the caller's trace context into the worker thread"""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def export_trace(trace: RequestTrace):
+    if not TRACE_EXPORT_FILE:
+        return
+    line = json.dumps(trace.to_otlp(), separators=(",", ":"))
+    try:
+        with trace_export_lock, open(TRACE_EXPORT_FILE, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        log.warning("Trace export to %s failed: %s", TRACE_EXPORT_FILE, e)
+
+
+# -------------------------------------------------------------------
+# Chat system storage (conversation history, rate limits, daily limits)
+# -------------------------------------------------------------------
+# Chat state lives behind a small store interface so every gunicorn worker
+# and instance sees the same limits and history. CHAT_STORE_URL picks the
+# backend:
+#   memory://               per-process dicts (default, single worker only)
+#   sqlite:///path/to/db    shared by all workers on one host
+#   redis://host:6379/0     shared by all instances (production)
+# Counters use atomic increment-with-expiry so limits hold across workers
+# without any cross-process lock.
+CHAT_STORE_URL = os.getenv("CHAT_STORE_URL", "memory://")
+HISTORY_MAX_EXCHANGES = 10
+HISTORY_TTL_S = int(os.getenv("HISTORY_TTL_S", str(7 * 24 * 3600)))
+HISTORY_MAX_USERS = int(os.getenv("HISTORY_MAX_USERS", "10000"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+COUNTER_MAX_KEYS = int(os.getenv("COUNTER_MAX_KEYS", "100000"))
+STORE_SWEEP_EVERY = 4096
+
+
+class _RateWindow:
+    """Sliding-window-counter state: two counts instead of a list of timestamps."""
+    __slots__ = ("start", "prev", "curr")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.prev = 0
+        self.curr = 0
+
+
+class MemoryStore:
+    """In-process store; values expire lazily and are swept periodically."""
+
+    def __init__(self, max_rate_keys: int = RATE_LIMIT_MAX_KEYS, max_lists: int = HISTORY_MAX_USERS,
+                 max_counters: int = COUNTER_MAX_KEYS):
+        self._lock = threading.Lock()
+        self._counters = OrderedDict()  # key -> [value, expires_at], oldest first
+        self.max_counters = max_counters
+        # prefix ("history", "summary") -> {key -> [deque(maxlen), expires_at]}, least recently used first;
+        # max_lists applies per prefix so each kind of list holds that many users
+        self._lists = {}
+        self.max_lists = max_lists
+        self._windows = OrderedDict()  # key -> _RateWindow, least recently used first
+        self.max_rate_keys = max_rate_keys
+        self._ops = 0
+
+    def incr(self, key: str, ttl: int) -> int:
+        """Count a hit; when the table is full of live counters new keys are refused.
+
+        Counters hold limits such as the daily chat quota, so evicting a live
+        one would hand its user a fresh quota. A refused key reports
+        sys.maxsize, i.e. over any limit, until expired counters make room.
+        """
+        now = time.time()
+        with self._lock:
+            self._maybe_sweep(now)
+            entry = self._counters.get(key)
+            if entry is None or entry[1] <= now:
+                self._counters.pop(key, None)
+                # Keys are kept in creation order and share a TTL per use, so
+                # the expired ones are at the front
+                while len(self._counters) >= self.max_counters:
+                    oldest = next(iter(self._counters.values()))
+                    if oldest[1] > now:
+                        return sys.maxsize
+                    self._counters.popitem(last=False)
+                entry = self._counters[key] = [0, now + ttl]
+            entry[0] += 1
+            return entry[0]
+
+    def _maybe_sweep(self, now: float):
+        self._ops += 1
+        if self._ops % STORE_SWEEP_EVERY:
+            return
+        for table in (self._counters, *self._lists.values()):
+            for key in [k for k, v in table.items() if v[1] <= now]:
+                del table[key]
+
+    def _list_table(self, key: str) -> OrderedDict:
+        return self._lists.setdefault(key.split(":", 1)[0], OrderedDict())
+
+    def rate_hit(self, key: str, limit: int, window_s: float) -> bool:
+        """Sliding-window counter on monotonic time: O(1) per call and per key."""
+        now = time.monotonic()
+        with self._lock:
+            w = self._windows.get(key)
+            if w is None:
+                w = self._windows[key] = _RateWindow(now)
+            else:
+                self._windows.move_to_end(key)
+                elapsed = int((now - w.start) // window_s)
+                if elapsed:
+                    w.prev = w.curr if elapsed == 1 else 0
+                    w.curr = 0
+                    w.start += elapsed * window_s
+
+            weight = 1.0 - (now - w.start) / window_s
+            allowed = w.prev * weight + w.curr < limit
+            if allowed:
+                w.curr += 1
+
+            # Least recently used keys sit at the front: drop them once they are
+            # idle for two windows (their state would reset anyway) or when the
+            # table is over its cap.
+            while self._windows:
+                oldest = next(iter(self._windows.values()))
+                if len(self._windows) <= self.max_rate_keys and now - oldest.start < 2 * window_s:
+                    break
+                self._windows.popitem(last=False)
+            return allowed
+
+    def rate_reset(self, key: str, window_s: float):
+        with self._lock:
+            self._windows.pop(key, None)
+
+    def rate_size(self) -> int:
+        return len(self._windows)
+
+    def list_push(self, key: str, value: str, maxlen: int, ttl: int):
+        now = time.time()
+        with self._lock:
+            table = self._list_table(key)
+            entry = table.get(key)
+            if entry is None or entry[1] <= now or entry[0].maxlen != maxlen:
+                items = deque(entry[0] if entry and entry[1] > now else (), maxlen=maxlen)
+                entry = table[key] = [items, 0]
+            table.move_to_end(key)
+            entry[0].append(value)
+            entry[1] = now + ttl
+            while len(table) > self.max_lists:
+                table.popitem(last=False)
+
+    def list_range(self, key: str) -> list:
+        with self._lock:
+            table = self._list_table(key)
+            entry = table.get(key)
+            if entry is None or entry[1] <= time.time():
+                return []
+            table.move_to_end(key)
+            return list(entry[0])
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._counters.pop(key, None)
+                self._list_table(key).pop(key, None)
+
+
+class SharedCounterStore:
+    """Sliding-window rate limiting built from two atomic fixed-window counters.
+
+    Shared backends cannot use a process-local monotonic clock, so windows are
+    aligned to wall time; stale buckets are removed by their TTL.
+    """
+
+    def rate_hit(self, key: str, limit: int, window_s: float) -> bool:
+        now = time.time()
+        bucket = int(now // window_s)
+        curr = self.incr(f"{key}:{bucket}", int(2 * window_s))
+        prev = self.get_count(f"{key}:{bucket - 1}")
+        weight = 1.0 - (now % window_s) / window_s
+        if prev * weight + curr <= limit:
+            return True
+        # Denied hits are handed back so only allowed requests count, as in MemoryStore
+        self.decr(f"{key}:{bucket}", int(2 * window_s))
+        return False
+
+    def rate_reset(self, key: str, window_s: float):
+        bucket = int(time.time() // window_s)
+        self.delete(f"{key}:{bucket}", f"{key}:{bucket - 1}")
+
+
+class SqliteStore(SharedCounterStore):
+    """Store shared by every worker on one host through a SQLite file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._ops = itertools.count(1)
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value INTEGER, expires_at REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS lists (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "key TEXT, value TEXT, expires_at REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS lists_key ON lists (key, seq)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def incr(self, key: str, ttl: int) -> int:
+        now = time.time()
+        row = self._conn().execute(
+            "INSERT INTO counters (key, value, expires_at) VALUES (?, 1, ?) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            "value = CASE WHEN expires_at <= ? THEN 1 ELSE value + 1 END, "
+            "expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END "
+            "RETURNING value",
+            (key, now + ttl, now, now)
+        ).fetchone()
+        self._maybe_sweep(now)
+        return int(row[0])
+
+    def _maybe_sweep(self, now: float):
+        # incr and list_push only reset or trim the key they touch, so rows of
+        # keys that are never seen again (old rate buckets, past days) go here
+        if next(self._ops) % STORE_SWEEP_EVERY:
+            return
+        conn = self._conn()
+        conn.execute("DELETE FROM counters WHERE expires_at <= ?", (now,))
+        conn.execute("DELETE FROM lists WHERE expires_at <= ?", (now,))
+
+    def decr(self, key: str, ttl: int):
+        self._conn().execute("UPDATE counters SET value = value - 1 WHERE key = ? AND value > 0", (key,))
+
+    def get_count(self, key: str) -> int:
+        row = self._conn().execute(
+            "SELECT value FROM counters WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return int(row[0]) if row else 0
+
+    def list_push(self, key: str, value: str, maxlen: int, ttl: int):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM lists WHERE key = ? AND expires_at <= ?", (key, now))
+            conn.execute("INSERT INTO lists (key, value, expires_at) VALUES (?, ?, ?)", (key, value, now + ttl))
+            conn.execute("UPDATE lists SET expires_at = ? WHERE key = ?", (now + ttl, key))
+            conn.execute(
+                "DELETE FROM lists WHERE key = ? AND seq NOT IN "
+                "(SELECT seq FROM lists WHERE key = ? ORDER BY seq DESC LIMIT ?)",
+                (key, key, maxlen)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._maybe_sweep(now)
+
+    def list_range(self, key: str) -> list:
+        rows = self._conn().execute(
+            "SELECT value FROM lists WHERE key = ? AND expires_at > ? ORDER BY seq", (key, time.time())
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def delete(self, *keys: str):
+        conn = self._conn()
+        for key in keys:
+            conn.execute("DELETE FROM counters WHERE key = ?", (key,))
+            conn.execute("DELETE FROM lists WHERE key = ?", (key,))
+
+
+class RedisStore(SharedCounterStore):
+    """Store shared by every instance through Redis (or any Redis-protocol server)."""
+
+    def __init__(self, url: str):
+        import redis  # only needed when a redis:// store is configured
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def incr(self, key: str, ttl: int) -> int:
+        pipe = self.client.pipeline(transaction=True)
+        pipe.set(key, 0, ex=ttl, nx=True)
+        pipe.incr(key)
+        return int(pipe.execute()[1])
+
+    def decr(self, key: str, ttl: int):
+        # expire too, so a key that lapsed between incr and decr cannot linger at -1
+        pipe = self.client.pipeline(transaction=True)
+        pipe.decr(key)
+        pipe.expire(key, ttl)
+        pipe.execute()
+
+    def get_count(self, key: str) -> int:
+        return int(self.client.get(key) or 0)
+
+    def list_push(self, key: str, value: str, maxlen: int, ttl: int):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.rpush(key, value)
+        pipe.ltrim(key, -maxlen, -1)
+        pipe.expire(key, ttl)
+        pipe.execute()
+
+    def list_range(self, key: str) -> list:
+        return self.client.lrange(key, 0, -1)
+
+    def delete(self, *keys: str):
+        if keys:
+            self.client.delete(*keys)
+
+
+def create_chat_store(url: str):
+    if url.startswith("sqlite:///"):
+        return SqliteStore(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore(url)
+    if url not in ("", "memory://"):
+        log.error("Unknown CHAT_STORE_URL %s, falling back to in-memory store", url)
+    return MemoryStore()
+
+
+chat_store = create_chat_store(CHAT_STORE_URL)
+log.info("Chat store backend: %s", type(chat_store).__name__)
+
+
+class ChatExchange:
+    """One user/AI exchange; stored as a compact JSON array [epoch_s, user, ai]."""
+    __slots__ = ("ts", "user", "ai")
+
+    def __init__(self, ts: float, user: str, ai: str):
+        self.ts = ts
+        self.user = user
+        self.ai = ai
+
+    def encode(self) -> str:
+        return json.dumps([self.ts, self.user, self.ai], ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def decode(cls, raw: str) -> "ChatExchange":
+        data = json.loads(raw)
+        if isinstance(data, dict):  # entries written before the compact format
+            ts = datetime.fromisoformat(data.get("timestamp")).timestamp() if data.get("timestamp") else 0
+            return cls(ts, data.get("user", ""), data.get("ai", ""))
+        return cls(data[0], data[1], data[2])
+
+    def to_dict(self) -> dict:
+        return {
+            "user": self.user,
+            "ai": self.ai,
+            "timestamp": datetime.fromtimestamp(self.ts).isoformat()
+        }
+
+
+def get_conversation_history(user_id: str) -> list:
+    return [ChatExchange.decode(v) for v in chat_store.list_range(f"history:{user_id}")]
+
+
+def append_conversation_history(user_id: str, user_message: str, ai_message: str):
+    exchange = ChatExchange(round(time.time(), 3), user_message, ai_message)
+    chat_store.list_push(f"history:{user_id}", exchange.encode(), HISTORY_MAX_EXCHANGES, HISTORY_TTL_S)
+    return exchange
+
 
 gemini_key = os.getenv("GEMINI_SECRET_KEY")
 if not gemini_key:
@@ -42,7 +756,14 @@ else:
 # -------------------------------------------------------------------
 USDA_API_KEY = os.getenv("USDA_API_KEY")
 API_NINJAS_KEY = os.getenv("API_NINJAS_KEY")
-genai.configure(api_key=os.getenv("GEMINI_SECRET_KEY"))
+# GEMINI_API_ENDPOINT points the client at another Gemini REST endpoint
+# (e.g. the local stub used by benchmarks/load_test.py)
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+if GEMINI_API_ENDPOINT:
+    genai.configure(api_key=os.getenv("GEMINI_SECRET_KEY"), transport="rest",
+                    client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+else:
+    genai.configure(api_key=os.getenv("GEMINI_SECRET_KEY"))
 if not USDA_API_KEY:
     log.error("USDA_API_KEY not set (USDA lookup disabled)")
 if not API_NINJAS_KEY:
@@ -51,7 +772,34 @@ if not API_NINJAS_KEY:
 # -------------------------------------------------------------------
 # Flask
 # -------------------------------------------------------------------
+# Uploads: reject oversized bodies before reading them (413) and spool file
+# parts above UPLOAD_SPOOL_BYTES to a temp file instead of holding them in RAM.
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "10")) * 1024 * 1024)
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(256 * 1024)))
+
+
+class SpooledUploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, mode="w+b")
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    @staticmethod
+    def default(o):
+        # Micronutrient vectors keep their legacy string form in responses
+        if isinstance(o, MicroVector):
+            return o.to_json()
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        with observe_stage("json_serialize"):
+            return super().dumps(obj, **kwargs)
+
+
 app = Flask(__name__)
+app.request_class = SpooledUploadRequest
+app.json = TimedJSONProvider(app)
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
 CORS(app)
 
 DATA_FILE = os.getenv("FEL_CSV", "fel_data.csv")
@@ -60,105 +808,323 @@ DEFAULT_PORT = int(os.getenv("PORT", "5000"))
 # -------------------------------------------------------------------
 # URLs for external APIs
 # -------------------------------------------------------------------
-# Global rate limiter for API calls
-USDA_URL = "https://api.nal.usda.gov/fdc/v1/foods/search"
-NINJAS_URL = "https://api.api-ninjas.com/v1/nutrition"
+USDA_URL = os.getenv("USDA_URL", "https://api.nal.usda.gov/fdc/v1/foods/search")
+NINJAS_URL = os.getenv("NINJAS_URL", "https://api.api-ninjas.com/v1/nutrition")
+
+# -------------------------------------------------------------------
+# Gemini executor (bounded concurrency + per-call deadlines)
+# -------------------------------------------------------------------
+# Gemini calls run on a dedicated pool so slow LLM traffic can only ever hold
+# GEMINI_MAX_CONCURRENCY + GEMINI_MAX_QUEUE request threads; anything beyond
+# that is rejected quickly instead of starving /get_nutritional_info.
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "2"))
+GEMINI_MAX_QUEUE = int(os.getenv("GEMINI_MAX_QUEUE", "2"))
+GEMINI_QUEUE_WAIT_S = float(os.getenv("GEMINI_QUEUE_WAIT_S", "0.5"))
+GEMINI_TIMEOUT_S = float(os.getenv("GEMINI_TIMEOUT_S", "20"))
+
+gemini_executor = ThreadPoolExecutor(max_workers=GEMINI_MAX_CONCURRENCY, thread_name_prefix="gemini")
+gemini_slots = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENCY + GEMINI_MAX_QUEUE)
+gemini_stats_lock = threading.Lock()
+gemini_stats = {
+    "in_flight": 0,
+    "queued": 0,
+    "max_queue_depth": 0,
+    "completed": 0,
+    "failed": 0,
+    "timeouts": 0,
+    "rejected": 0
+}
+
+
+class GeminiUnavailable(Exception):
+    """Gemini pool is saturated; callers should answer 503."""
+    status_code = 503
+
+
+class GeminiTimeout(GeminiUnavailable):
+    """Gemini call missed its deadline; callers should answer 504."""
+    status_code = 504
+
+
+def _bump_gemini_stat(key: str, delta: int = 1):
+    with gemini_stats_lock:
+        gemini_stats[key] += delta
+        if key == "queued":
+            gemini_stats["max_queue_depth"] = max(gemini_stats["max_queue_depth"], gemini_stats["queued"])
+
+
+def _run_gemini(contents, deadline: float) -> str:
+    _bump_gemini_stat("queued", -1)
+    _bump_gemini_stat("in_flight")
+    try:
+        remaining = max(1.0, deadline - time.monotonic())
+        model = genai.GenerativeModel(GEMINI_MODEL)
+        response = model.generate_content(contents, request_options={"timeout": remaining})
+        return response.text
+    finally:
+        _bump_gemini_stat("in_flight", -1)
+
+
+@observe_stage("gemini")
+def call_gemini(contents, timeout: float = None) -> str:
+    """Run a Gemini generate_content call on the bounded pool and return its text"""
+    timeout = timeout or GEMINI_TIMEOUT_S
+    if not gemini_slots.acquire(timeout=GEMINI_QUEUE_WAIT_S):
+        _bump_gemini_stat("rejected")
+        raise GeminiUnavailable("Gemini is busy, please try again shortly")
+
+    _bump_gemini_stat("queued")
+    deadline = time.monotonic() + timeout
+    try:
+        future = gemini_executor.submit(_run_gemini, contents, deadline)
+    except Exception:
+        _bump_gemini_stat("queued", -1)
+        gemini_slots.release()
+        raise
+    # The slot is released only when the worker is really done, so abandoned
+    # (timed-out) calls still count against the concurrency cap.
+    future.add_done_callback(lambda _: gemini_slots.release())
+
+    try:
+        text = future.result(timeout=timeout)
+    except FuturesTimeout:
+        if future.cancel():
+            _bump_gemini_stat("queued", -1)
+        _bump_gemini_stat("timeouts")
+        raise GeminiTimeout(f"Gemini call exceeded {timeout:g}s deadline")
+    except Exception:
+        _bump_gemini_stat("failed")
+        raise
+
+    _bump_gemini_stat("completed")
+    return text
+
+
+def gemini_metrics() -> dict:
+    with gemini_stats_lock:
+        snapshot = dict(gemini_stats)
+    snapshot["max_concurrency"] = GEMINI_MAX_CONCURRENCY
+    snapshot["max_queue"] = GEMINI_MAX_QUEUE
+    return snapshot
 
 
 # -------------------------------------------------------------------
 # Chat helper functions
 # -------------------------------------------------------------------
+NUTRITION_KEYWORDS = [
+    # Food and nutrition
+    'food', 'foods', 'eat', 'eating', 'meal', 'meals', 'nutrition', 'nutritional',
+    'calories', 'calorie', 'protein', 'carbs', 'carbohydrates', 'fat', 'sugar',
+    'vitamin', 'mineral', 'fiber', 'sodium', 'cholesterol',
+
+    # Diet and health
+    'diet', 'dieting', 'healthy', 'health', 'weight', 'bmi', 'lose weight',
+    'gain weight', 'maintain weight', 'obesity', 'underweight', 'overweight',
+
+    # Exercise and fitness
+    'exercise', 'workout', 'fitness', 'gym', 'training', 'activity', 'burn calories',
+    'muscle', 'strength', 'cardio', 'running', 'walking', 'sports',
+
+    # Filipino food context
+    'rice', 'adobo', 'sinigang', 'lumpia', 'pancit', 'lechon', 'bangus',
+    'kangkong', 'ampalaya', 'mongo', 'pinakbet', 'taho', 'halo-halo',
+
+    # Meal planning
+    'breakfast', 'lunch', 'dinner', 'snack', 'recipe', 'cooking', 'ingredients',
+    'portion', 'serving', 'grams', 'cup', 'tablespoon',
+
+    # Health conditions
+    'diabetes', 'hypertension', 'cholesterol', 'heart', 'blood pressure',
+    'allergies', 'lactose', 'gluten',
+
+    # Common fruits and vegetables that should be recognized as health topics
+    'apple', 'banana', 'orange', 'mango', 'grapes', 'strawberry', 'pineapple',
+    'tomato', 'carrot', 'broccoli', 'spinach', 'lettuce', 'cabbage',
+
+    # Wellness and general health terms
+    'wellness', 'wellbeing', 'tips', 'advice', 'recommend', 'suggestion',
+    'good', 'best', 'better', 'should', 'can', 'how', 'what', 'why',
+    'example', 'about', 'help', 'guide'
+]
+
+
 def is_nutrition_fitness_topic(message: str) -> bool:
     """Check if the message is related to nutrition/fitness topics"""
-    nutrition_keywords = [
-        # Food and nutrition
-        'food', 'foods', 'eat', 'eating', 'meal', 'meals', 'nutrition', 'nutritional',
-        'calories', 'calorie', 'protein', 'carbs', 'carbohydrates', 'fat', 'sugar',
-        'vitamin', 'mineral', 'fiber', 'sodium', 'cholesterol',
-
-        # Diet and health
-        'diet', 'dieting', 'healthy', 'health', 'weight', 'bmi', 'lose weight',
-        'gain weight', 'maintain weight', 'obesity', 'underweight', 'overweight',
-
-        # Exercise and fitness
-        'exercise', 'workout', 'fitness', 'gym', 'training', 'activity', 'burn calories',
-        'muscle', 'strength', 'cardio', 'running', 'walking', 'sports',
-
-        # Filipino food context
-        'rice', 'adobo', 'sinigang', 'lumpia', 'pancit', 'lechon', 'bangus',
-        'kangkong', 'ampalaya', 'mongo', 'pinakbet', 'taho', 'halo-halo',
-
-        # Meal planning
-        'breakfast', 'lunch', 'dinner', 'snack', 'recipe', 'cooking', 'ingredients',
-        'portion', 'serving', 'grams', 'cup', 'tablespoon',
-
-        # Health conditions
-        'diabetes', 'hypertension', 'cholesterol', 'heart', 'blood pressure',
-        'allergies', 'lactose', 'gluten',
-
-        # Common fruits and vegetables that should be recognized as health topics
-        'apple', 'banana', 'orange', 'mango', 'grapes', 'strawberry', 'pineapple',
-        'tomato', 'carrot', 'broccoli', 'spinach', 'lettuce', 'cabbage',
-
-        # Wellness and general health terms
-        'wellness', 'wellbeing', 'tips', 'advice', 'recommend', 'suggestion',
-        'good', 'best', 'better', 'should', 'can', 'how', 'what', 'why',
-        'example', 'about', 'help', 'guide'
-    ]
-
     message_lower = message.lower()
-    return any(keyword in message_lower for keyword in nutrition_keywords)
+    return any(keyword in message_lower for keyword in NUTRITION_KEYWORDS)
 
 
 def check_rate_limit(user_id: str, max_requests: int = 10, window_minutes: int = 5) -> bool:
     """Check if user has exceeded rate limit"""
-    now = datetime.now()
-    cutoff = now - timedelta(minutes=window_minutes)
-
-    # Clean old requests
-    rate_limiter[user_id] = [req_time for req_time in rate_limiter[user_id] if req_time > cutoff]
-
-    # Check if under limit
-    if len(rate_limiter[user_id]) >= max_requests:
-        return False
-
-    # Add current request
-    rate_limiter[user_id].append(now)
-    return True
+    return chat_store.rate_hit(f"rate:{user_id}", max_requests, window_minutes * 60)
 
 
 def check_daily_chat_limit(user_id: str, max_daily_chats: int = 10) -> tuple[bool, int]:
     """Check if user has exceeded daily chat limit. Returns (can_chat, remaining_chats)"""
     today = datetime.now().date().isoformat()
-    user_data = daily_chat_limiter[user_id]
 
-    # Reset counter if new day
-    if user_data["date"] != today:
-        user_data["date"] = today
-        user_data["count"] = 0
+    # Keys are per-day, so a new day simply starts a fresh counter
+    count = chat_store.incr(f"daily:{user_id}:{today}", 2 * 24 * 3600)
+
+    can_chat = count <= max_daily_chats
+    remaining = max(0, max_daily_chats - count)
+    return can_chat, remaining
 
-    can_chat = user_data["count"] < max_daily_chats
 
-    if can_chat:
-        user_data["count"] += 1
-        remaining = max_daily_chats - user_data["count"]
+CHAT_CONTEXT_MAX_EXCHANGES = 5
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "600"))
+
+# Rolling summary: once more than CHAT_SUMMARY_TRIGGER raw exchanges are
+# waiting, all but the newest CHAT_SUMMARY_KEEP_RECENT are folded into a
+# stored summary, so each prompt carries one short summary plus a few turns.
+# CHAT_SUMMARY_MODE is "extractive" (local, default), "gemini" (background
+# LLM call, extractive on failure) or "off".
+CHAT_SUMMARY_MODE = os.getenv("CHAT_SUMMARY_MODE", "extractive").lower()
+CHAT_SUMMARY_TRIGGER = int(os.getenv("CHAT_SUMMARY_TRIGGER", "4"))
+CHAT_SUMMARY_KEEP_RECENT = int(os.getenv("CHAT_SUMMARY_KEEP_RECENT", "2"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "150"))
+
+summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-summary")
+summaries_in_progress = set()
+summaries_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+def build_chat_context(history: list, summary: str = "", token_budget: int = CHAT_CONTEXT_TOKEN_BUDGET) -> str:
+    """Summary plus a newest-first selection of past exchanges that fits within token_budget"""
+    turns = []
+    used = estimate_tokens(summary) if summary else 0
+    for exchange in reversed(history[-CHAT_CONTEXT_MAX_EXCHANGES:]):
+        turn = f"User: {exchange.user}\nAI: {exchange.ai}\n"
+        cost = estimate_tokens(turn)
+        if used + cost > token_budget:
+            break
+        turns.append(turn)
+        used += cost
+    if not turns and not summary:
+        return ""
+    turns.reverse()
+    parts = []
+    if summary:
+        parts.append(f"Summary of earlier conversation:\n{summary}\n\n")
+    if turns:
+        parts.append("Previous conversation:\n")
+        parts.extend(turns)
+    parts.append("\nCurrent question:\n")
+    return "".join(parts)
+
+
+def get_chat_summary(user_id: str) -> dict:
+    """Stored rolling summary: {"upto": epoch of last folded exchange, "text": ...}"""
+    # A one-item list keeps the summary under the same TTL/LRU bounds as history
+    stored = chat_store.list_range(f"summary:{user_id}")
+    return json.loads(stored[-1]) if stored else {"upto": 0, "text": ""}
+
+
+def set_chat_summary(user_id: str, upto: float, text: str):
+    chat_store.list_push(f"summary:{user_id}", json.dumps({"upto": upto, "text": text}), 1, HISTORY_TTL_S)
+
+
+def _split_sentences(text: str) -> list:
+    return [p.strip() for p in re.split(r"(?<=[.!?])\s+", text) if p.strip()]
+
+
+def extractive_summary(previous: str, exchanges: list, max_tokens: int = CHAT_SUMMARY_MAX_TOKENS) -> str:
+    """Keep the most nutrition-dense sentences (old summary + folded turns) within max_tokens"""
+    sentences = _split_sentences(previous)
+    for exchange in exchanges:
+        asked = _split_sentences(exchange.user)
+        answered = _split_sentences(exchange.ai)
+        if asked:
+            sentences.append(f"User asked: {asked[0]}")
+        if answered:
+            sentences.append(f"AI said: {answered[0]}")
+
+    def score(idx_sentence):
+        idx, sentence = idx_sentence
+        lower = sentence.lower()
+        hits = sum(1 for kw in NUTRITION_KEYWORDS if kw in lower)
+        numbers = len(re.findall(r"\d", lower))
+        return hits + min(numbers, 3) + idx / max(len(sentences), 1)  # prefer newer on ties
+
+    kept = []
+    seen = set()
+    used = 0
+    for idx, sentence in sorted(enumerate(sentences), key=score, reverse=True):
+        cost = estimate_tokens(sentence)
+        if sentence not in seen and used + cost <= max_tokens:
+            kept.append((idx, sentence))
+            seen.add(sentence)
+            used += cost
+    return " ".join(sentence for _, sentence in sorted(kept))
+
+
+def gemini_summary(previous: str, exchanges: list, max_tokens: int = CHAT_SUMMARY_MAX_TOKENS) -> str:
+    transcript = "".join(f"User: {e.user}\nAI: {e.ai}\n" for e in exchanges)
+    prompt = (
+        f"Condense this nutrition chat into at most {max_tokens * 3 // 4} words. Keep foods, amounts, "
+        "goals and health conditions the user mentioned. Plain sentences, no lists.\n\n"
+        f"Existing summary: {previous or '(none)'}\n\nNew turns:\n{transcript}"
+    )
+    text = call_gemini(prompt).strip()
+    # Never let a chatty model blow the budget
+    return text[:max_tokens * 4]
+
+
+def _fold_summary(user_id: str, previous: dict, exchanges: list):
+    try:
+        if CHAT_SUMMARY_MODE == "gemini":
+            try:
+                text = gemini_summary(previous["text"], exchanges)
+            except Exception as e:
+                log.warning("Gemini summary failed for %s, using extractive: %s", user_id, e)
+                text = extractive_summary(previous["text"], exchanges)
+        else:
+            text = extractive_summary(previous["text"], exchanges)
+        set_chat_summary(user_id, exchanges[-1].ts, text)
+    finally:
+        with summaries_lock:
+            summaries_in_progress.discard(user_id)
+
+
+def maybe_roll_summary(user_id: str, summary: dict, pending: list):
+    """Fold older unsummarized exchanges into the summary once they exceed the trigger"""
+    if CHAT_SUMMARY_MODE == "off" or len(pending) <= CHAT_SUMMARY_TRIGGER:
+        return
+    with summaries_lock:
+        if user_id in summaries_in_progress:
+            return
+        summaries_in_progress.add(user_id)
+    to_fold = pending[:-CHAT_SUMMARY_KEEP_RECENT] if CHAT_SUMMARY_KEEP_RECENT else pending
+    if CHAT_SUMMARY_MODE == "gemini":
+        summary_executor.submit(_fold_summary, user_id, summary, to_fold)
     else:
-        remaining = 0
+        _fold_summary(user_id, summary, to_fold)
 
-    return can_chat, remaining
+
+def record_chat_exchange(user_id: str, user_message: str, ai_message: str, summary: dict = None,
+                         pending: list = None):
+    """Append an exchange to history and roll the summary; summary/pending are re-read if not given"""
+    if summary is None:
+        summary = get_chat_summary(user_id)
+        pending = [e for e in get_conversation_history(user_id) if e.ts > summary["upto"]]
+    exchange = append_conversation_history(user_id, user_message, ai_message)
+    maybe_roll_summary(user_id, summary, pending + [exchange])
+    return exchange
 
 
 def get_ai_nutrition_response(message: str, user_id: str) -> str:
     """Get AI response for nutrition/fitness questions using Gemini"""
     try:
-        # Build context from conversation history
-        history = conversation_history[user_id][-5:]  # Last 5 exchanges
-        context = ""
-        if history:
-            context = "Previous conversation:\n"
-            for entry in history:
-                context += f"User: {entry['user']}\nAI: {entry['ai']}\n"
-            context += "\nCurrent question:\n"
+        # Build context from the rolling summary plus the turns it does not cover yet
+        summary = get_chat_summary(user_id)
+        pending = [e for e in get_conversation_history(user_id) if e.ts > summary["upto"]]
+        context = build_chat_context(pending, summary["text"])
 
         # Enhanced system prompt for Filipino nutrition focus
         system_prompt = """You're a friendly nutrition buddy! Talk like you're chatting with a friend about food and health. 
@@ -176,24 +1142,18 @@ Keep it real, keep it simple, keep it short, and always respond in English only!
 
         full_prompt = f"{system_prompt}\n\n{context}User: {message}\n\nAI:"
 
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        response = model.generate_content(full_prompt)
+        response_text = call_gemini(full_prompt)
 
-        # Store in conversation history
-        conversation_history[user_id].append({
-            'user': message,
-            'ai': response.text,
-            'timestamp': datetime.now().isoformat()
-        })
-
-        # Keep only last 10 exchanges per user
-        if len(conversation_history[user_id]) > 10:
-            conversation_history[user_id] = conversation_history[user_id][-10:]
+        # Store in conversation history (the store keeps only the last 10 exchanges)
+        record_chat_exchange(user_id, message, response_text, summary, pending)
 
-        return response.text.strip()
+        return response_text.strip()
 
+    except GeminiUnavailable as e:
+        log.warning("AI response skipped: %s", e)
+        return "Lots of people are asking questions right now! Please try again in a moment."
     except Exception as e:
-        log.error(f"AI response generation failed: {e}")
+        log.error("AI response generation failed: %s", e)
         return "I'm having trouble generating a response right now. Please try asking about specific Filipino foods, meal planning, or nutrition questions."
 
 
@@ -212,6 +1172,103 @@ def calculate_atwater_kcal(protein_g: float, fat_g: float, carbs_g: float) -> fl
     return round((safe_float(protein_g) * 4.0) + (safe_float(carbs_g) * 4.0) + (safe_float(fat_g) * 9.0), 2)
 
 
+# Fixed micronutrient layout shared by FEL, USDA and API Ninjas results
+MICRO_NUTRIENTS = (("Fiber", "g"), ("Sodium", "mg"), ("Vit C", "mg"), ("Vit A", "mcg"),
+                   ("Calcium", "mg"), ("Iron", "mg"), ("Potassium", "mg"), ("Cholesterol", "mg"))
+MICRO_INDEX = {name.lower(): i for i, (name, _) in enumerate(MICRO_NUTRIENTS)}
+MICRO_COLUMNS = [f"{name}({unit})" for name, unit in MICRO_NUTRIENTS]
+MICRO_RENDER_MIN = 0.1
+MICRO_TEXT_RE = re.compile(r"([A-Za-z][A-Za-z ]*?)\s*:\s*(-?\d+(?:\.\d+)?)")
+
+
+class MicroVector:
+    """
+    Micronutrient amounts in MICRO_NUTRIENTS order, held as one float64
+    numpy array in .values. Scaling and adding are single array operations;
+    the legacy "Fiber: 1.2g, Sodium: 300.0mg" text is only produced by
+    to_json(), i.e. when a response is serialized.
+    """
+    __slots__ = ("values",)
+
+    def __init__(self, values=None):
+        if values is None:
+            self.values = np.zeros(len(MICRO_NUTRIENTS))
+        else:
+            self.values = np.fromiter(values, np.float64, len(MICRO_NUTRIENTS))
+
+    @classmethod
+    def _wrap(cls, values: np.ndarray):
+        vector = cls.__new__(cls)
+        vector.values = values
+        return vector
+
+    def __reduce__(self):
+        return MicroVector, (self.values.tolist(),)
+
+    def __copy__(self):
+        return MicroVector._wrap(self.values.copy())
+
+    def __deepcopy__(self, memo):
+        return MicroVector._wrap(self.values.copy())
+
+    @classmethod
+    def from_named(cls, amounts: dict):
+        vector = cls()
+        for name, value in amounts.items():
+            idx = MICRO_INDEX.get(name.lower())
+            if idx is not None:
+                vector.values[idx] = max(0.0, safe_float(value, 0))
+        return vector
+
+    @classmethod
+    def parse(cls, text: str):
+        """Read the legacy string form (e.g. an FEL MicroNutrients column)."""
+        return cls.from_named({name.strip(): value for name, value in MICRO_TEXT_RE.findall(str(text or ""))})
+
+    def scaled(self, factor: float):
+        return MicroVector._wrap(self.values * factor)
+
+    def __add__(self, other):
+        return MicroVector._wrap(self.values + (other.values if isinstance(other, MicroVector) else other))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, idx):
+        return float(self.values[idx])
+
+    def __setitem__(self, idx, value):
+        self.values[idx] = value
+
+    def __iter__(self):
+        return iter(self.values.tolist())
+
+    def __eq__(self, other):
+        return isinstance(other, MicroVector) and np.array_equal(self.values, other.values)
+
+    __hash__ = None
+
+    def __bool__(self):
+        return bool((self.values >= MICRO_RENDER_MIN).any())
+
+    def as_dict(self) -> dict:
+        return {name: round(v, 2) for (name, _), v in zip(MICRO_NUTRIENTS, self.values.tolist())}
+
+    def to_json(self) -> str:
+        return ", ".join(f"{name}: {v:.1f}{unit}" for (name, unit), v in zip(MICRO_NUTRIENTS, self.values.tolist())
+                         if v >= MICRO_RENDER_MIN)
+
+    def __str__(self):
+        return self.to_json()
+
+    def __repr__(self):
+        return f"MicroVector({self.to_json()!r})"
+
+
+def micro_from_row(row) -> MicroVector:
+    return MicroVector(safe_float(row.get(col, 0), 0) for col in MICRO_COLUMNS)
+
+
 def normalize_text(s: str) -> str:
     if s is None:
         return ""
@@ -221,6 +1278,11 @@ def normalize_text(s: str) -> str:
     return s
 
 
+def category_family(category: str) -> str:
+    """FEL category without its grade: "Meat_HighFat" -> "meat", "Rice_A" -> "rice"."""
+    return str(category).split("_")[0].strip().lower()
+
+
 # -------------------------------------------------------------------
 # Load FEL dataset (normalize columns)
 # -------------------------------------------------------------------
@@ -261,7 +1323,11 @@ def load_dataset(path: str):
         df["FAT(g)"] = df[fat_col].apply(lambda v: safe_float(v, 0)) if fat_col else 0.0
         df["Energy(kcal)"] = df[energy_col].apply(lambda v: safe_float(v, 0)) if energy_col else 0.0
         df["Sugar(g)"] = df[sugar_col].apply(lambda v: safe_float(v, 0)) if sugar_col else 0.0
-        df["MicroNutrients"] = df[micronutrients_col].fillna("").astype(str) if micronutrients_col else ""
+        # Micronutrients become numeric per-nutrient columns (MICRO_COLUMNS)
+        micros = [MicroVector.parse(v) for v in df[micronutrients_col].fillna("")] if micronutrients_col else []
+        micro_table = np.vstack([m.values for m in micros]) if micros else None
+        for i, col in enumerate(MICRO_COLUMNS):
+            df[col] = micro_table[:, i] if micros else 0.0
 
         # Category
         cat_col = find_col(["foodcategoryid"])
@@ -278,7 +1344,55 @@ def load_dataset(path: str):
         return pd.DataFrame()
 
 
+# Alias table: CSV of alias,food pairs mapping Filipino/English synonyms
+# ("bitter gourd", "adobong manok") to a FEL FoodId.
+ALIAS_FILE = os.getenv("FEL_ALIASES_CSV", os.path.join(os.path.dirname(DATA_FILE), "fel_aliases.csv"))
+
+
+def load_aliases(path: str) -> dict:
+    """Normalized alias -> normalized FEL food name."""
+    if not path or not os.path.exists(path):
+        log.info("No FEL alias table at %s", path)
+        return {}
+    try:
+        df = pd.read_csv(path, dtype=str).fillna("")
+    except Exception as e:
+        log.exception("Failed to load FEL aliases: %s", e)
+        return {}
+    cols = {c.lower().strip(): c for c in df.columns}
+    if "alias" not in cols or "food" not in cols:
+        log.error("FEL alias table %s needs alias and food columns", path)
+        return {}
+    return {normalize_text(a): normalize_text(f) for a, f in zip(df[cols["alias"]], df[cols["food"]])
+            if normalize_text(a) and normalize_text(f)}
+
+
+def compile_exact_index(df, aliases: dict) -> dict:
+    """Exact-match hash map: normalized name or alias -> (row position, alias or None).
+
+    FEL names win over aliases, and the first row wins for duplicate names,
+    matching the row order the old boolean-mask lookup returned.
+    """
+    index = {}
+    if df is None or df.empty:
+        return index
+    for pos, food in enumerate(df["Food"]):
+        index.setdefault(food, (pos, None))
+    unknown = []
+    for alias, food in aliases.items():
+        target = index.get(food)
+        if target is None or target[1] is not None:
+            unknown.append(food)
+            continue
+        index.setdefault(alias, (target[0], alias))
+    if unknown:
+        log.warning("FEL aliases point at unknown foods: %s", ", ".join(sorted(set(unknown))))
+    return index
+
+
 fel = load_dataset(DATA_FILE)
+fel_aliases = load_aliases(ALIAS_FILE)
+fel_exact = compile_exact_index(fel, fel_aliases)
 
 
 # -------------------------------------------------------------------
@@ -289,7 +1403,7 @@ def lookup_fel(food: str):
     food_norm = normalize_text(food)
     match_row, lookup_path = fel_find_match(food_norm)
     if match_row is None:
-        log.warning("No FEL match found for %s", food_norm)
+        lookup_log.debug("No FEL match found for %s", food_norm)
         return None
     return {
         "Protein": float(match_row.get("PRO(g)", 0)),
@@ -298,13 +1412,15 @@ def lookup_fel(food: str):
         "Calories": float(match_row.get("Energy(kcal)", 0)),
         "Sugar": float(match_row.get("Sugar(g)", 0)),  # Add Sugar support
         "Portion": float(match_row.get("Portion(g)", 100)),
-        "MicroNutrients": str(match_row.get("MicroNutrients", "")),  # Add MicroNutrients support
+        "MicroNutrients": micro_from_row(match_row),
+        "Food": str(match_row.get("Food", food_norm)),
+        "Category": str(match_row.get("Category", "")),
         "lookup_path": lookup_path
     }
 
 
 # -------------------------------------------------------------------
-# FEL matching: exact -> token-set -> contains -> fuzzy
+# FEL matching: exact/alias -> token-set -> contains -> fuzzy
 # -------------------------------------------------------------------
 def fel_find_match(name: str):
     if fel is None or fel.empty or not name:
@@ -312,32 +1428,39 @@ def fel_find_match(name: str):
         return None, None
     q = normalize_text(name)
 
-    # Exact match
-    exact = fel[fel["Food"] == q]
-    if not exact.empty:
-        return exact.iloc[0], "FEL-exact"
+    # Exact match, including aliases
+    with observe_stage("fel_exact"):
+        exact = fel_exact.get(q)
+    if exact is not None:
+        pos, alias = exact
+        if alias:
+            lookup_log.debug("FEL alias %s -> %s", alias, fel["Food"].iloc[pos])
+        return fel.iloc[pos], "FEL-alias" if alias else "FEL-exact"
 
     # Token-set match
-    q_tokens = set(q.split())
-    for _, row in fel.iterrows():
-        toks = set(str(row["Food"]).split())
-        if q_tokens and (q_tokens.issubset(toks) or toks.issubset(q_tokens)):
-            return row, "FEL-tokenset"
+    with observe_stage("fel_tokenset"):
+        q_tokens = set(q.split())
+        for _, row in fel.iterrows():
+            toks = set(str(row["Food"]).split())
+            if q_tokens and (q_tokens.issubset(toks) or toks.issubset(q_tokens)):
+                return row, "FEL-tokenset"
 
     # Contains (substring)
-    contains = fel[fel["Food"].str.contains(q, na=False)]
+    with observe_stage("fel_contains"):
+        contains = fel[fel["Food"].str.contains(q, na=False)]
     if not contains.empty:
         return contains.iloc[0], "FEL-contains"
 
     # Fuzzy match
-    choices = fel["Food"].dropna().astype(str).unique().tolist()
-    close = difflib.get_close_matches(q, choices, n=1, cutoff=0.75)
+    with observe_stage("fel_fuzzy"):
+        choices = fel["Food"].dropna().astype(str).unique().tolist()
+        close = difflib.get_close_matches(q, choices, n=1, cutoff=0.75)
     if close:
         matched = fel[fel["Food"] == close[0]]
         if not matched.empty:
             return matched.iloc[0], "FEL-fuzzy"
 
-    log.warning("No match found for %s after all methods", q)
+    lookup_log.warning("No match found for %s after all methods", q)
     return None, None
 
 
@@ -352,7 +1475,11 @@ def cache_key(food_name: str, grams: float):
 
 
 def cached_return(food_name: str, grams: float):
-    return external_cache.get(cache_key(food_name, grams))
+    value = external_cache.get(cache_key(food_name, grams))
+    cache_events_total.inc("external_hit" if value else "external_miss")
+    if value:
+        trace_event("cache_hit", cache="external", food=food_name)
+    return value
 
 
 def store_cache(food_name: str, grams: float, value: dict):
@@ -360,7 +1487,7 @@ def store_cache(food_name: str, grams: float, value: dict):
 
 
 def normalize_external_item(food_name: str, grams: float, src: str, calories=0, protein=0, fat=0, carbs=0, sugar=0,
-                            micronutrients=""):
+                            micronutrients=None):
     return {
         "NutrientLogId": str(uuid.uuid4()),
         "FoodCategoryId": src,
@@ -370,21 +1497,103 @@ def normalize_external_item(food_name: str, grams: float, src: str, calories=0,
         "Fat": round(fat, 2),
         "Carbs": round(carbs, 2),
         "Sugar": round(sugar, 2),  # Add Sugar field
-        "MicroNutrients": micronutrients,  # Add MicroNutrients field
+        "MicroNutrients": micronutrients if micronutrients is not None else MicroVector(),
         "UserId": "Unknown",
         "FoodGramAmount": float(grams),
         "Source": src
     }
 
 
+def usda_item(food_name: str, grams: float, nutrients: dict, description: str = None):
+    """Scale a per-100g USDA nutrient dict (lowercased names) to grams."""
+    protein = safe_float(nutrients.get("protein", 0))
+    fat = safe_float(nutrients.get("total lipid (fat)", 0))
+    carbs = safe_float(nutrients.get("carbohydrate, by difference", 0))
+
+    # Enhanced sugar extraction with debugging
+    sugar = 0
+    for candidate in USDA_SUGAR_FIELDS:
+        sugar = safe_float(nutrients.get(candidate, 0))
+        if sugar > 0:
+            lookup_log.debug("Found sugar for %s using field '%s': %s", food_name, candidate, sugar)
+            break
+
+    # USDA values are per 100g, so we need to scale to requested grams
+    scale = grams / 100.0
+    lookup_log.debug("USDA scaling for %s: %s grams / 100g = %s factor", food_name, grams, scale)
+    lookup_log.debug("USDA raw values (per 100g): cal=%.2f prot=%.2f fat=%.2f carbs=%.2f sugar=%.2f",
+                     calculate_atwater_kcal(protein, fat, carbs), protein, fat, carbs, sugar)
+
+    micronutrients = MicroVector.from_named(
+        {friendly_name: nutrients.get(usda_name, 0) for usda_name, (friendly_name, _) in USDA_MICRO_MAP.items()}
+    ).scaled(scale)
+
+    calories = calculate_atwater_kcal(protein, fat, carbs)
+    scaled_values = {
+        "calories": calories * scale,
+        "protein": protein * scale,
+        "fat": fat * scale,
+        "carbs": carbs * scale,
+        "sugar": sugar * scale
+    }
+
+    lookup_log.debug("USDA scaled values for %sg: cal=%.2f prot=%.2f fat=%.2f carbs=%.2f sugar=%.2f",
+                     grams, scaled_values["calories"], scaled_values["protein"],
+                     scaled_values["fat"], scaled_values["carbs"], scaled_values["sugar"])
+
+    item = normalize_external_item(
+        food_name, grams, "USDA",
+        scaled_values["calories"], scaled_values["protein"], scaled_values["fat"],
+        scaled_values["carbs"], scaled_values["sugar"], micronutrients
+    )
+    if description:
+        item["Description"] = description  # canonical FDC name; not copied into unified_lookup results
+    return item
+
+
+# -------------------------------------------------------------------
+# Offline USDA FoodData Central index
+# -------------------------------------------------------------------
+# Built from the FDC bulk download by fdc_import.py (see fdc_index.py for
+# the format). lookup_usda resolves from here first and only calls the live
+# API for foods that aren't indexed.
+def open_fdc_index(path: str):
+    if not path or not os.path.exists(path):
+        log.info("No offline FDC index at %s; USDA lookups use the live API", path)
+        return None
+    try:
+        index = FdcIndex(path)
+    except (sqlite3.Error, ValueError) as e:
+        log.error("Ignoring offline FDC index %s: %s", path, e)
+        return None
+    log.info("Loaded offline FDC index %s rows=%d", path, index.rows)
+    return index
+
+
+fdc_index = open_fdc_index(FDC_INDEX_DB)
+
+
+@observe_stage("lookup_usda")
 def lookup_usda(food_name: str, grams: float):
+    if fdc_index is not None:
+        try:
+            hit = fdc_index.search(food_name)
+        except sqlite3.Error as e:
+            lookup_log.warning("FDC index search failed for %s: %s", food_name, e)
+            hit = None
+        cache_events_total.inc("fdc_index_hit" if hit else "fdc_index_miss")
+        if hit:
+            trace_event("cache_hit", cache="fdc_index", food=food_name)
+            lookup_log.debug("USDA (offline) found: %s for query: %s", hit[0], food_name)
+            return usda_item(food_name, grams, hit[1], hit[0])
+
     if not USDA_API_KEY:
         return None
     try:
         params = {"query": food_name, "api_key": USDA_API_KEY, "pageSize": 1}
         r = requests.get(USDA_URL, params=params, timeout=7)
         if r.status_code != 200:
-            log.warning("USDA lookup status %s for %s", r.status_code, food_name)
+            lookup_log.warning("USDA lookup status %s for %s", r.status_code, food_name)
             return None
         foods = r.json().get("foods", [])
         if not foods:
@@ -393,83 +1602,17 @@ def lookup_usda(food_name: str, grams: float):
 
         # Log the food description to see what we're getting
         food_desc = f.get("description", "Unknown")
-        log.info("USDA found: %s for query: %s", food_desc, food_name)
+        lookup_log.debug("USDA found: %s for query: %s", food_desc, food_name)
 
         nutrients = {n.get("nutrientName").lower(): n.get("value") for n in f.get("foodNutrients", []) if
                      "nutrientName" in n}
-
-        protein = safe_float(nutrients.get("protein", 0))
-        fat = safe_float(nutrients.get("total lipid (fat)", 0))
-        carbs = safe_float(nutrients.get("carbohydrate, by difference", 0))
-
-        # Enhanced sugar extraction with debugging
-        sugar = 0
-        sugar_candidates = [
-            "sugars, total including nlea",
-            "sugars, total",
-            "sugars, added",
-            "total sugars",
-            "sugar",
-            "sugars"
-        ]
-
-        for candidate in sugar_candidates:
-            sugar = safe_float(nutrients.get(candidate, 0))
-            if sugar > 0:
-                log.info("Found sugar for %s using field '%s': %s", food_name, candidate, sugar)
-                break
-
-        # USDA values are per 100g, so we need to scale to requested grams
-        scale = grams / 100.0
-        log.info("USDA scaling for %s: %s grams / 100g = %s factor", food_name, grams, scale)
-        log.info("USDA raw values (per 100g): cal=%.2f prot=%.2f fat=%.2f carbs=%.2f sugar=%.2f",
-                 calculate_atwater_kcal(protein, fat, carbs), protein, fat, carbs, sugar)
-
-        # Build micronutrients string with proper scaling
-        micronutrients_list = []
-        micro_map = {
-            "fiber, total dietary": ("Fiber", "g"),
-            "sodium, na": ("Sodium", "mg"),
-            "vitamin c, total ascorbic acid": ("Vit C", "mg"),
-            "vitamin a, rae": ("Vit A", "mcg"),
-            "calcium, ca": ("Calcium", "mg"),
-            "iron, fe": ("Iron", "mg"),
-            "potassium, k": ("Potassium", "mg"),
-            "cholesterol": ("Cholesterol", "mg")
-        }
-
-        for usda_name, (friendly_name, unit) in micro_map.items():
-            val = safe_float(nutrients.get(usda_name, 0))
-            if val > 0:
-                scaled_val = val * scale
-                if scaled_val >= 0.1:
-                    micronutrients_list.append(f"{friendly_name}: {scaled_val:.1f}{unit}")
-
-        micronutrients = ", ".join(micronutrients_list)
-
-        calories = calculate_atwater_kcal(protein, fat, carbs)
-        scaled_values = {
-            "calories": calories * scale,
-            "protein": protein * scale,
-            "fat": fat * scale,
-            "carbs": carbs * scale,
-            "sugar": sugar * scale
-        }
-
-        log.info("USDA scaled values for %sg: cal=%.2f prot=%.2f fat=%.2f carbs=%.2f sugar=%.2f",
-                 grams, scaled_values["calories"], scaled_values["protein"],
-                 scaled_values["fat"], scaled_values["carbs"], scaled_values["sugar"])
-
-        return normalize_external_item(
-            food_name, grams, "USDA",
-            scaled_values["calories"], scaled_values["protein"], scaled_values["fat"],
-            scaled_values["carbs"], scaled_values["sugar"], micronutrients
-        )
+        return usda_item(food_name, grams, nutrients, f.get("description"))
     except Exception as e:
-        log.warning("USDA lookup failed for %s: %s", food_name, e)
+        lookup_log.warning("USDA lookup failed for %s: %s", food_name, e)
         return None
 
 
+@observe_stage("lookup_api_ninjas")
 def lookup_api_ninjas(food_name: str, grams: float):
     if not API_NINJAS_KEY:
         return None
@@ -481,7 +1624,7 @@ def lookup_api_ninjas(food_name: str, grams: float):
             timeout=7
         )
         if r.status_code != 200:
-            log.warning("API Ninjas lookup status %s for %s", r.status_code, food_name)
+            lookup_log.warning("API Ninjas lookup status %s for %s", r.status_code, food_name)
             return None
         arr = r.json()
         if not arr:
@@ -493,29 +1636,23 @@ def lookup_api_ninjas(food_name: str, grams: float):
         sugar = safe_float(d.get("sugar_g"), 0)
 
         # FIXED: API Ninjas already returns values for the requested portion size, no additional scaling needed
-        micronutrients_list = []
-        micro_data = [
-            ("Fiber", d.get("fiber_g"), "g"),
-            ("Sodium", d.get("sodium_mg"), "mg"),
-            ("Potassium", d.get("potassium_mg"), "mg"),
-            ("Vit A", d.get("vitamin_a_mcg"), "mcg"),
-            ("Vit C", d.get("vitamin_c_mg"), "mg"),
-            ("Calcium", d.get("calcium_mg"), "mg"),
-            ("Iron", d.get("iron_mg"), "mg"),
-            ("Cholesterol", d.get("cholesterol_mg"), "mg")
-        ]
-        for name, val, unit in micro_data:
-            val = safe_float(val, 0)
-            if val > 0:
-                micronutrients_list.append(f"{name}: {val:.1f}{unit}")
-        micronutrients = ", ".join(micronutrients_list)
-        log.info("Micronutrients for %s (%sg): %s", food_name, grams, micronutrients)
+        micronutrients = MicroVector.from_named({
+            "Fiber": d.get("fiber_g"),
+            "Sodium": d.get("sodium_mg"),
+            "Potassium": d.get("potassium_mg"),
+            "Vit A": d.get("vitamin_a_mcg"),
+            "Vit C": d.get("vitamin_c_mg"),
+            "Calcium": d.get("calcium_mg"),
+            "Iron": d.get("iron_mg"),
+            "Cholesterol": d.get("cholesterol_mg")
+        })
+        lookup_log.debug("Micronutrients for %s (%sg): %s", food_name, grams, micronutrients)
 
         calories = calculate_atwater_kcal(protein, fat, carbs)
         return normalize_external_item(food_name, grams, "API_Ninjas", calories, protein, fat, carbs, sugar,
                                        micronutrients)
     except Exception as e:
-        log.warning("API Ninjas lookup failed for %s: %s", food_name, e)
+        lookup_log.warning("API Ninjas lookup failed for %s: %s", food_name, e)
         return None
 
 
@@ -528,7 +1665,7 @@ def external_fallback(food_name: str, grams: float):
         if item:
             store_cache(food_name, grams, item)
             return item
-    log.warning("No external data found for %s", food_name)
+    lookup_log.warning("No external data found for %s", food_name)
     empty = normalize_external_item(food_name, grams, "None", 0, 0, 0, 0)
     empty["Note"] = "No external data"
     store_cache(food_name, grams, empty)
@@ -538,21 +1675,25 @@ def external_fallback(food_name: str, grams: float):
 # -------------------------------------------------------------------
 # Unified lookup
 # -------------------------------------------------------------------
+@observe_stage("unified_lookup")
 def unified_lookup(food: str, grams: float):
     food_norm = normalize_text(food)
     sources = []
 
-    log.info("Unified lookup for '%s' (%sg edible portion)", food_norm, grams)
+    lookup_log.debug("Unified lookup for '%s' (%sg edible portion)", food_norm, grams)
 
     # 1. FEL lookup first (prioritize Philippine standards)
+    fel_hits = lookup_fel.cache_info().hits if _active_trace.get() is not None else None
     fel_data = lookup_fel(food_norm)
+    if fel_hits is not None and lookup_fel.cache_info().hits > fel_hits:
+        trace_event("cache_hit", cache="fel_lookup", food=food_norm)
     if fel_data and any([fel_data["Protein"], fel_data["Fat"], fel_data["Carbs"]]):
         sources.append(fel_data["lookup_path"])
         portion = fel_data.get("Portion", 100) or 100
 
         # FEL data is per 100g, scale to requested grams
         scale = grams / 100.0
-        log.info("FEL scaling for %s: %s grams / 100g FEL base = %s factor", food_norm, grams, scale)
+        lookup_log.debug("FEL scaling for %s: %s grams / 100g FEL base = %s factor", food_norm, grams, scale)
 
         base = {
             "Protein": round(fel_data["Protein"] * scale, 2),
@@ -560,15 +1701,15 @@ def unified_lookup(food: str, grams: float):
             "Carbs": round(fel_data["Carbs"] * scale, 2),
             "Calories": round(fel_data["Calories"] * scale, 2),
             "Sugar": round(fel_data["Sugar"] * scale, 2),
-            "MicroNutrients": fel_data["MicroNutrients"]
+            "MicroNutrients": fel_data["MicroNutrients"].scaled(scale)
         }
 
-        log.info("FEL scaled values for %sg: cal=%.2f prot=%.2f fat=%.2f carbs=%.2f",
-                 grams, base["Calories"], base["Protein"], base["Fat"], base["Carbs"])
+        lookup_log.debug("FEL scaled values for %sg: cal=%.2f prot=%.2f fat=%.2f carbs=%.2f",
+                         grams, base["Calories"], base["Protein"], base["Fat"], base["Carbs"])
 
         # If FEL doesn't have micronutrients, try external APIs
-        if not base["MicroNutrients"] or base["MicroNutrients"].strip() == "":
-            log.info("FEL missing micronutrients for %s, trying external APIs", food_norm)
+        if not base["MicroNutrients"]:
+            lookup_log.debug("FEL missing micronutrients for %s, trying external APIs", food_norm)
             usda_data = lookup_usda(food_norm, grams)
             if usda_data and usda_data.get("MicroNutrients"):
                 base["MicroNutrients"] = usda_data["MicroNutrients"]
@@ -580,7 +1721,7 @@ def unified_lookup(food: str, grams: float):
                     sources.append("Ninjas-micro")
 
     else:
-        log.info("No FEL match for %s, trying external APIs", food_norm)
+        lookup_log.debug("No FEL match for %s, trying external APIs", food_norm)
         # 2. USDA lookup as fallback
         usda_data = lookup_usda(food_norm, grams)
         if usda_data:
@@ -594,7 +1735,7 @@ def unified_lookup(food: str, grams: float):
                 base = nin_data
             else:
                 sources.append("None")
-                base = {"Protein": 0, "Fat": 0, "Carbs": 0, "Calories": 0, "Sugar": 0, "MicroNutrients": ""}
+                base = {"Protein": 0, "Fat": 0, "Carbs": 0, "Calories": 0, "Sugar": 0, "MicroNutrients": MicroVector()}
 
     # Ensure calories are calculated if missing
     if base["Calories"] <= 0:
@@ -616,10 +1757,20 @@ def unified_lookup(food: str, grams: float):
         "Source": "+".join(sources),
         "LookupPath": sources[0] if sources else "None"
     }
-
-    log.info("Final result for %s (%sg): cal=%.2f prot=%.2f fat=%.2f carbs=%.2f sugar=%.2f src=%s",
-             food_norm, grams, result["Calories"], result["Protein"], result["Fat"],
-             result["Carbs"], result["Sugar"], result["Source"])
+    lookup_path_total.inc(result["LookupPath"])
+    if fel_data and result["LookupPath"] == "FEL-alias":
+        food_index.record(food_norm)
+    elif fel_data and result["LookupPath"].startswith("FEL"):
+        food_index.record(fel_data["Food"])
+    elif result["LookupPath"] == "USDA" and base.get("Description"):
+        # Only the catalogue name is searchable, never the user's own wording
+        food_index.add(base["Description"], base["Description"], "external")
+        food_index.record(normalize_text(base["Description"]))
+
+    lookup_log.info("Final result for %s (%sg): cal=%.2f prot=%.2f fat=%.2f carbs=%.2f sugar=%.2f src=%s",
+                    food_norm, grams, result["Calories"], result["Protein"], result["Fat"],
+                    result["Carbs"], result["Sugar"], result["Source"],
+                    extra={"food": food_norm, "grams": grams, "lookup_path": result["LookupPath"]})
 
     return result
 
@@ -639,13 +1790,77 @@ def scale_row(row, grams=100.0):
         "Fat": round(safe_float(row.get("FAT(g)", 0)) * factor, 2),
         "Carbs": round(safe_float(row.get("CHO(g)", 0)) * factor, 2),
         "Sugar": round(safe_float(row.get("Sugar(g)", 0)) * factor, 2),  # Add Sugar scaling
-        "MicroNutrients": str(row.get("MicroNutrients", "")),  # Add MicroNutrients
+        "MicroNutrients": micro_from_row(row).scaled(factor),
         "UserId": "Unknown",
         "FoodGramAmount": grams,
         "Source": "FEL"
     }
 
 
+# -------------------------------------------------------------------
+# Request timing + /metrics
+# -------------------------------------------------------------------
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    mode = (request.args.get("trace") or request.headers.get("X-Debug-Trace") or "").strip().lower()
+    if mode in TRACE_MODES:
+        g.trace_mode = mode
+        g.trace = RequestTrace(f"{request.method} {request.path}")
+        g.trace_token = _active_trace.set(g.trace)
+
+
+@app.after_request
+def record_request_time(response):
+    start = g.get("request_start")
+    if start is not None:
+        request_seconds.observe(request.url_rule.rule if request.url_rule else "unmatched",
+                                time.perf_counter() - start)
+    trace = g.pop("trace", None)
+    if trace is not None:
+        _active_trace.reset(g.pop("trace_token"))
+        trace.finish()
+        response.headers["Server-Timing"] = trace.server_timing()
+        response.headers["X-Trace-Id"] = trace.trace_id
+        if g.get("trace_mode") == "json" and response.is_json:
+            body = response.get_json(silent=True)
+            if isinstance(body, dict):
+                body["trace"] = trace.to_dict()
+                response.set_data(app.json.dumps(body))
+        export_trace(trace)
+    return response
+
+
+def _gauge(name: str, help_text: str, samples: list) -> list:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    lines.extend(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}" for labels, value in samples)
+    return lines
+
+
+@app.route("/metrics")
+def metrics():
+    fel_cache = lookup_fel.cache_info()
+    img = image_cache.stats()
+    gem = gemini_metrics()
+    fel_lookups = fel_cache.hits + fel_cache.misses
+    lines = []
+    for metric in (stage_seconds, request_seconds, lookup_path_total, cache_events_total, chat_route_total):
+        lines.extend(metric.render())
+    lines.extend(_gauge("foodgapp_cache_hit_ratio", "Hit ratio per cache", [
+        ('cache="fel_lookup"', round(fel_cache.hits / fel_lookups, 4) if fel_lookups else 0),
+        ('cache="image"', img["hit_rate"]),
+    ]))
+    lines.extend(_gauge("foodgapp_cache_entries", "Entries held per cache", [
+        ('cache="fel_lookup"', fel_cache.currsize),
+        ('cache="external"', len(external_cache)),
+        ('cache="image"', img["entries"]),
+    ]))
+    lines.extend(_gauge("foodgapp_gemini_calls", "Gemini pool state and outcomes", [
+        (_label("state", key), value) for key, value in sorted(gem.items())
+    ]))
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
 # -------------------------------------------------------------------
 # Health
 # -------------------------------------------------------------------
@@ -657,15 +1872,28 @@ def health():
         "rows": int(len(fel)) if (fel is not None and not fel.empty) else 0,
         "external": {
             "usda": bool(USDA_API_KEY),
-            "api_ninjas": bool(API_NINJAS_KEY)
+            "api_ninjas": bool(API_NINJAS_KEY),
+            "usda_offline": fdc_index.stats() if fdc_index is not None else None
         },
-        "time": datetime.now(datetime.UTC).isoformat()
+        "gemini": gemini_metrics(),
+        "image_cache": image_cache.stats(),
+        "food_index": food_index.stats(),
+        "substitute_index": substitute_index.stats(),
+        "meal_pools": meal_pools.stats(),
+        "alert_windows": alert_engine.stats(),
+        "intake": intake_ledger.stats(),
+        "chat_routes": chat_route_stats(),
+        "time": datetime.now(timezone.utc).isoformat()
     })
 
 
 # -------------------------------------------------------------------
 # BMI helpers and recommendation endpoint
 # -------------------------------------------------------------------
+# Reasonable single-meal portion, used for sizing and for the meal pools
+MEAL_PORTION_RANGE_G = (50, 400)
+
+
 def bmi_category(bmi: float):
     if bmi < 18.5:
         return "Underweight", [5]
@@ -702,12 +1930,106 @@ def find_appropriate_portion(food_row, target_calories):
     target_grams = target_calories / calories_per_gram
 
     # Keep portions reasonable (50g - 400g)
-    target_grams = max(50, min(400, target_grams))
+    target_grams = max(MEAL_PORTION_RANGE_G[0], min(MEAL_PORTION_RANGE_G[1], target_grams))
     actual_calories = target_grams * calories_per_gram
 
     return round(target_grams, 1), round(actual_calories, 1)
 
 
+# Meal-type sampling pools: FEL row positions per meal type (by category
+# family), built once when the dataset loads, each with a Walker alias table
+# so a pick is O(1) whatever the table size. Foods whose portion for the
+# meal's calorie target fits MEAL_PORTION_RANGE_G are favoured, and foods
+# people actually look up get a boost (folded in every MEAL_POOL_REFRESH_S).
+MEAL_TYPE_FAMILIES = [
+    ("breakfast", ("rice", "bread", "egg", "milk", "fruit", "meat")),
+    ("lunch", ("rice", "meat", "seafood", "vegetable", "soup", "noodles", "fried")),
+    ("dinner", ("rice", "meat", "seafood", "vegetable", "soup", "noodles", "fried")),
+    ("snack", ("fruit", "dessert", "bread", "milk", "noodles", "fried")),
+]
+# Ingredients, never a meal on their own
+MEAL_EXCLUDED_FAMILIES = ("fat", "sugar")
+MEAL_POOL_REFRESH_S = float(os.getenv("MEAL_POOL_REFRESH_S", "300"))
+
+
+def build_alias_table(weights: list) -> tuple:
+    """Walker alias table (prob, alias) for O(1) weighted sampling."""
+    n = len(weights)
+    total = float(sum(weights))
+    scaled = [w * n / total for w in weights] if total > 0 else [1.0] * n
+    prob = [1.0] * n
+    alias = list(range(n))
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        lo, hi = small.pop(), large.pop()
+        prob[lo], alias[lo] = scaled[lo], hi
+        scaled[hi] -= 1.0 - scaled[lo]
+        (small if scaled[hi] < 1.0 else large).append(hi)
+    return prob, alias
+
+
+class MealPlanPools:
+    """Per-meal-type FEL row pools with weighted O(1) sampling."""
+
+    def __init__(self, df, targets: dict):
+        self.targets = targets
+        self.members = {}
+        self._tables = {}
+        self._lock = threading.Lock()
+        self._popularity = {}
+        self._refreshed_at = time.monotonic()
+        if df is None or df.empty:
+            return
+        self.foods = df["Food"].tolist()
+        portion = df["Portion(g)"].to_numpy(dtype=float)
+        self.kcal_per_g = df["Energy(kcal)"].to_numpy(dtype=float) / np.where(portion > 0, portion, 100.0)
+
+        families = [category_family(c) for c in df["Category"]]
+        usable = [pos for pos, family in enumerate(families) if family not in MEAL_EXCLUDED_FAMILIES]
+        usable = usable or list(range(len(df)))
+        for meal_type, allowed in MEAL_TYPE_FAMILIES:
+            # A table with other category names still gets a plan
+            self.members[meal_type] = [pos for pos in usable if families[pos] in allowed] or usable
+        self._tables = self._build({})
+
+    def _build(self, popularity: dict) -> dict:
+        tables = {}
+        lo, hi = MEAL_PORTION_RANGE_G
+        for meal_type, rows in self.members.items():
+            density = self.kcal_per_g[rows]
+            grams = np.divide(self.targets[meal_type], density, out=np.zeros_like(density), where=density > 0)
+            fit = np.where((grams >= lo) & (grams <= hi), 1.0, 0.2)
+            boost = 1.0 + np.log1p([popularity.get(self.foods[pos], 0) for pos in rows])
+            tables[meal_type] = (rows, *build_alias_table((fit * boost).tolist()))
+        return tables
+
+    def _maybe_refresh(self):
+        if time.monotonic() - self._refreshed_at < MEAL_POOL_REFRESH_S or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._refreshed_at = time.monotonic()
+            popularity = food_index.popularity()
+            if popularity != self._popularity:
+                self._popularity = popularity
+                self._tables = self._build(popularity)
+        finally:
+            self._lock.release()
+
+    def sample(self, meal_type: str, rnd=random) -> int:
+        """Row position in fel for one meal of meal_type."""
+        self._maybe_refresh()
+        rows, prob, alias = self._tables[meal_type]
+        i = rnd.randrange(len(rows))
+        return rows[i] if rnd.random() < prob[i] else rows[alias[i]]
+
+    def stats(self) -> dict:
+        return {meal_type: len(rows) for meal_type, rows in self.members.items()}
+
+
+meal_pools = MealPlanPools(fel, get_meal_calorie_targets())
+
+
 @app.route("/get_food_recommendations", methods=["POST"])
 def get_food_recommendations():
     if fel is None or fel.empty:
@@ -735,9 +2057,7 @@ def get_food_recommendations():
     bmi = round(weight / ((height_cm / 100) ** 2), 2)
     category, cat_ids = bmi_category(bmi)
 
-    # Use broader food selection for variety
-    pool = fel.copy()
-    if pool.empty:
+    if not meal_pools.members:
         return jsonify({"error": "No food data available"}), 500
 
     meal_targets = get_meal_calorie_targets()
@@ -754,8 +2074,8 @@ def get_food_recommendations():
         for meal_type in meal_types:
             target_calories = meal_targets[meal_type]
 
-            # Sample a random food from the pool
-            sampled_food = pool.sample(n=1).iloc[0]
+            # Weighted pick from the foods that suit this meal type
+            sampled_food = fel.iloc[meal_pools.sample(meal_type)]
             food_name = str(sampled_food.get("Food_raw", "unknown"))
 
             # Calculate appropriate portion for target calories
@@ -853,6 +2173,31 @@ def get_food_recommendations():
 # -------------------------------------------------------------------
 # Nutritional info endpoint
 # -------------------------------------------------------------------
+ALERT_CALORIES_KCAL = 800
+ALERT_FAT_G = 30
+
+
+def alert_reasons(item: dict) -> list:
+    """Which per-portion limits an item exceeds, as SUBSTITUTE_REASONS keys"""
+    reasons = []
+    if item["Calories"] > ALERT_CALORIES_KCAL:
+        reasons.append("calories")
+    if item["Fat"] > ALERT_FAT_G:
+        reasons.append("fat")
+    return reasons
+
+
+def nutrition_alerts(item: dict) -> list:
+    """Per-item realtime alerts for high values based on the edible portion"""
+    alerts = []
+    for reason in alert_reasons(item):
+        if reason == "calories":
+            alerts.append(f"High calories: {item['FoodId']} ({item['Calories']} kcal)")
+        else:
+            alerts.append(f"High fat: {item['FoodId']} ({item['Fat']}g)")
+    return alerts
+
+
 @app.route("/get_nutritional_info", methods=["POST"])
 def get_nutritional_info():
     data = request.get_json(silent=True) or {}
@@ -861,28 +2206,32 @@ def get_nutritional_info():
 
     results = []
     alerts = []
+    substitutes = {}
 
-    log.info("Incoming nutritional query items=%s", items)
+    log.info("Incoming nutritional query count=%d", len(items))
 
     for raw in items:
         name = str(raw.get("foodName", "unknown")).strip().lower()
         edible_grams = safe_float(raw.get("grams"), 100)  # This is already the edible portion
 
-        log.info("Processing %s with %s edible grams", name, edible_grams)
+        lookup_log.debug("Processing %s with %s edible grams", name, edible_grams)
 
         # Use edible grams directly for nutritional lookup
-        item = unified_lookup(name, edible_grams)
+        with observe_stage("item", {"food": name, "grams": edible_grams}):
+            item = unified_lookup(name, edible_grams)
         item["OriginalName"] = name
 
-        # Alerts for high values based on edible portion
-        if item["Calories"] > 800:
-            alerts.append(f"High calories: {item['FoodId']} ({item['Calories']} kcal)")
-        if item["Fat"] > 30:
-            alerts.append(f"High fat: {item['FoodId']} ({item['Fat']}g)")
+        # Alerts for high values based on edible portion, with lighter FEL options
+        alerts.extend(nutrition_alerts(item))
+        reasons = alert_reasons(item)
+        if reasons:
+            suggestion = suggest_substitutes(name, edible_grams, reasons, resolved=item)
+            if suggestion and suggestion["substitutes"]:
+                substitutes[name] = suggestion["substitutes"]
 
         results.append(item)
 
-        log.info(
+        lookup_log.debug(
             "Computed %s edible_grams=%.2f src=%s cal=%.2f prot=%.2f fat=%.2f carbs=%.2f sugar=%.2f",
             item["FoodId"],
             edible_grams,
@@ -901,6 +2250,15 @@ def get_nutritional_info():
     if alerts:
         response["realtime_alert"] = True
         response["alert_reason"] = alerts
+    if substitutes:
+        response["substitutes"] = substitutes
+    # "commit": true with a userId records the foods as eaten
+    user_id = str(data.get("userId") or "").strip()
+    if data.get("commit") and user_id and results:
+        committed = commit_intake(user_id, results, time.time())
+        response["intake"] = {"date": committed["date"], "today": committed["day"]}
+        if committed["alerts"]:
+            response["windowed_alerts"] = committed["alerts"]
     if include_sources:
         response["sources_used"] = {
             "USDA": bool(USDA_API_KEY),
@@ -910,17 +2268,481 @@ def get_nutritional_info():
     return jsonify(response)
 
 
+# -------------------------------------------------------------------
+# Healthier substitutes (nearest neighbours in the same food category)
+# -------------------------------------------------------------------
+# Per-100g FEL nutrients are z-scored once at startup and split into one k-d
+# tree per category family ("Meat_HighFat" and "Meat_LowFat" are both
+# "meat", so a fatty cut can be swapped for a lean one), plus one tree over
+# every row for foods that only resolved externally. A query descends a few
+# leaves instead of scanning and sorting the table; the "healthier" filter
+# (no more energy, fat or sugar, and strictly less of what raised the alert)
+# is applied to leaf rows during the search.
+SUBSTITUTE_FEATURES = ["Energy(kcal)", "PRO(g)", "FAT(g)", "CHO(g)", "Sugar(g)"]
+SUBSTITUTE_REASONS = {"calories": "Energy(kcal)", "fat": "FAT(g)", "sugar": "Sugar(g)"}
+SUBSTITUTE_CAPPED = [SUBSTITUTE_FEATURES.index(c) for c in SUBSTITUTE_REASONS.values()]
+SUBSTITUTE_LIMIT = int(os.getenv("SUBSTITUTE_LIMIT", "3"))
+KDTREE_LEAF_SIZE = 64
+
+
+class KDTree:
+    """Static k-d tree over the rows of a float matrix; leaves are scanned with numpy.
+
+    Every node keeps its bounding box, so a subtree is skipped when the box
+    is farther than the current k-th match or lies above the query ceiling.
+    """
+
+    def __init__(self, points, rows):
+        # points/rows are permuted in place into leaf order
+        self.points = points
+        self.rows = rows
+        self.nodes = []  # (split_dim, split_value, left, right, lo, hi); split_dim -1 for leaves
+        self.boxes = []  # (mins, maxs) per node, as float lists
+        if len(rows):
+            self._build(0, len(rows))
+
+    def _build(self, lo: int, hi: int) -> int:
+        node = len(self.nodes)
+        block = self.points[lo:hi]
+        mins, maxs = block.min(axis=0), block.max(axis=0)
+        self.nodes.append((-1, 0.0, -1, -1, lo, hi))
+        self.boxes.append((mins.tolist(), maxs.tolist()))
+        if hi - lo <= KDTREE_LEAF_SIZE:
+            return node
+        dim = int(np.argmax(maxs - mins))
+        mid = (hi - lo) // 2
+        order = np.argpartition(block[:, dim], mid)
+        self.points[lo:hi] = block[order]
+        self.rows[lo:hi] = self.rows[lo:hi][order]
+        split = float(self.points[lo + mid, dim])
+        left = self._build(lo, lo + mid)
+        right = self._build(lo + mid, hi)
+        self.nodes[node] = (dim, split, left, right, lo, hi)
+        return node
+
+    def query(self, x, k: int, upper=None, accept=None) -> list:
+        """Up to k (distance, row) pairs nearest to x, nearest first.
+
+        upper is an optional per-dimension ceiling (inf where unbounded);
+        accept(rows) returns a boolean mask of the leaf rows that may be returned.
+        """
+        best = []  # heap of (-squared distance, row): the worst kept match is on top
+        if self.nodes and k > 0:
+            self._search(0, [float(v) for v in x], np.asarray(x, dtype=float), k, upper, accept, best)
+        return [(float(np.sqrt(-d)), row) for d, row in sorted(best, reverse=True)]
+
+    def _search(self, node: int, x: list, xa, k: int, upper, accept, best: list):
+        mins, maxs = self.boxes[node]
+        if upper is not None and any(m > u for m, u in zip(mins, upper)):
+            return
+        if len(best) >= k:
+            gap = 0.0
+            for v, lo, hi in zip(x, mins, maxs):
+                if v < lo:
+                    gap += (lo - v) ** 2
+                elif v > hi:
+                    gap += (v - hi) ** 2
+            if gap >= -best[0][0]:
+                return
+        dim, split, left, right, lo, hi = self.nodes[node]
+        if dim < 0:
+            rows, points = self.rows[lo:hi], self.points[lo:hi]
+            if accept is not None:
+                keep = accept(rows)
+                rows, points = rows[keep], points[keep]
+            for d, row in zip(((points - xa) ** 2).sum(axis=1).tolist(), rows.tolist()):
+                if len(best) < k:
+                    heapq.heappush(best, (-d, row))
+                elif d < -best[0][0]:
+                    heapq.heapreplace(best, (-d, row))
+            return
+        near, far = (left, right) if x[dim] < split else (right, left)
+        self._search(near, x, xa, k, upper, accept, best)
+        self._search(far, x, xa, k, upper, accept, best)
+
+
+class SubstituteIndex:
+    """Per-category-family k-d trees over z-scored per-100g FEL nutrients."""
+
+    def __init__(self, df):
+        self.trees = {}
+        self.per100 = np.zeros((0, len(SUBSTITUTE_FEATURES)))
+        self.mean = np.zeros(len(SUBSTITUTE_FEATURES))
+        self.scale = np.ones(len(SUBSTITUTE_FEATURES))
+        if df is None or df.empty:
+            return
+        portion = df["Portion(g)"].to_numpy(dtype=float)
+        portion = np.where(portion > 0, portion, 100.0)
+        self.per100 = df[SUBSTITUTE_FEATURES].to_numpy(dtype=float) * (100.0 / portion)[:, None]
+        self.mean = self.per100.mean(axis=0)
+        std = self.per100.std(axis=0)
+        self.scale = np.where(std > 0, std, 1.0)
+        normalized = (self.per100 - self.mean) / self.scale
+
+        groups = {"": list(range(len(df)))}
+        for pos, category in enumerate(df["Category"]):
+            groups.setdefault(category_family(category), []).append(pos)
+        for family, positions in groups.items():
+            rows = np.array(positions)
+            self.trees[family] = KDTree(normalized[rows], rows)
+
+    def nearest(self, per100, family: str = "", reasons=("calories",), exclude: int = -1,
+                limit: int = SUBSTITUTE_LIMIT) -> list:
+        """(distance, row) of the closest rows that are lighter on every reason and no heavier elsewhere"""
+        tree = self.trees.get(family) or self.trees.get("")
+        if tree is None:
+            return []
+        per100 = np.asarray(per100, dtype=float)
+        targets = [SUBSTITUTE_FEATURES.index(SUBSTITUTE_REASONS[r]) for r in reasons]
+
+        def accept(rows):
+            values = self.per100[rows]
+            keep = (values[:, SUBSTITUTE_CAPPED] <= per100[SUBSTITUTE_CAPPED]).all(axis=1) & (rows != exclude)
+            for t in targets:
+                keep &= values[:, t] < per100[t]
+            return keep
+
+        upper = np.full(len(SUBSTITUTE_FEATURES), np.inf)
+        upper[SUBSTITUTE_CAPPED] = per100[SUBSTITUTE_CAPPED]
+        with observe_stage("substitute_search"):
+            return tree.query((per100 - self.mean) / self.scale, limit,
+                              ((upper - self.mean) / self.scale).tolist(), accept)
+
+    def stats(self) -> dict:
+        return {"rows": int(len(self.per100)), "families": len(self.trees) - 1 if self.trees else 0}
+
+
+substitute_index = SubstituteIndex(fel)
+
+
+def suggest_substitutes(food: str, grams: float, reasons=None, limit: int = SUBSTITUTE_LIMIT, resolved: dict = None):
+    """Closest lighter FEL foods for `food`, or None if it cannot be resolved.
+
+    FEL foods are compared within their category family; foods that only
+    resolve externally are compared against the whole table. `resolved` is
+    the caller's unified_lookup result for `food`, reused instead of a second
+    external lookup. Savings are for the same edible grams.
+    """
+    info = lookup_fel(food)
+    if info is not None:
+        factor = 100.0 / (info["Portion"] or 100.0)
+        per100 = [info["Calories"] * factor, info["Protein"] * factor, info["Fat"] * factor,
+                  info["Carbs"] * factor, info["Sugar"] * factor]
+        family = category_family(info["Category"])
+        exclude = fel_exact.get(info["Food"], (-1, None))[0]
+        base = {"FoodId": fel["Food_raw"].iloc[exclude] if exclude >= 0 else info["Food"],
+                "Category": info["Category"], "Source": "FEL"}
+    else:
+        item = resolved if resolved is not None else unified_lookup(food, 100.0)
+        if item.get("LookupPath") == "None":
+            return None
+        factor = 100.0 / (safe_float(item.get("FoodGramAmount"), 100) or 100.0)
+        per100 = [item[key] * factor for key in ("Calories", "Protein", "Fat", "Carbs", "Sugar")]
+        family, exclude = "", -1
+        base = {"FoodId": item["FoodId"], "Category": None, "Source": item["Source"]}
+    if reasons is None:
+        reasons = alert_reasons({"Calories": per100[0] * grams / 100.0, "Fat": per100[2] * grams / 100.0}) \
+            or ["calories"]
+
+    substitutes = []
+    for distance, row in substitute_index.nearest(per100, family, reasons, exclude, limit):
+        values = substitute_index.per100[row]
+        substitutes.append({
+            "FoodId": fel["Food_raw"].iloc[row],
+            "Category": fel["Category"].iloc[row],
+            "distance": round(distance, 3),
+            "per100g": {key: round(float(values[i]), 2)
+                        for i, key in enumerate(("Calories", "Protein", "Fat", "Carbs", "Sugar"))},
+            "saves": {key: round(float(per100[i] - values[i]) * grams / 100.0, 2)
+                      for i, key in ((0, "Calories"), (2, "Fat"), (4, "Sugar"))}
+        })
+    base["per100g"] = {key: round(float(per100[i]), 2)
+                       for i, key in enumerate(("Calories", "Protein", "Fat", "Carbs", "Sugar"))}
+    return {"food": base, "grams": grams, "reasons": list(reasons), "substitutes": substitutes}
+
+
+@app.route("/suggest_substitutes", methods=["GET", "POST"])
+def api_suggest_substitutes():
+    """Lighter FEL foods close to `food`. Query string or JSON: food, grams, reason, limit"""
+    params = request.args.to_dict()
+    params.update(request.get_json(silent=True) or {})
+    food = str(params.get("food") or params.get("foodName") or "").strip().lower()
+    if not food:
+        return jsonify({"error": "food is required"}), 400
+    grams = safe_float(params.get("grams"), 100)
+    try:
+        limit = max(1, min(10, int(params.get("limit", SUBSTITUTE_LIMIT))))
+    except (TypeError, ValueError):
+        return jsonify({"error": "limit must be an integer"}), 400
+    reasons = params.get("reason")
+    if reasons:
+        if isinstance(reasons, str):
+            reasons = reasons.split(",")
+        reasons = [str(r).strip().lower() for r in reasons if str(r).strip()]
+        unknown = [r for r in reasons if r not in SUBSTITUTE_REASONS]
+        if unknown:
+            return jsonify({"error": f"reason must be one of {', '.join(SUBSTITUTE_REASONS)}"}), 400
+
+    result = suggest_substitutes(food, grams, reasons or None, limit)
+    if result is None:
+        return jsonify({"error": f"No nutrition data found for {food}"}), 404
+    return jsonify(result)
+
+
+# -------------------------------------------------------------------
+# Food name search (typeahead)
+# -------------------------------------------------------------------
+# Sorted-array prefix index over every token suffix of the known names, so
+# "ado" finds both "adobo pork" and "pork adobo nutritionist". Names come
+# from FEL and from foods unified_lookup resolved externally. Results are
+# ranked by how often each name was resolved. Query results are cached per
+# snapshot; new names and popularity are folded in at most every
+# SEARCH_REFRESH_S seconds, so a keystroke is normally a dict hit. External
+# names are USDA catalogue descriptions only, capped at SEARCH_MAX_EXTERNAL
+# (least recently resolved dropped first).
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "10"))
+SEARCH_REFRESH_S = float(os.getenv("SEARCH_REFRESH_S", "30"))
+SEARCH_MAX_EXTERNAL = int(os.getenv("SEARCH_MAX_EXTERNAL", "5000"))
+SEARCH_SOURCE_RANK = {"FEL": 0, "alias": 1, "external": 2}
+
+
+class FoodNameIndex:
+    def __init__(self, refresh_s: float = SEARCH_REFRESH_S, max_external: int = SEARCH_MAX_EXTERNAL):
+        self.refresh_s = refresh_s
+        self.max_external = max_external
+        self._lock = threading.Lock()
+        self._names = {}  # normalized name -> (display name, source)
+        self._external = OrderedDict()  # external names, least recently resolved first
+        self._popularity = {}
+        self._names_dirty = self._pop_dirty = True
+        self._built_at = 0.0
+        # (sorted keys, target name per key, rank tuple per name, result cache); swapped as one
+        self._snapshot = ([], [], {}, {})
+
+    def add(self, name: str, display: str, source: str):
+        name = normalize_text(name)
+        if not name:
+            return
+        with self._lock:
+            current = self._names.get(name)
+            if current is None or SEARCH_SOURCE_RANK[source] < SEARCH_SOURCE_RANK[current[1]]:
+                self._names[name] = (display, source)
+                self._names_dirty = True
+            if self._names[name][1] != "external":
+                self._external.pop(name, None)
+                return
+            self._external[name] = None
+            self._external.move_to_end(name)
+            if len(self._external) > self.max_external:
+                oldest, _ = self._external.popitem(last=False)
+                del self._names[oldest]
+                self._popularity.pop(oldest, None)
+                self._names_dirty = True
+
+    def record(self, name: str):
+        with self._lock:
+            self._popularity[name] = self._popularity.get(name, 0) + 1
+            self._pop_dirty = True
+
+    def popularity(self) -> dict:
+        """Copy of normalized name -> times resolved."""
+        with self._lock:
+            return dict(self._popularity)
+
+    def _refresh(self):
+        with self._lock:
+            if not (self._names_dirty or self._pop_dirty):
+                return
+            if self._built_at and time.monotonic() - self._built_at < self.refresh_s:
+                return
+            names = dict(self._names)
+            popularity = dict(self._popularity)
+            resort = self._names_dirty
+            self._names_dirty = self._pop_dirty = False
+            self._built_at = time.monotonic()
+        keys, targets = self._snapshot[:2]
+        if resort:
+            pairs = sorted((" ".join(toks[i:]), name) for name in names
+                           for toks in [name.split()] for i in range(len(toks)))
+            keys = [k for k, _ in pairs]
+            targets = [n for _, n in pairs]
+        ranked = {name: (-popularity.get(name, 0), SEARCH_SOURCE_RANK[source], len(name), name, display, source)
+                  for name, (display, source) in names.items()}
+        self._snapshot = (keys, targets, ranked, {})
+
+    def search(self, query: str, limit: int = SEARCH_MAX_RESULTS) -> list:
+        self._refresh()
+        q = normalize_text(query)
+        if not q:
+            return []
+        keys, targets, ranked, cache = self._snapshot
+        hit = cache.get((q, limit))
+        if hit is not None:
+            return hit
+        lo = bisect.bisect_left(keys, q)
+        hi = bisect.bisect_left(keys, q + "\uffff", lo)
+        matched = set(targets[lo:hi])
+        # Names that start with the query rank ahead of mid-name matches
+        best = heapq.nsmallest(limit, (ranked[n] for n in matched),
+                               key=lambda r: (not r[3].startswith(q),) + r[:4])
+        results = [{"name": r[4], "food": r[3], "source": r[5], "popularity": -r[0]} for r in best]
+        if len(cache) < 10000:
+            cache[(q, limit)] = results
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            names, external = len(self._names), len(self._external)
+        keys, _, _, cache = self._snapshot
+        return {"names": names, "external": external, "keys": len(keys), "cached_queries": len(cache)}
+
+
+def build_food_index() -> FoodNameIndex:
+    index = FoodNameIndex()
+    if fel is not None and not fel.empty:
+        for food, display in zip(fel["Food"], fel["Food_raw"]):
+            index.add(food, display, "FEL")
+    for name, (_, alias) in fel_exact.items():
+        if alias:
+            index.add(name, name, "alias")
+    return index
+
+
+food_index = build_food_index()
+
+
+@app.route("/search_foods", methods=["GET"])
+def search_foods():
+    q = request.args.get("q", "")
+    try:
+        limit = max(1, min(50, int(request.args.get("limit", SEARCH_MAX_RESULTS))))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    return jsonify({"query": q, "results": food_index.search(q, limit)})
+
+
+# -------------------------------------------------------------------
+# Chat intent router: factual nutrient questions answered from lookups
+# -------------------------------------------------------------------
+# "how many calories in 200g adobo" is answered from unified_lookup with a
+# templated reply instead of a Gemini call. Anything that reads as advice or
+# opinion, names several foods, or doesn't resolve to real data goes to
+# Gemini as before.
+CHAT_LOCAL_ANSWERS = os.getenv("CHAT_LOCAL_ANSWERS", "1") != "0"
+
+CHAT_NUTRIENT_WORDS = {
+    "calorie": "Calories", "calories": "Calories", "kcal": "Calories", "cal": "Calories", "cals": "Calories",
+    "energy": "Calories", "protein": "Protein", "proteins": "Protein", "fat": "Fat", "fats": "Fat",
+    "carb": "Carbs", "carbs": "Carbs", "carbohydrate": "Carbs", "carbohydrates": "Carbs",
+    "sugar": "Sugar", "sugars": "Sugar",
+}
+CHAT_ALL_NUTRIENT_WORDS = {"nutrition", "nutritional", "nutrients", "nutrient", "macros", "macro"}
+CHAT_FACT_CUES = re.compile(r"^(?:how (?:many|much)|what(?: s| is| are)?|whats|tell me|give me|show me|"
+                            r"calories|protein|fat|carbs|sugar|nutrition|macros)\b")
+CHAT_OPEN_ENDED = {
+    "should", "healthy", "healthier", "unhealthy", "why", "better", "best", "worse", "worst", "recommend",
+    "lose", "gain", "diet", "vs", "versus", "compare", "good", "bad", "ok", "okay", "enough", "too", "need",
+    "daily", "day", "week", "burn", "if", "instead", "alternative", "substitute", "safe", "diabetic",
+}
+CHAT_GRAMS_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(kg|kilos?|kilograms?|g|gm|gms|grams?)\b")
+CHAT_FOOD_RE = re.compile(r"\b(?:in|of|for|does|do)\s+(?P<food>.+)$")
+CHAT_FOOD_FILLERS = re.compile(r"^(?:(?:a|an|the|one|my|some|serving|servings|piece|pieces|plate|bowl|of|is|are|"
+                               r"there|content|facts|info|information)\s+)+|"
+                               r"\s+(?:have|has|contain|contains|serving|please|pls|po)$")
+CHAT_SOURCE_NOTES = {"FEL": "Philippine FEL data", "USDA": "USDA data", "API_Ninjas": "API Ninjas data"}
+
+
+def parse_nutrient_question(message: str):
+    """Return (food, grams or None, [nutrient keys]) for a plain factual question, else None."""
+    text = re.sub(r"[^\w\s.]", " ", message.lower())
+    text = re.sub(r"(?<!\d)\.|\.(?!\d)", " ", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    words = text.split()
+    if not words or len(words) > 14 or not CHAT_FACT_CUES.match(text):
+        return None
+    if CHAT_OPEN_ENDED.intersection(words):
+        return None
+
+    nutrients = []
+    for word in words:
+        key = CHAT_NUTRIENT_WORDS.get(word)
+        if key and key not in nutrients:
+            nutrients.append(key)
+        elif word in CHAT_ALL_NUTRIENT_WORDS:
+            nutrients.extend(k for k in ("Calories", "Protein", "Fat", "Carbs") if k not in nutrients)
+    if not nutrients:
+        return None
+
+    grams = None
+    quantity = CHAT_GRAMS_RE.search(text)
+    if quantity:
+        grams = float(quantity.group(1)) * (1000.0 if quantity.group(2).startswith("k") else 1.0)
+        text = (text[:quantity.start()] + " " + text[quantity.end():]).strip()
+
+    match = None
+    for match in CHAT_FOOD_RE.finditer(text):
+        pass
+    if match is None:
+        return None
+    food = match.group("food")
+    for _ in range(3):
+        food = CHAT_FOOD_FILLERS.sub("", food).strip()
+    food_words = food.split()
+    if not food_words or any(w in CHAT_NUTRIENT_WORDS or w in CHAT_ALL_NUTRIENT_WORDS or w in ("and", "or", "with")
+                             for w in food_words):
+        return None
+    if grams is not None and not 0 < grams <= MAX_PORTION_GRAMS:
+        return None
+    return food, grams, nutrients
+
+
+def local_nutrition_answer(message: str):
+    """Templated reply for a factual nutrient question, or None to defer to Gemini."""
+    parsed = parse_nutrient_question(message)
+    if parsed is None:
+        return None
+    food, grams, nutrients = parsed
+    typical = grams is None
+    if typical:
+        match = lookup_fel(food)
+        grams = estimate_portion_grams(food, match["Category"] if match else "")
+    item = unified_lookup(food, grams)
+    path = item.get("LookupPath", "None")
+    # No data, or nothing for what was asked (FEL carries no sugar values): let Gemini answer
+    if path == "None" or not any(item[k] for k in nutrients):
+        return None
+
+    amounts = {"Calories": f"{item['Calories']:.0f} kcal", "Protein": f"{item['Protein']:.1f}g of protein",
+               "Fat": f"{item['Fat']:.1f}g of fat", "Carbs": f"{item['Carbs']:.1f}g of carbs",
+               "Sugar": f"{item['Sugar']:.1f}g of sugar"}
+    asked = [amounts[k] for k in nutrients]
+    listed = asked[0] if len(asked) == 1 else ", ".join(asked[:-1]) + " and " + asked[-1]
+    portion = f"A typical serving (about {grams:g}g) of {food}" if typical else f"{grams:g}g of {food}"
+    reply = f"{portion} has about {listed}."
+    if "Calories" not in nutrients:
+        reply += f" That's roughly {item['Calories']:.0f} kcal in total."
+    source = CHAT_SOURCE_NOTES.get(path.split("-")[0], "our food database")
+    reply += f" (Based on {source}.)"
+    return reply, item
+
+
+def chat_route_stats() -> dict:
+    routes = chat_route_total.snapshot()
+    answered = routes.get("local", 0) + routes.get("gemini", 0)
+    return {**routes, "local_fraction": round(routes.get("local", 0) / answered, 4) if answered else 0.0}
+
+
 # -------------------------------------------------------------------
 # Chat endpoint with topic filtering and AI responses
 # -------------------------------------------------------------------
 @app.route('/api/chat', methods=['POST'])
 def api_chat():
     """Chat endpoint with topic filtering, AI responses, and daily limits"""
-    log.info("🔥 CHAT REQUEST RECEIVED!")  # DEBUG: Check if requests reach backend
+    chat_log.debug("Chat request received")
     data = request.get_json(silent=True) or {}
     message = data.get('message', '').strip()
     user_id = data.get('userId', 'anonymous')
-    log.info(f"📨 Request data: message='{message}', userId='{user_id}'")
+    chat_log.debug("Chat request userId=%s message_chars=%d", user_id, len(message))
 
     if not message:
         return jsonify({
@@ -951,7 +2773,7 @@ def api_chat():
 
     # Topic validation
     is_on_topic = is_nutrition_fitness_topic(message)
-    log.info(f"Message: '{message}' | Topic check: {is_on_topic} | User: {user_id}")
+    chat_log.info("Chat topic check on_topic=%s user=%s", is_on_topic, user_id)
 
     if not is_on_topic:
         off_topic_responses = [
@@ -967,11 +2789,20 @@ def api_chat():
             "remainingChats": remaining,
             "timestamp": datetime.now().isoformat()
         }
+        chat_route_total.inc("off_topic")
         return jsonify(response)
 
     # Generate AI response for on-topic questions
     try:
-        ai_response = get_ai_nutrition_response(message, user_id)
+        local = local_nutrition_answer(message) if CHAT_LOCAL_ANSWERS else None
+        if local:
+            ai_response, item = local
+            record_chat_exchange(user_id, message, ai_response)
+            chat_route_total.inc("local")
+            chat_log.info("Chat answered locally user=%s path=%s", user_id, item["LookupPath"])
+        else:
+            ai_response = get_ai_nutrition_response(message, user_id)
+            chat_route_total.inc("gemini")
 
         response = {
             "response": ai_response,
@@ -979,6 +2810,11 @@ def api_chat():
             "remainingChats": remaining,
             "timestamp": datetime.now().isoformat()
         }
+        if local:
+            response["answeredLocally"] = True
+            response["nutrition"] = {k: local[1][k] for k in
+                                     ("FoodId", "FoodGramAmount", "Calories", "Protein", "Fat", "Carbs", "Sugar",
+                                      "LookupPath")}
 
         # Add helpful context for certain question types
         if any(word in message.lower() for word in ['calorie', 'nutrition', 'protein', 'carbs']):
@@ -1014,10 +2850,11 @@ def api_chat():
 @app.route('/api/chat/history/<user_id>', methods=['GET'])
 def get_chat_history(user_id):
     """Get conversation history for a user"""
-    history = conversation_history.get(user_id, [])
+    history = [exchange.to_dict() for exchange in get_conversation_history(user_id)]
     return jsonify({
         "userId": user_id,
         "history": history,
+        "summary": get_chat_summary(user_id)["text"],
         "totalExchanges": len(history)
     })
 
@@ -1025,10 +2862,8 @@ def get_chat_history(user_id):
 @app.route('/api/chat/clear/<user_id>', methods=['DELETE'])
 def clear_chat_history(user_id):
     """Clear conversation history for a user"""
-    if user_id in conversation_history:
-        del conversation_history[user_id]
-    if user_id in rate_limiter:
-        del rate_limiter[user_id]
+    chat_store.delete(f"history:{user_id}", f"summary:{user_id}")
+    chat_store.rate_reset(f"rate:{user_id}", 5 * 60)
 
     return jsonify({
         "message": f"Chat history cleared for user {user_id}",
@@ -1036,6 +2871,253 @@ def clear_chat_history(user_id):
     })
 
 
+# -------------------------------------------------------------------
+# Image preprocessing (before anything is sent to Gemini)
+# -------------------------------------------------------------------
+IMAGE_MAX_DIM = int(os.getenv("IMAGE_MAX_DIM", "1024"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "80"))
+
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+
+def sniff_image_mime(data: bytes):
+    """Detect the real image type from magic bytes (clients often mislabel uploads)"""
+    for signature, mime in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:8] == b"ftyp" and data[8:12] in (b"heic", b"heix", b"mif1", b"msf1"):
+        return "image/heic"
+    return None
+
+
+def as_seekable_stream(source):
+    """Accept raw bytes or a seekable binary stream (e.g. a spooled upload)"""
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    source.seek(0)
+    return source
+
+
+def sha256_stream(stream, chunk_size: int = 64 * 1024) -> str:
+    stream.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def preprocess_image(source):
+    """
+    Downscale to IMAGE_MAX_DIM, drop EXIF/metadata and re-encode as JPEG.
+    source is bytes or a seekable stream; Pillow decodes straight from it so
+    a spooled upload is never copied into memory whole. Returns
+    (bytes, mime_type). Formats Pillow cannot decode (e.g. HEIC) are passed
+    through untouched with their sniffed type; raises ValueError if the bytes
+    are not a recognizable image at all or exceed Image.MAX_IMAGE_PIXELS.
+    """
+    stream = as_seekable_stream(source)
+    mime = sniff_image_mime(stream.read(16))
+    raw_size = stream.seek(0, io.SEEK_END)
+    stream.seek(0)
+    try:
+        with Image.open(stream) as img:
+            # Let the JPEG decoder downscale by DCT scaling; much cheaper than a full decode
+            img.draft("RGB", (IMAGE_MAX_DIM, IMAGE_MAX_DIM))
+            # Shrink in place first so the orientation fix copies the small image
+            img.thumbnail((IMAGE_MAX_DIM, IMAGE_MAX_DIM), Image.LANCZOS)
+            img = ImageOps.exif_transpose(img)  # keep orientation once EXIF is gone
+            if img.mode in ("RGBA", "LA", "P"):
+                rgba = img.convert("RGBA")
+                img = Image.new("RGB", rgba.size, (255, 255, 255))
+                img.paste(rgba, mask=rgba.getchannel("A"))
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+            out = io.BytesIO()
+            img.save(out, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    except Image.DecompressionBombError as e:
+        # Not an OSError; never pass a pixel bomb through to the model
+        raise ValueError("Image has too many pixels") from e
+    except (UnidentifiedImageError, OSError) as e:
+        if mime:
+            log.warning("Could not re-encode %s upload, sending as-is: %s", mime, e)
+            stream.seek(0)
+            return stream.read(), mime
+        raise ValueError("Unsupported or corrupt image") from e
+
+    processed = out.getvalue()
+    log.debug("Preprocessed image %s %d bytes -> image/jpeg %d bytes", mime, raw_size, len(processed))
+    return processed, "image/jpeg"
+
+
+# -------------------------------------------------------------------
+# Image description cache (content hash -> "Food Name - Category")
+# -------------------------------------------------------------------
+# Retries and re-uploads of the same photo never reach Gemini twice. Raw
+# upload bytes are hashed first so an identical retry skips preprocessing;
+# on a miss the normalized (preprocessed) bytes are hashed too, which also
+# catches the same photo re-sent with different metadata. IMAGE_CACHE_KEY=dhash
+# keys the second level on a 64-bit perceptual hash instead, so recompressed
+# or resized copies match as well. IMAGE_CACHE_DB persists entries in SQLite.
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", "2048"))
+IMAGE_CACHE_TTL_S = int(os.getenv("IMAGE_CACHE_TTL_S", str(30 * 24 * 3600)))
+IMAGE_CACHE_KEY = os.getenv("IMAGE_CACHE_KEY", "sha256").lower()
+IMAGE_CACHE_DB = os.getenv("IMAGE_CACHE_DB")
+
+DESCRIBE_IMAGE_PROMPT = (
+    "Identify the food in this image. Respond only in the format: Food Name - Category. "
+    "If it is not food, respond: No food detected."
+)
+
+
+class ImageDescriptionCache:
+    """Bounded TTL/LRU cache with optional SQLite write-through and hit-rate stats."""
+
+    def __init__(self, max_entries: int, ttl: int, path: str = None):
+        self._lock = threading.Lock()
+        self._memory = TTLCache(maxsize=max_entries, ttl=ttl)
+        self.ttl = ttl
+        self.path = path
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        if path:
+            self._conn().execute("CREATE TABLE IF NOT EXISTS image_descriptions "
+                                 "(key TEXT PRIMARY KEY, description TEXT, created_at REAL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        return conn
+
+    def get(self, key: str):
+        with self._lock:
+            value = self._memory.get(key)
+        if value is None and self.path:
+            row = self._conn().execute(
+                "SELECT description FROM image_descriptions WHERE key = ? AND created_at > ?",
+                (key, time.time() - self.ttl)
+            ).fetchone()
+            if row:
+                value = row[0]
+                with self._lock:
+                    self._memory[key] = value
+        return value
+
+    def put(self, key: str, description: str):
+        with self._lock:
+            self._memory[key] = description
+        if self.path:
+            self._conn().execute("INSERT OR REPLACE INTO image_descriptions VALUES (?, ?, ?)",
+                                 (key, description, time.time()))
+
+    def record(self, hit: bool):
+        trace_event("cache_hit" if hit else "cache_miss", cache="image")
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._memory),
+                "max_entries": self._memory.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "persistent": bool(self.path)
+            }
+
+
+image_cache = ImageDescriptionCache(IMAGE_CACHE_SIZE, IMAGE_CACHE_TTL_S, IMAGE_CACHE_DB)
+
+
+def dhash_image(data: bytes) -> str:
+    """64-bit difference hash; identical for resized/recompressed copies of a photo"""
+    with Image.open(io.BytesIO(data)) as img:
+        small = img.convert("L").resize((9, 8), Image.BILINEAR)
+        px = small.tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (px[row * 9 + col] > px[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+
+def image_cache_key(processed: bytes) -> str:
+    if IMAGE_CACHE_KEY == "dhash":
+        try:
+            return "dhash:" + dhash_image(processed)
+        except Image.DecompressionBombError as e:
+            raise ValueError("Image has too many pixels") from e
+        except (UnidentifiedImageError, OSError):
+            pass  # undecodable passthrough formats fall back to the content hash
+    return "sha256:" + hashlib.sha256(processed).hexdigest()
+
+
+def prepare_image(source, cache_prefix: str = "") -> dict:
+    """
+    Hash, cache-check and (on a miss) preprocess one upload. Returns a dict
+    with raw_key plus either the cached description or the processed bytes,
+    mime_type and norm_key to send to the model. Raises ValueError for
+    unusable images.
+    """
+    stream = as_seekable_stream(source)
+    prepared = {"raw_key": cache_prefix + "raw:" + sha256_stream(stream), "description": None}
+    prepared["description"] = image_cache.get(prepared["raw_key"])
+    if prepared["description"] is not None:
+        image_cache.record(hit=True)
+        return prepared
+
+    # Normalize (resize / strip metadata) before hashing and sending
+    prepared["processed"], prepared["mime_type"] = preprocess_image(stream)
+    prepared["norm_key"] = cache_prefix + image_cache_key(prepared["processed"])
+    prepared["description"] = image_cache.get(prepared["norm_key"])
+    if prepared["description"] is not None:
+        image_cache.record(hit=True)
+        image_cache.put(prepared["raw_key"], prepared["description"])
+    else:
+        image_cache.record(hit=False)
+    return prepared
+
+
+def remember_description(prepared: dict, description: str):
+    image_cache.put(prepared["norm_key"], description)
+    image_cache.put(prepared["raw_key"], description)
+
+
+def describe_image_upload(source, prompt: str = DESCRIBE_IMAGE_PROMPT, cache_prefix: str = ""):
+    """
+    Recognize the food in an uploaded image (bytes or seekable stream).
+    Returns (description, cached). Raises ValueError for unusable images and
+    GeminiUnavailable when the model pool is saturated or times out. Callers
+    using a different prompt pass their own cache_prefix.
+    """
+    prepared = prepare_image(source, cache_prefix)
+    if prepared["description"] is not None:
+        return prepared["description"], True
+
+    # genai takes raw bytes for inline data; no base64 string round trip
+    image_part = {
+        "mime_type": prepared["mime_type"],
+        "data": prepared["processed"]
+    }
+    description = call_gemini([prompt, image_part])
+    remember_description(prepared, description)
+    return description, False
+
+
 # -------------------------------------------------------------------
 # Gemini Describe Image
 # -------------------------------------------------------------------
@@ -1049,31 +3131,948 @@ def api_describe_image():
         return jsonify({"error": "No selected file"}), 400
 
     try:
-        import base64
+        description, cached = describe_image_upload(file.stream)
+        return jsonify({"description": description, "cached": cached})
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except GeminiUnavailable as e:
+        log.warning("/describe_image rejected: %s", e)
+        return jsonify({"error": str(e)}), e.status_code
+    except Exception as e:
+        log.exception("Error in /describe_image")
+        return jsonify({"error": str(e)}), 500
 
-        # Read file and encode as base64
-        file_data = file.read()
-        img_data = base64.b64encode(file_data).decode()
 
-        prompt = (
-            "Identify the food in this image. Respond only in the format: Food Name - Category. "
-            "If it is not food, respond: No food detected."
-        )
+# -------------------------------------------------------------------
+# Batch image recognition
+# -------------------------------------------------------------------
+# Uploads are hashed/preprocessed in parallel, cache hits are answered
+# directly, and the misses are packed IMAGES_PER_MODEL_CALL at a time into
+# one Gemini request each (the chunks run concurrently, still bounded by the
+# global Gemini pool). Images the packed answer does not cover are retried
+# one by one.
+MAX_BATCH_IMAGES = int(os.getenv("MAX_BATCH_IMAGES", "10"))
+IMAGES_PER_MODEL_CALL = int(os.getenv("IMAGES_PER_MODEL_CALL", "4"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "4"))
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+
+
+def batch_describe_prompt(count: int) -> str:
+    return (
+        f"You are given {count} images, numbered 1 to {count} in order. For each image write exactly one line: "
+        "<number>. Food Name - Category. If an image has no food, write: <number>. No food detected."
+    )
+
+
+def parse_numbered_lines(text: str, count: int) -> dict:
+    """'1. Adobo - Meat' lines -> {0: 'Adobo - Meat'}; ignores numbers outside 1..count"""
+    answers = {}
+    for line in (text or "").splitlines():
+        m = re.match(r"^\s*(?:image\s*)?(\d+)\s*[.):-]\s*(.+)$", line, re.IGNORECASE)
+        if m and 1 <= int(m.group(1)) <= count:
+            answers.setdefault(int(m.group(1)) - 1, m.group(2).strip())
+    return answers
+
+
+def describe_chunk(chunk: list) -> int:
+    """Describe prepared images in one model call, filling result["description"]; returns model calls made"""
+    calls = 1
+    if len(chunk) == 1:
+        answers = {0: call_gemini([DESCRIBE_IMAGE_PROMPT, {"mime_type": chunk[0]["mime_type"],
+                                                            "data": chunk[0]["processed"]}])}
+    else:
+        contents = [batch_describe_prompt(len(chunk))]
+        contents.extend({"mime_type": p["mime_type"], "data": p["processed"]} for p in chunk)
+        answers = parse_numbered_lines(call_gemini(contents), len(chunk))
+    for idx, prepared in enumerate(chunk):
+        description = answers.get(idx)
+        if description is None:
+            # The packed answer skipped this image; ask about it alone
+            description = call_gemini([DESCRIBE_IMAGE_PROMPT, {"mime_type": prepared["mime_type"],
+                                                               "data": prepared["processed"]}])
+            calls += 1
+        prepared["description"] = description
+        remember_description(prepared, description)
+    return calls
+
+
+@app.route('/describe_images', methods=['POST'])
+def api_describe_images():
+    """Recognize several meal photos at once; results come back in upload order"""
+    files = request.files.getlist("files") or request.files.getlist("file")
+    files = [f for f in files if f.filename]
+    if not files:
+        return jsonify({"error": "No files uploaded (use the 'files' field)"}), 400
+    if len(files) > MAX_BATCH_IMAGES:
+        return jsonify({"error": f"Too many images (max {MAX_BATCH_IMAGES})"}), 400
+
+    results = [{"index": i, "filename": f.filename} for i, f in enumerate(files)]
+    prepare_futures = [submit_in_context(image_executor, prepare_image, f.stream) for f in files]
+
+    pending = []
+    for result, future in zip(results, prepare_futures):
+        try:
+            prepared = future.result()
+        except ValueError as e:
+            result.update({"error": str(e), "status": 400})
+            continue
+        except Exception as e:
+            log.exception("Preprocessing failed for %s", result["filename"])
+            result.update({"error": str(e), "status": 500})
+            continue
+        if prepared["description"] is not None:
+            result.update({"description": prepared["description"], "cached": True})
+        else:
+            prepared["result"] = result
+            pending.append(prepared)
+
+    chunks = [pending[i:i + IMAGES_PER_MODEL_CALL] for i in range(0, len(pending), IMAGES_PER_MODEL_CALL)]
+    chunk_futures = [submit_in_context(image_executor, describe_chunk, chunk) for chunk in chunks]
+    model_calls = 0
+    for chunk, future in zip(chunks, chunk_futures):
+        try:
+            model_calls += future.result()
+        except GeminiUnavailable as e:
+            for prepared in chunk:
+                if prepared["description"] is None:
+                    prepared["result"].update({"error": str(e), "status": e.status_code})
+        except Exception as e:
+            log.exception("Batch recognition failed")
+            for prepared in chunk:
+                if prepared["description"] is None:
+                    prepared["result"].update({"error": str(e), "status": 500})
+        for prepared in chunk:
+            if prepared["description"] is not None:
+                prepared["result"].update({"description": prepared["description"], "cached": False})
 
-        model = genai.GenerativeModel("gemini-2.5-flash")
+    return jsonify({
+        "results": results,
+        "modelCalls": model_calls,
+        "failed": sum(1 for r in results if "error" in r)
+    })
 
-        image_part = {
-            "mime_type": "image/jpeg",
-            "data": img_data
-        }
 
-        result = model.generate_content([prompt, image_part])
-        return jsonify({"description": result.text})
+# -------------------------------------------------------------------
+# Photo -> nutrition in one request
+# -------------------------------------------------------------------
+ANALYZE_MEAL_PROMPT = (
+    "List every food or dish visible in this image, one per line, in the format: "
+    "Food Name - Category - estimated edible grams (e.g. Pork Adobo - Meat - 150g). "
+    "If there is no food, respond: No food detected."
+)
+
+# Typical single-serving edible grams by category keyword, used when the model
+# gives no usable weight for a dish
+TYPICAL_PORTION_GRAMS = [
+    ("rice", 160), ("soup", 250), ("sinigang", 250), ("tinola", 250), ("noodle", 200), ("pancit", 200),
+    ("drink", 250), ("beverage", 250), ("milk", 250), ("dessert", 150), ("fruit", 120),
+    ("vegetable", 100), ("bread", 50), ("egg", 50), ("seafood", 120), ("fish", 120), ("meat", 120),
+]
+DEFAULT_PORTION_GRAMS = 150.0
+MIN_PORTION_GRAMS = 10.0
+MAX_PORTION_GRAMS = 1000.0
+
+LOOKUP_WORKERS = int(os.getenv("LOOKUP_WORKERS", "8"))
+lookup_executor = ThreadPoolExecutor(max_workers=LOOKUP_WORKERS, thread_name_prefix="lookup")
+
+
+def estimate_portion_grams(name: str, category: str) -> float:
+    text = normalize_text(f"{category} {name}")
+    for keyword, grams in TYPICAL_PORTION_GRAMS:
+        if keyword in text:
+            return float(grams)
+    return DEFAULT_PORTION_GRAMS
+
+
+def parse_dishes(description: str) -> list:
+    """Parse 'Food Name - Category[ - 150g]' lines into [{name, category, grams, portionSource}]"""
+    dishes = []
+    for line in (description or "").splitlines():
+        line = re.sub(r"^(?:[-*•]|\d+[.)])\s*", "", line.strip())
+        if not line or "no food detected" in line.lower():
+            continue
+        parts = [p.strip() for p in re.split(r"\s+[-–—]\s+", line) if p.strip()]
+        name = parts[0]
+        category = parts[1] if len(parts) > 1 else "Unknown"
+        grams = None
+        for part in parts[2:]:
+            m = re.search(r"(\d+(?:\.\d+)?)\s*(?:g|grams?)\b", part, re.IGNORECASE)
+            if m:
+                grams = safe_float(m.group(1), None)
+                break
+        if grams and MIN_PORTION_GRAMS <= grams <= MAX_PORTION_GRAMS:
+            source = "model"
+        else:
+            grams = estimate_portion_grams(name, category)
+            source = "default"
+        dishes.append({"name": name, "category": category, "grams": grams, "portionSource": source})
+    return dishes
+
+
+def resolve_items_concurrently(items: list, fn=unified_lookup) -> list:
+    """Run fn for [(food, grams), ...] (or other argument tuples) on the lookup pool, results in input order"""
+    futures = [submit_in_context(lookup_executor, fn, *args) for args in items]
+    return [f.result() for f in futures]
+
 
+@app.route('/analyze_meal_photo', methods=['POST'])
+def analyze_meal_photo():
+    """Recognize dishes in a photo and return their nutrition in the same request"""
+    if 'file' not in request.files:
+        return jsonify({"error": "No file part"}), 400
+
+    file = request.files['file']
+    if file.filename == "":
+        return jsonify({"error": "No selected file"}), 400
+
+    try:
+        description, cached = describe_image_upload(file.stream, ANALYZE_MEAL_PROMPT, cache_prefix="meal:")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except GeminiUnavailable as e:
+        log.warning("/analyze_meal_photo rejected: %s", e)
+        return jsonify({"error": str(e)}), e.status_code
     except Exception as e:
-        log.exception("Error in /describe_image")
+        log.exception("Error in /analyze_meal_photo")
         return jsonify({"error": str(e)}), 500
 
+    dishes = parse_dishes(description)
+    items = resolve_items_concurrently([(d["name"], d["grams"]) for d in dishes])
+
+    foods = []
+    alerts = []
+    for dish, item in zip(dishes, items):
+        item.update({
+            "OriginalName": dish["name"],
+            "RecognizedCategory": dish["category"],
+            "PortionSource": dish["portionSource"]
+        })
+        alerts.extend(nutrition_alerts(item))
+        foods.append(item)
+
+    response = {
+        "description": description,
+        "cached": cached,
+        "foods": foods,
+        "totals": {
+            **{key: round(sum(item[key] for item in foods), 2)
+               for key in ("Calories", "Protein", "Fat", "Carbs", "Sugar")},
+            "MicroNutrients": sum((item["MicroNutrients"] for item in foods), MicroVector())
+        },
+        "body_goal_note": "Portions are estimated from the photo. Philippines FEL standard used where available."
+    }
+    if not foods:
+        response["message"] = "No food detected"
+    if alerts:
+        response["realtime_alert"] = True
+        response["alert_reason"] = alerts
+    return jsonify(response)
+
+
+# -------------------------------------------------------------------
+# Free-text meal parser
+# -------------------------------------------------------------------
+# "2 cups rice, 1 adobo, half a mango" -> items with grams. Segments split on
+# commas/and/plus; each is [quantity] [unit] [of] food, or food [quantity]
+# [unit]. Parsing is text only. Grams need the FEL category, so the FEL
+# lookup, the unit conversion and the nutrition lookup for every food run
+# together in one deduplicated batch on the lookup pool. Mass units convert
+# directly, volume units through a density table, pieces through a
+# per-piece table, and a bare count or "serving" uses the typical portion
+# table.
+MAX_MEAL_ITEMS = int(os.getenv("MAX_MEAL_ITEMS", "20"))
+
+MEAL_NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
+    "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "dozen": 12, "half": 0.5, "quarter": 0.25,
+}
+MEAL_FRACTIONS = {"½": " 1/2", "¼": " 1/4", "¾": " 3/4", "⅓": " 1/3", "⅔": " 2/3"}
+# unit -> (kind, amount): grams for "mass", millilitres for "volume"
+MEAL_UNITS = {
+    "g": ("mass", 1), "gm": ("mass", 1), "gms": ("mass", 1), "gram": ("mass", 1), "grams": ("mass", 1),
+    "kg": ("mass", 1000), "kilo": ("mass", 1000), "kilos": ("mass", 1000),
+    "oz": ("mass", 28.35), "ounce": ("mass", 28.35), "ounces": ("mass", 28.35),
+    "lb": ("mass", 453.6), "lbs": ("mass", 453.6), "pound": ("mass", 453.6), "pounds": ("mass", 453.6),
+    "ml": ("volume", 1), "l": ("volume", 1000), "liter": ("volume", 1000), "liters": ("volume", 1000),
+    "litre": ("volume", 1000), "litres": ("volume", 1000),
+    "cup": ("volume", 240), "cups": ("volume", 240), "glass": ("volume", 250), "glasses": ("volume", 250),
+    "bowl": ("volume", 300), "bowls": ("volume", 300),
+    "tbsp": ("volume", 15), "tablespoon": ("volume", 15), "tablespoons": ("volume", 15),
+    "tsp": ("volume", 5), "teaspoon": ("volume", 5), "teaspoons": ("volume", 5),
+    "piece": ("piece", 1), "pieces": ("piece", 1), "pc": ("piece", 1), "pcs": ("piece", 1),
+    "slice": ("piece", 1), "slices": ("piece", 1), "stick": ("piece", 1), "sticks": ("piece", 1),
+    "serving": ("serving", 1), "servings": ("serving", 1), "plate": ("serving", 1), "plates": ("serving", 1),
+    "order": ("serving", 1), "orders": ("serving", 1),
+    "can": ("volume", 330), "cans": ("volume", 330), "bottle": ("volume", 500), "bottles": ("volume", 500),
+}
+# First keyword found in the food name (then its FEL category) wins
+DENSITY_G_PER_ML = [
+    ("oil", 0.92), ("honey", 1.42), ("sugar", 0.85), ("butter", 0.96), ("milk", 1.03), ("taho", 1.0),
+    ("rice", 0.66), ("pancit", 0.6), ("noodle", 0.6), ("mongo", 0.84), ("halo", 0.9), ("gulaman", 1.0),
+    ("soup", 1.0), ("sinigang", 1.0), ("tinola", 1.0), ("kangkong", 0.42), ("ampalaya", 0.5),
+    ("vegetable", 0.5), ("fruit", 0.65), ("dessert", 0.8), ("adobo", 0.9), ("meat", 0.85),
+    ("coke", 1.04), ("cola", 1.04), ("soda", 1.04), ("juice", 1.04), ("water", 1.0), ("coffee", 1.0),
+]
+DEFAULT_DENSITY_G_PER_ML = 0.8
+PIECE_GRAMS = [
+    ("egg", 50), ("pandesal", 30), ("bread", 25), ("banana", 90), ("apple", 180), ("mango", 200),
+    ("lumpia", 30), ("hotdog", 45), ("longganisa", 40), ("shrimp", 15), ("bangus", 150), ("fish", 100),
+    ("chicken", 120), ("pork", 100), ("lechon", 100), ("beef", 100), ("butter", 5),
+]
+# Foods where a bare count ("2 eggs") means pieces rather than servings
+COUNTABLE_FOODS = ("egg", "pandesal", "bread", "banana", "apple", "mango", "lumpia", "hotdog", "longganisa", "shrimp")
+
+_MEAL_QTY = r"(?P<qty>\d+(?:\.\d+)?\s+\d+/\d+|\d+/\d+|\d+(?:\.\d+)?|" + "|".join(MEAL_NUMBER_WORDS) + r")\b"
+_MEAL_UNIT = r"(?P<unit>" + "|".join(sorted(MEAL_UNITS, key=len, reverse=True)) + r")"
+MEAL_LEADING_RE = re.compile(rf"^(?:{_MEAL_QTY})?\s*(?:(?:a|an)\s+)?(?:{_MEAL_UNIT}\b)?\s*(?:of\s+)?(?P<food>.+)$")
+MEAL_TRAILING_RE = re.compile(rf"^(?P<food>.+?)\s+(?:x\s*)?{_MEAL_QTY}\s*(?:{_MEAL_UNIT}\b)?$")
+MEAL_SPLIT_RE = re.compile(r"\s*(?:[,;+\n]|\band\b|\bwith\b|&)\s*")
+# "200g" -> "200 g", but only before a unit: "7up" stays one word
+MEAL_UNIT_JOIN_RE = re.compile(rf"(\d){_MEAL_UNIT}\b")
+
+
+def parse_quantity(text: str) -> float:
+    if not text:
+        return 1.0
+    if text in MEAL_NUMBER_WORDS:
+        return float(MEAL_NUMBER_WORDS[text])
+    total = 0.0
+    for part in text.split():
+        if "/" in part:
+            num, den = part.split("/", 1)
+            total += float(num) / float(den) if float(den) else 0.0
+        else:
+            total += float(part)
+    return total
+
+
+def keyword_value(table, *texts, default=None):
+    for text in texts:
+        for keyword, value in table:
+            if keyword in text:
+                return value
+    return default
+
+
+def resolve_meal_food(food: str) -> str:
+    """Prefer a form that is an exact FEL name or alias ("eggs" -> "egg")."""
+    food = normalize_text(food)
+    candidates = [food]
+    if food.endswith("es"):
+        candidates.append(food[:-2])
+    if food.endswith("s"):
+        candidates.append(food[:-1])
+    return next((c for c in candidates if c in fel_exact), food)
+
+
+def split_meal_segment(segment: str):
+    """One meal segment -> {name, quantity, unit} (unit "" if none given) or None; text only."""
+    text = segment.lower().strip(" .")
+    for char, repl in MEAL_FRACTIONS.items():
+        text = text.replace(char, repl)
+    text = MEAL_UNIT_JOIN_RE.sub(r"\1 \g<unit>", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    if not text:
+        return None
+
+    match = MEAL_LEADING_RE.match(text)
+    if match and not match.group("qty") and not match.group("unit"):
+        match = MEAL_TRAILING_RE.match(text) or match
+    if not match:
+        return None
+    quantity = parse_quantity(match.group("qty"))
+    name = resolve_meal_food(re.sub(r"^(?:a|an|of)\s+", "", match.group("food").strip()))
+    if not name or quantity <= 0:
+        return None
+    return {"name": name, "quantity": round(quantity, 3), "unit": match.group("unit") or ""}
+
+
+def meal_portion(name: str, quantity: float, unit: str) -> dict:
+    """Grams for a parsed quantity; the FEL category refines density and piece weights."""
+    fel_match = lookup_fel(name)
+    category = normalize_text(fel_match["Category"]) if fel_match else ""
+    kind, amount = MEAL_UNITS.get(unit, ("serving", 1))
+    if kind == "mass":
+        grams, source = quantity * amount, "mass"
+    elif kind == "volume":
+        density = keyword_value(DENSITY_G_PER_ML, name, category, default=DEFAULT_DENSITY_G_PER_ML)
+        grams, source = quantity * amount * density, "volume"
+    elif kind == "piece" or (not unit and any(k in name for k in COUNTABLE_FOODS)):
+        grams, source = quantity * keyword_value(PIECE_GRAMS, name, category,
+                                                 default=estimate_portion_grams(name, category)), "piece"
+    else:
+        grams, source = quantity * estimate_portion_grams(name, category), "serving"
+
+    return {
+        "unit": unit or ("piece" if source == "piece" else "serving"),
+        "grams": round(grams, 1),
+        "portionSource": source,
+    }
+
+
+def parse_meal_segment(segment: str):
+    """One meal segment -> {name, quantity, unit, grams, portionSource} or None."""
+    parsed = split_meal_segment(segment)
+    if not parsed:
+        return None
+    parsed.update(meal_portion(parsed["name"], parsed["quantity"], parsed["unit"]))
+    return parsed
+
+
+def resolve_meal_item(name: str, quantity: float, unit: str) -> tuple:
+    """Portion and nutrition for one parsed food; runs on the lookup pool."""
+    portion = meal_portion(name, quantity, unit)
+    return portion, unified_lookup(name, portion["grams"])
+
+
+def parse_meal_text(text: str):
+    """Split free text into parsed segments and the segments that didn't parse."""
+    items, unparsed = [], []
+    for segment in MEAL_SPLIT_RE.split(text or ""):
+        if not segment.strip():
+            continue
+        parsed = split_meal_segment(segment)
+        if parsed:
+            parsed["text"] = segment.strip()
+            items.append(parsed)
+        else:
+            unparsed.append(segment.strip())
+    return items, unparsed
+
+
+@app.route('/parse_meal', methods=['POST'])
+def parse_meal():
+    """Parse a free-text meal and return nutrition for every food in one request"""
+    data = request.get_json(silent=True) or {}
+    text = str(data.get("text", "")).strip()
+    if not text:
+        return jsonify({"error": "text is required"}), 400
+
+    with observe_stage("meal_parse"):
+        parsed, unparsed = parse_meal_text(text)
+    if len(parsed) > MAX_MEAL_ITEMS:
+        return jsonify({"error": f"At most {MAX_MEAL_ITEMS} foods per meal"}), 400
+
+    # Same food at the same quantity is resolved once
+    unique = list(dict.fromkeys((p["name"], p["quantity"], p["unit"]) for p in parsed))
+    resolved = dict(zip(unique, resolve_items_concurrently(unique, resolve_meal_item)))
+
+    foods = []
+    alerts = []
+    for p in parsed:
+        portion, found = resolved[(p["name"], p["quantity"], p["unit"])]
+        item = dict(found)
+        item.update({
+            "OriginalName": p["text"],
+            "Quantity": p["quantity"],
+            "Unit": portion["unit"],
+            "PortionSource": portion["portionSource"]
+        })
+        alerts.extend(nutrition_alerts(item))
+        foods.append(item)
+
+    response = {
+        "foods": foods,
+        "unparsed": unparsed,
+        "totals": {
+            **{key: round(sum(item[key] for item in foods), 2)
+               for key in ("Calories", "Protein", "Fat", "Carbs", "Sugar")},
+            "MicroNutrients": sum((item["MicroNutrients"] for item in foods), MicroVector())
+        },
+        "body_goal_note": "Grams are estimated from household units. Philippines FEL standard used where available."
+    }
+    if alerts:
+        response["realtime_alert"] = True
+        response["alert_reason"] = alerts
+    return jsonify(response)
+
+
+# -------------------------------------------------------------------
+# Windowed intake alerts (high sugar, dehydration)
+# -------------------------------------------------------------------
+# Per-user rolling windows over logged intake: 24 hourly and 7 daily
+# buckets per metric in one flat float array, plus running window sums.
+# Recording an event or moving the clock forward only clears the buckets
+# that expired, so each event and each evaluation is O(1) and history is
+# never re-summed. The 24 h window is to the hour; days start at midnight
+# INTAKE_UTC_OFFSET_H. Windows live in this process, like memory:// chat
+# state. /alerts/evaluate/batch replays logged history to backfill them,
+# e.g. after a restart.
+INTAKE_METRICS = ("calories", "sugar", "sodium", "water")
+INTAKE_UTC_OFFSET_H = float(os.getenv("INTAKE_UTC_OFFSET_H", "8"))  # Philippine time
+INTAKE_HOURS = 24
+INTAKE_DAYS = 7
+ALERT_MAX_USERS = int(os.getenv("ALERT_MAX_USERS", "50000"))
+ALERT_MAX_EVENTS = int(os.getenv("ALERT_MAX_EVENTS", "5000"))
+ALERT_MAX_CLOCK_SKEW_S = 3600  # events further in the future would expire real data early
+
+# Weekly averages need a few days behind them before they mean anything
+ALERT_7D_MIN_DAYS = int(os.getenv("ALERT_7D_MIN_DAYS", "3"))
+
+# (rule, metric, window, comparison, limit, message); window is "24h" or "7d_avg".
+# "<" rules only apply to users who logged that metric in the last 7 days;
+# "7d_avg" rules only once ALERT_7D_MIN_DAYS days are tracked.
+ALERT_RULES = [
+    ("high_sugar_24h", "sugar", "24h", ">", float(os.getenv("ALERT_SUGAR_24H_G", "50")),
+     "High sugar: {value:.0f}g in the last 24 hours (limit {limit:.0f}g)"),
+    ("high_sugar_7d", "sugar", "7d_avg", ">", float(os.getenv("ALERT_SUGAR_7D_AVG_G", "36")),
+     "High sugar: {value:.0f}g a day on average this week (limit {limit:.0f}g)"),
+    ("high_sodium_24h", "sodium", "24h", ">", float(os.getenv("ALERT_SODIUM_24H_MG", "2300")),
+     "Dehydration risk: {value:.0f}mg sodium in the last 24 hours (limit {limit:.0f}mg)"),
+    ("low_water_24h", "water", "24h", "<", float(os.getenv("ALERT_WATER_24H_MIN_ML", "1500")),
+     "Dehydration: {value:.0f}ml water in the last 24 hours (target {limit:.0f}ml)"),
+]
+
+
+def intake_clock(ts: float) -> tuple:
+    """(hour number, day number) of an epoch timestamp in intake local time"""
+    hour = int((ts + INTAKE_UTC_OFFSET_H * 3600) // 3600)
+    return hour, hour // 24
+
+
+def intake_time(value) -> float:
+    """Epoch seconds from an epoch number or ISO 8601 string (naive means UTC); now when missing"""
+    if value in (None, ""):
+        return time.time()
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def micro_from_payload(value) -> MicroVector:
+    """MicroNutrients as sent by clients: the legacy string or a name -> amount object"""
+    if isinstance(value, MicroVector):
+        return value
+    if isinstance(value, dict):
+        return MicroVector.from_named(value)
+    return MicroVector.parse(value)
+
+
+def intake_event(raw: dict) -> tuple:
+    """(timestamp, INTAKE_METRICS values) from a logged item or a nutrition result"""
+    def pick(*keys):
+        for key in keys:
+            if raw.get(key) is not None:
+                return max(0.0, safe_float(raw[key], 0))
+        return None
+
+    sodium = pick("sodium", "Sodium")
+    if sodium is None:
+        sodium = micro_from_payload(raw.get("MicroNutrients"))[MICRO_INDEX["sodium"]]
+    values = (pick("calories", "Calories") or 0.0, pick("sugar", "Sugar") or 0.0, sodium,
+              pick("waterMl", "water") or 0.0)
+    return intake_time(raw.get("timestamp")), values
+
+
+class IntakeWindows:
+    """Rolling 24 h (hourly buckets) and 7 day (daily buckets) sums for one user."""
+    __slots__ = ("hour", "day", "first_day", "buckets", "sums")
+
+    def __init__(self, ts: float):
+        self.hour, self.day = intake_clock(ts)
+        self.first_day = self.day
+        m = len(INTAKE_METRICS)
+        self.buckets = array("d", bytes(8 * (INTAKE_HOURS + INTAKE_DAYS) * m))
+        self.sums = array("d", bytes(8 * 2 * m))  # 24 h sums, then 7 day sums
+
+    def _clear(self, slot: int, sums_at: int):
+        m = len(INTAKE_METRICS)
+        for i in range(m):
+            self.sums[sums_at + i] -= self.buckets[slot * m + i]
+            self.buckets[slot * m + i] = 0.0
+
+    def advance(self, ts: float):
+        """Move the windows forward to ts, expiring at most one full window of buckets."""
+        hour, day = intake_clock(ts)
+        if hour > self.hour:
+            for h in range(max(self.hour + 1, hour - INTAKE_HOURS + 1), hour + 1):
+                self._clear(h % INTAKE_HOURS, 0)
+            self.hour = hour
+        if day > self.day:
+            for d in range(max(self.day + 1, day - INTAKE_DAYS + 1), day + 1):
+                self._clear(INTAKE_HOURS + d % INTAKE_DAYS, len(INTAKE_METRICS))
+            self.day = day
+
+    def add(self, ts: float, values) -> bool:
+        """Record one event; False when it is older than both windows."""
+        self.advance(ts)
+        hour, day = intake_clock(ts)
+        m = len(INTAKE_METRICS)
+        in_hours = hour > self.hour - INTAKE_HOURS
+        in_days = day > self.day - INTAKE_DAYS
+        for i, v in enumerate(values):
+            if in_hours:
+                self.buckets[(hour % INTAKE_HOURS) * m + i] += v
+                self.sums[i] += v
+            if in_days:
+                self.buckets[(INTAKE_HOURS + day % INTAKE_DAYS) * m + i] += v
+                self.sums[m + i] += v
+        if in_days:
+            self.first_day = min(self.first_day, day)
+        return in_hours or in_days
+
+    def snapshot(self) -> dict:
+        m = len(INTAKE_METRICS)
+        days = max(1, min(INTAKE_DAYS, self.day - self.first_day + 1))
+        return {
+            "24h": {name: round(max(0.0, self.sums[i]), 2) for i, name in enumerate(INTAKE_METRICS)},
+            "7d": {name: round(max(0.0, self.sums[m + i]), 2) for i, name in enumerate(INTAKE_METRICS)},
+            "7d_avg": {name: round(max(0.0, self.sums[m + i]) / days, 2) for i, name in enumerate(INTAKE_METRICS)},
+            "days_tracked": days,
+        }
+
+
+def evaluate_alert_rules(windows: dict) -> list:
+    alerts = []
+    for rule, metric, window, comparison, limit, message in ALERT_RULES:
+        if window == "7d_avg" and windows["days_tracked"] < ALERT_7D_MIN_DAYS:
+            continue
+        value = windows[window][metric]
+        if comparison == ">":
+            fired = value > limit
+        else:
+            fired = windows["7d"][metric] > 0 and value < limit
+        if fired:
+            alerts.append({"rule": rule, "metric": metric, "window": window, "value": value, "limit": limit,
+                           "message": message.format(value=value, limit=limit)})
+    return alerts
+
+
+class AlertEngine:
+    """Per-user IntakeWindows, least recently used users dropped past max_users."""
+
+    def __init__(self, max_users: int = ALERT_MAX_USERS):
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, user_id: str, ts: float, values) -> bool:
+        with self._lock:
+            windows = self._users.get(user_id)
+            if windows is None:
+                windows = self._users[user_id] = IntakeWindows(ts)
+                if len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            else:
+                self._users.move_to_end(user_id)
+            return windows.add(ts, values)
+
+    def evaluate(self, user_id: str, ts: float = None) -> dict:
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            windows = self._users.get(user_id)
+            if windows is None:
+                windows = IntakeWindows(ts)
+            else:
+                windows.advance(ts)
+            snapshot = windows.snapshot()
+        return {"userId": user_id, "windows": snapshot, "alerts": evaluate_alert_rules(snapshot)}
+
+    def reset(self, user_id: str):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"users": len(self._users), "max_users": self.max_users}
+
+
+alert_engine = AlertEngine()
+
+
+def record_intake_events(user_id: str, events: list) -> tuple:
+    """Feed raw events into the user's windows in time order; returns (recorded, skipped)"""
+    parsed, skipped = [], 0
+    for raw in events:
+        try:
+            parsed.append(intake_event(raw))
+        except (AttributeError, TypeError, ValueError):
+            skipped += 1
+    recorded = 0
+    latest = time.time() + ALERT_MAX_CLOCK_SKEW_S
+    for ts, values in sorted(parsed, key=lambda e: e[0]):
+        if ts <= latest and alert_engine.record(user_id, ts, values):
+            recorded += 1
+        else:
+            skipped += 1
+    return recorded, skipped
+
+
+@app.route('/alerts/evaluate', methods=['POST'])
+def alerts_evaluate():
+    """Record a user's new intake events (optional) and evaluate the windowed alert rules"""
+    data = request.get_json(silent=True) or {}
+    user_id = str(data.get("userId") or "").strip()
+    if not user_id:
+        return jsonify({"error": "userId is required"}), 400
+    events = data.get("events") or ([data["event"]] if isinstance(data.get("event"), dict) else [])
+    if not isinstance(events, list) or len(events) > ALERT_MAX_EVENTS:
+        return jsonify({"error": f"events must be a list of at most {ALERT_MAX_EVENTS} items"}), 400
+    try:
+        as_of = min(intake_time(data.get("asOf")), time.time())
+    except ValueError:
+        return jsonify({"error": "asOf must be epoch seconds or ISO 8601"}), 400
+
+    recorded, skipped = record_intake_events(user_id, events)
+    result = alert_engine.evaluate(user_id, as_of)
+    result.update({"recorded": recorded, "skipped": skipped, "realtime_alert": bool(result["alerts"])})
+    return jsonify(result)
+
+
+@app.route('/alerts/evaluate/batch', methods=['POST'])
+def alerts_evaluate_batch():
+    """Backfill: rebuild the windows of every user in `events` from logged history, then evaluate"""
+    data = request.get_json(silent=True) or {}
+    events = data.get("events")
+    if not isinstance(events, list) or len(events) > ALERT_MAX_EVENTS:
+        return jsonify({"error": f"events must be a list of at most {ALERT_MAX_EVENTS} items"}), 400
+    try:
+        as_of = min(intake_time(data.get("asOf")), time.time())
+    except ValueError:
+        return jsonify({"error": "asOf must be epoch seconds or ISO 8601"}), 400
+
+    by_user = {}
+    for raw in events:
+        if isinstance(raw, dict) and raw.get("userId"):
+            by_user.setdefault(str(raw["userId"]).strip(), []).append(raw)
+    users = {}
+    skipped = len(events) - sum(len(v) for v in by_user.values())
+    for user_id, user_events in by_user.items():
+        if data.get("reset", True):
+            alert_engine.reset(user_id)
+        recorded, user_skipped = record_intake_events(user_id, user_events)
+        skipped += user_skipped
+        result = alert_engine.evaluate(user_id, as_of)
+        users[user_id] = {"windows": result["windows"], "alerts": result["alerts"], "recorded": recorded}
+    return jsonify({"users": users, "events": len(events), "skipped": skipped})
+
+
+# -------------------------------------------------------------------
+# Daily intake totals
+# -------------------------------------------------------------------
+# Running per-user, per-day sums of committed nutrition results: one flat
+# float array per day holding the macros, MICRO_NUTRIENTS and an item count.
+# A commit adds its items to that day's array in place, so "today" is a
+# dict hit and "last N days" touches N arrays; logs are never re-summed.
+# Days older than INTAKE_RETENTION_DAYS are dropped. With INTAKE_SNAPSHOT_DB
+# set, changed days are written as 8-byte-per-value blobs at most every
+# INTAKE_SNAPSHOT_S (and at exit) and read back on first use after a
+# restart. Like the alert windows, the totals are kept per process.
+INTAKE_TOTAL_KEYS = ("Calories", "Protein", "Fat", "Carbs", "Sugar")
+INTAKE_SLOTS = len(INTAKE_TOTAL_KEYS) + len(MICRO_NUTRIENTS) + 1  # last slot counts items
+INTAKE_RETENTION_DAYS = int(os.getenv("INTAKE_RETENTION_DAYS", "90"))
+INTAKE_MAX_USERS = int(os.getenv("INTAKE_MAX_USERS", "50000"))
+INTAKE_SNAPSHOT_DB = os.getenv("INTAKE_SNAPSHOT_DB")
+INTAKE_SNAPSHOT_S = float(os.getenv("INTAKE_SNAPSHOT_S", "30"))
+
+
+def intake_date(day: int) -> str:
+    return datetime.fromtimestamp(day * 86400, timezone.utc).date().isoformat()
+
+
+def intake_totals(totals) -> dict:
+    """Response form of one day's array"""
+    out = {key: round(totals[i], 2) for i, key in enumerate(INTAKE_TOTAL_KEYS)}
+    out["MicroNutrients"] = MicroVector(totals[len(INTAKE_TOTAL_KEYS):-1])
+    out["Items"] = int(totals[-1])
+    return out
+
+
+class IntakeLedger:
+    """Per-user {day number: totals array}, least recently used users dropped past max_users."""
+
+    def __init__(self, max_users: int = INTAKE_MAX_USERS, path: str = None):
+        self.max_users = max_users
+        self.path = path
+        self._users = OrderedDict()
+        self._dirty = {}  # (user, day) -> totals array not yet written to path
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+        self._local = threading.local()
+        if path:
+            self._conn().execute("CREATE TABLE IF NOT EXISTS intake_days "
+                                 "(user_id TEXT, day INTEGER, totals BLOB, PRIMARY KEY (user_id, day)) WITHOUT ROWID")
+            atexit.register(self.flush)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        return conn
+
+    def _load(self, user_id: str, since_day: int) -> dict:
+        if not self.path:
+            return {}
+        rows = self._conn().execute("SELECT day, totals FROM intake_days WHERE user_id = ? AND day >= ?",
+                                    (user_id, since_day)).fetchall()
+        days = {}
+        for day, blob in rows:
+            totals = array("d")
+            totals.frombytes(blob)
+            if len(totals) == INTAKE_SLOTS:
+                days[day] = totals
+        return days
+
+    def _days(self, user_id: str, today: int) -> dict:
+        with self._lock:
+            days = self._users.get(user_id)
+            if days is not None:
+                self._users.move_to_end(user_id)
+                return days
+        loaded = self._load(user_id, today - INTAKE_RETENTION_DAYS + 1)
+        with self._lock:
+            days = self._users.get(user_id)
+            if days is None:
+                # Unwritten days of a user evicted earlier are newer than the snapshot
+                loaded.update({d: t for (u, d), t in self._dirty.items() if u == user_id})
+                days = self._users[user_id] = loaded
+                if len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            return days
+
+    def add(self, user_id: str, ts: float, items: list) -> int:
+        """Add nutrition results to the user's day at ts; returns the day number."""
+        day = intake_clock(ts)[1]
+        delta = array("d", bytes(8 * INTAKE_SLOTS))
+        micro_at = len(INTAKE_TOTAL_KEYS)
+        for item in items:
+            for i, key in enumerate(INTAKE_TOTAL_KEYS):
+                delta[i] += safe_float(item.get(key), 0)
+            for i, v in enumerate(micro_from_payload(item.get("MicroNutrients"))):
+                delta[micro_at + i] += v
+            delta[-1] += 1
+
+        today = intake_clock(time.time())[1]
+        days = self._days(user_id, today)
+        with self._lock:
+            totals = days.get(day)
+            if totals is None:
+                totals = days[day] = array("d", bytes(8 * INTAKE_SLOTS))
+                for old in [d for d in days if d <= today - INTAKE_RETENTION_DAYS]:
+                    del days[old]
+            for i, v in enumerate(delta):
+                totals[i] += v
+            if self.path:
+                self._dirty[(user_id, day)] = totals
+        self._maybe_flush()
+        return day
+
+    def day(self, user_id: str, day: int) -> dict:
+        days = self._days(user_id, intake_clock(time.time())[1])
+        with self._lock:
+            totals = days.get(day)
+            return intake_totals(totals if totals is not None else array("d", bytes(8 * INTAKE_SLOTS)))
+
+    def last_days(self, user_id: str, count: int, today: int) -> list:
+        """(day number, totals dict) for the `count` days ending today, oldest first"""
+        days = self._days(user_id, today)
+        empty = array("d", bytes(8 * INTAKE_SLOTS))
+        with self._lock:
+            return [(d, intake_totals(days.get(d, empty))) for d in range(today - count + 1, today + 1)]
+
+    def _maybe_flush(self):
+        if self.path and time.monotonic() - self._flushed_at >= INTAKE_SNAPSHOT_S:
+            self.flush(blocking=False)
+
+    def flush(self, blocking: bool = True):
+        """Write changed days to the snapshot database."""
+        if not self.path or not self._flush_lock.acquire(blocking=blocking):
+            return
+        try:
+            self._flushed_at = time.monotonic()
+            with self._lock:
+                pending = [(u, d, t.tobytes()) for (u, d), t in self._dirty.items()]
+                self._dirty.clear()
+            if not pending:
+                return
+            oldest = intake_clock(time.time())[1] - INTAKE_RETENTION_DAYS + 1
+            conn = self._conn()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany("INSERT OR REPLACE INTO intake_days VALUES (?, ?, ?)", pending)
+                conn.execute("DELETE FROM intake_days WHERE day < ?", (oldest,))
+                conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                log.warning("Intake snapshot write failed, will retry: %s", e)
+                with self._lock:
+                    for u, d, blob in pending:
+                        self._dirty.setdefault((u, d), array("d", blob))
+        finally:
+            self._flush_lock.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"users": len(self._users), "unsaved_days": len(self._dirty), "persistent": bool(self.path)}
+
+
+intake_ledger = IntakeLedger(INTAKE_MAX_USERS, INTAKE_SNAPSHOT_DB)
+
+
+def commit_intake(user_id: str, items: list, ts: float) -> dict:
+    """Add eaten items to the daily totals and the alert windows"""
+    day = intake_ledger.add(user_id, ts, items)
+    for item in items:
+        alert_engine.record(user_id, ts, intake_event({**item, "timestamp": ts})[1])
+    windowed = alert_engine.evaluate(user_id)
+    return {"date": intake_date(day), "day": intake_ledger.day(user_id, day), "alerts": windowed["alerts"]}
+
+
+@app.route('/intake/commit', methods=['POST'])
+def intake_commit():
+    """Commit nutrition results (e.g. /get_nutritional_info foods) a user actually ate"""
+    data = request.get_json(silent=True) or {}
+    user_id = str(data.get("userId") or "").strip()
+    foods = data.get("foods")
+    if not user_id:
+        return jsonify({"error": "userId is required"}), 400
+    if not isinstance(foods, list) or not all(isinstance(f, dict) for f in foods) or len(foods) > ALERT_MAX_EVENTS:
+        return jsonify({"error": f"foods must be a list of at most {ALERT_MAX_EVENTS} items"}), 400
+    try:
+        ts = min(intake_time(data.get("timestamp")), time.time() + ALERT_MAX_CLOCK_SKEW_S)
+    except ValueError:
+        return jsonify({"error": "timestamp must be epoch seconds or ISO 8601"}), 400
+    return jsonify({"userId": user_id, **commit_intake(user_id, foods, ts)})
+
+
+@app.route('/intake/<user_id>/today', methods=['GET'])
+def intake_today(user_id):
+    day = intake_clock(time.time())[1]
+    return jsonify({"userId": user_id, "date": intake_date(day), "totals": intake_ledger.day(user_id, day)})
+
+
+@app.route('/intake/<user_id>/days', methods=['GET'])
+def intake_days(user_id):
+    """Daily totals for the last n days (including today), oldest first, with their sum and average"""
+    try:
+        count = max(1, min(INTAKE_RETENTION_DAYS, int(request.args.get("n", 7))))
+    except ValueError:
+        return jsonify({"error": "n must be an integer"}), 400
+    days = intake_ledger.last_days(user_id, count, intake_clock(time.time())[1])
+    total = {key: round(sum(t[key] for _, t in days), 2) for key in INTAKE_TOTAL_KEYS}
+    total["MicroNutrients"] = sum((t["MicroNutrients"] for _, t in days), MicroVector())
+    total["Items"] = sum(t["Items"] for _, t in days)
+    logged = sum(1 for _, t in days if t["Items"])
+    average = {key: round(total[key] / logged, 2) if logged else 0.0 for key in INTAKE_TOTAL_KEYS}
+    return jsonify({
+        "userId": user_id,
+        "days": [{"date": intake_date(d), **t} for d, t in days],
+        "total": total,
+        "average_per_logged_day": average,
+        "logged_days": logged
+    })
+
+
 # -------------------------------------------------------------------
 # Errors
 # -------------------------------------------------------------------
@@ -1082,6 +4081,11 @@ def not_found(_):
     return jsonify({"error": "Not found"}), 404
 
 
+@app.errorhandler(413)
+def too_large(_):
+    return jsonify({"error": f"Upload too large (max {MAX_UPLOAD_BYTES / (1024 * 1024):g} MB)"}), 413
+
+
 @app.errorhandler(500)
 def internal_err(e):
     log.exception("Unhandled error: %s", e)
@@ -0,0 +1,11 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Import main offline and quietly: blank keys win over .env, FEL data from this checkout
+for key in ("USDA_API_KEY", "API_NINJAS_KEY", "GEMINI_SECRET_KEY", "FDC_INDEX_DB", "INTAKE_SNAPSHOT_DB"):
+    os.environ[key] = ""
+os.environ["FEL_CSV"] = os.path.join(ROOT, "fel_data.csv")
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
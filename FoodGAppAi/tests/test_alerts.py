@@ -0,0 +1,99 @@
+import pytest
+
+import main
+
+RULES = {rule[0]: rule for rule in main.ALERT_RULES}
+HOUR = 3600
+
+
+def limit(rule):
+    return RULES[rule][4]
+
+
+def windows(days_tracked=main.INTAKE_DAYS, **values):
+    """Window snapshot with every metric at 0 except `values`, e.g. sugar_24h=51"""
+    snapshot = {w: {m: 0.0 for m in main.INTAKE_METRICS} for w in ("24h", "7d", "7d_avg")}
+    for key, value in values.items():
+        metric, window = key.split("_", 1)
+        snapshot[window][metric] = value
+    snapshot["days_tracked"] = days_tracked
+    return snapshot
+
+
+def fired(snapshot):
+    return {a["rule"] for a in main.evaluate_alert_rules(snapshot)}
+
+
+def test_nothing_fires_on_an_empty_window():
+    assert fired(windows()) == set()
+
+
+@pytest.mark.parametrize("rule, key", [
+    ("high_sugar_24h", "sugar_24h"), ("high_sodium_24h", "sodium_24h"), ("high_sugar_7d", "sugar_7d_avg"),
+])
+def test_upper_limits_are_exclusive(rule, key):
+    assert rule not in fired(windows(**{key: limit(rule)}))
+    assert rule in fired(windows(**{key: limit(rule) + 0.01}))
+
+
+def test_low_water_boundary_and_only_for_water_trackers():
+    target = limit("low_water_24h")
+    assert "low_water_24h" not in fired(windows(water_24h=target, water_7d=target))
+    assert "low_water_24h" in fired(windows(water_24h=target - 0.01, water_7d=target))
+    # No water logged all week: the user doesn't track water
+    assert "low_water_24h" not in fired(windows(water_24h=0.0, water_7d=0.0))
+
+
+def test_weekly_average_waits_for_min_days():
+    high = limit("high_sugar_7d") + 10
+    assert "high_sugar_7d" not in fired(windows(main.ALERT_7D_MIN_DAYS - 1, sugar_7d_avg=high))
+    assert "high_sugar_7d" in fired(windows(main.ALERT_7D_MIN_DAYS, sugar_7d_avg=high))
+
+
+def test_alert_message_reports_value_and_limit():
+    alert = main.evaluate_alert_rules(windows(sugar_24h=62.4))[0]
+    assert alert["value"] == 62.4 and alert["limit"] == limit("high_sugar_24h")
+    assert "62g" in alert["message"]
+
+
+def values(sugar=0.0, water=0.0):
+    return tuple({"sugar": sugar, "water": water}.get(m, 0.0) for m in main.INTAKE_METRICS)
+
+
+def start_of_day():
+    # Midnight in intake local time, so hour and day buckets line up with the test
+    return (20000 * 24 - main.INTAKE_UTC_OFFSET_H) * HOUR
+
+
+def test_24h_window_expires_by_the_hour():
+    t0 = start_of_day() + 10 * HOUR
+    w = main.IntakeWindows(t0)
+    w.add(t0 + 1800, values(sugar=30))
+    w.advance(t0 + 23 * HOUR + 3599)
+    assert w.snapshot()["24h"]["sugar"] == 30
+    w.advance(t0 + 24 * HOUR)
+    assert w.snapshot()["24h"]["sugar"] == 0
+    assert w.snapshot()["7d"]["sugar"] == 30
+
+
+def test_7d_window_and_average():
+    t0 = start_of_day()
+    w = main.IntakeWindows(t0)
+    for day in range(main.INTAKE_DAYS):
+        w.add(t0 + day * 24 * HOUR + 12 * HOUR, values(sugar=10 * (day + 1)))
+    snapshot = w.snapshot()
+    assert snapshot["days_tracked"] == main.INTAKE_DAYS
+    assert snapshot["7d"]["sugar"] == sum(10 * (d + 1) for d in range(main.INTAKE_DAYS))
+    assert snapshot["7d_avg"]["sugar"] == pytest.approx(snapshot["7d"]["sugar"] / main.INTAKE_DAYS)
+    # The next midnight drops day 0 only
+    w.advance(t0 + main.INTAKE_DAYS * 24 * HOUR)
+    assert w.snapshot()["7d"]["sugar"] == snapshot["7d"]["sugar"] - 10
+
+
+def test_events_older_than_both_windows_are_skipped():
+    t0 = start_of_day() + 30 * 24 * HOUR
+    w = main.IntakeWindows(t0)
+    assert not w.add(t0 - main.INTAKE_DAYS * 24 * HOUR, values(sugar=99))
+    assert w.add(t0 - 25 * HOUR, values(sugar=5))  # in the 7 day window only
+    snapshot = w.snapshot()
+    assert snapshot["24h"]["sugar"] == 0 and snapshot["7d"]["sugar"] == 5
@@ -0,0 +1,15 @@
+import main
+
+
+def test_local_answers_roll_into_the_summary(monkeypatch):
+    monkeypatch.setattr(main, "chat_store", main.MemoryStore())
+    monkeypatch.setattr(main, "CHAT_SUMMARY_MODE", "extractive")
+    client = main.app.test_client()
+    for _ in range(main.CHAT_SUMMARY_TRIGGER + 1):
+        response = client.post("/api/chat", json={"message": "how many calories in adobo", "userId": "alice"})
+        assert response.get_json()["answeredLocally"] is True
+
+    summary = main.get_chat_summary("alice")
+    history = main.get_conversation_history("alice")
+    assert summary["text"]
+    assert [e.ts > summary["upto"] for e in history].count(True) == main.CHAT_SUMMARY_KEEP_RECENT
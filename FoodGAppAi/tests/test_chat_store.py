@@ -0,0 +1,63 @@
+import main
+
+
+def rows(store, table):
+    return store._conn().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_sqlite_store_sweeps_expired_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "STORE_SWEEP_EVERY", 10)
+    store = main.SqliteStore(str(tmp_path / "chat.db"))
+    # Every key is new and already expired, like old rate buckets and past days
+    for i in range(500):
+        store.incr(f"daily:user{i}:2026-01-01", 0)
+        store.list_push(f"history:user{i}", "x", 10, 0)
+        assert rows(store, "counters") <= 10
+        assert rows(store, "lists") <= 10
+
+
+def test_sqlite_store_sweep_keeps_live_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "STORE_SWEEP_EVERY", 2)
+    store = main.SqliteStore(str(tmp_path / "chat.db"))
+    store.incr("daily:alice:2026-01-01", 3600)
+    store.list_push("history:alice", "hi", 10, 3600)
+    for i in range(20):
+        store.incr(f"rate:user{i}:1", 0)
+    assert store.get_count("daily:alice:2026-01-01") == 1
+    assert store.list_range("history:alice") == ["hi"]
+
+
+def test_memory_counters_refuse_new_keys_instead_of_evicting_live_ones():
+    store = main.MemoryStore(max_counters=3)
+    for _ in range(4):
+        store.incr("daily:alice:2026-01-01", 3600)
+    for i in range(50):  # flood of spoofed ids
+        store.incr(f"daily:spoof{i}:2026-01-01", 3600)
+    assert store.incr("daily:alice:2026-01-01", 3600) == 5
+    assert store.incr("daily:spoof99:2026-01-01", 3600) > 10
+    assert len(store._counters) == 3
+
+
+def test_memory_counters_reuse_expired_slots():
+    store = main.MemoryStore(max_counters=2)
+    store.incr("daily:old:2026-01-01", 0)
+    store.incr("daily:alice:2026-01-02", 3600)
+    assert store.incr("daily:bob:2026-01-02", 3600) == 1
+    assert "daily:old:2026-01-01" not in store._counters
+
+
+def test_memory_list_cap_is_per_prefix():
+    store = main.MemoryStore(max_lists=2)
+    for user in ("alice", "bob"):
+        store.list_push(f"history:{user}", "turn", 10, 3600)
+        store.list_push(f"summary:{user}", "summary", 1, 3600)
+    # Two users fit in full: a summary does not take a history slot
+    for user in ("alice", "bob"):
+        assert store.list_range(f"history:{user}") == ["turn"]
+        assert store.list_range(f"summary:{user}") == ["summary"]
+
+    store.list_push("history:carol", "turn", 10, 3600)
+    assert store.list_range("history:alice") == []
+    assert store.list_range("summary:alice") == ["summary"]
+    store.delete("history:bob", "summary:bob")
+    assert store.list_range("history:bob") == store.list_range("summary:bob") == []
@@ -0,0 +1,44 @@
+import io
+
+import pytest
+from PIL import Image
+
+import main
+
+
+def png(size=(64, 64)) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", size, (200, 120, 40)).save(out, "PNG")
+    return out.getvalue()
+
+
+@pytest.fixture
+def tiny_pixel_limit(monkeypatch):
+    # Pillow raises DecompressionBombError above twice this many pixels
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 100)
+
+
+def test_preprocess_image_downscales_and_reencodes():
+    processed, mime = main.preprocess_image(png((2000, 1000)))
+    assert mime == "image/jpeg"
+    with Image.open(io.BytesIO(processed)) as img:
+        assert max(img.size) == main.IMAGE_MAX_DIM
+
+
+def test_preprocess_image_rejects_pixel_bombs(tiny_pixel_limit):
+    with pytest.raises(ValueError, match="too many pixels"):
+        main.preprocess_image(png())
+
+
+def test_dhash_cache_key_rejects_pixel_bombs(tiny_pixel_limit, monkeypatch):
+    monkeypatch.setattr(main, "IMAGE_CACHE_KEY", "dhash")
+    with pytest.raises(ValueError, match="too many pixels"):
+        main.image_cache_key(png())
+
+
+def test_describe_image_answers_400_for_pixel_bombs(tiny_pixel_limit):
+    client = main.app.test_client()
+    response = client.post("/describe_image", data={"file": (io.BytesIO(png()), "bomb.png")},
+                           content_type="multipart/form-data")
+    assert response.status_code == 400
+    assert "too many pixels" in response.get_json()["error"]
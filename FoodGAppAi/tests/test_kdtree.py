@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import main
+
+
+def brute_force(points, x, k, mask=None):
+    d = np.sqrt(((points - x) ** 2).sum(axis=1))
+    if mask is not None:
+        d = np.where(mask, d, np.inf)
+    order = [i for i in np.argsort(d, kind="stable") if np.isfinite(d[i])][:k]
+    return [(float(d[i]), int(i)) for i in order]
+
+
+def make_tree(points):
+    # KDTree permutes its arrays in place
+    return main.KDTree(points.copy(), np.arange(len(points)))
+
+
+@pytest.mark.parametrize("n, dims, k", [
+    (1, 5, 3), (10, 5, 3), (main.KDTREE_LEAF_SIZE, 2, 5), (500, 5, 1), (3000, 5, 10), (2000, 3, 2000),
+])
+def test_nearest_matches_brute_force(n, dims, k):
+    rng = np.random.default_rng(n + dims)
+    points = rng.normal(size=(n, dims))
+    tree = make_tree(points)
+    for x in rng.normal(size=(20, dims)) * 1.5:
+        got = tree.query(x, k)
+        expected = brute_force(points, x, k)
+        assert [row for _, row in got] == [row for _, row in expected]
+        assert [d for d, _ in got] == pytest.approx([d for d, _ in expected])
+
+
+def test_filtered_query_matches_brute_force():
+    rng = np.random.default_rng(7)
+    points = rng.uniform(-2, 2, size=(4000, 5))
+    tree = make_tree(points)
+    for x in rng.uniform(-1, 1, size=(20, 5)):
+        upper = [x[0], np.inf, x[2], np.inf, x[4]]
+        mask = (points[:, [0, 2, 4]] <= x[[0, 2, 4]]).all(axis=1) & (points[:, 0] < x[0])
+        got = tree.query(x, 5, upper, lambda rows: mask[rows])
+        assert [row for _, row in got] == [row for _, row in brute_force(points, x, 5, mask)]
+
+
+def test_duplicate_points_and_empty_tree():
+    points = np.zeros((200, 3))
+    got = make_tree(points).query(np.zeros(3), 4)
+    assert len(got) == 4 and all(d == 0.0 for d, _ in got)
+    assert main.KDTree(np.zeros((0, 3)), np.arange(0)).query(np.zeros(3), 3) == []
+
+
+def test_substitutes_are_lighter_and_in_the_same_family():
+    index = main.substitute_index
+    fel = main.fel
+    found = 0
+    for pos in range(len(fel)):
+        family = main.category_family(fel["Category"].iloc[pos])
+        per100 = index.per100[pos]
+        for reasons in (["calories"], ["fat"], ["calories", "fat"]):
+            for _, row in index.nearest(per100, family, reasons, exclude=pos, limit=5):
+                found += 1
+                assert row != pos
+                assert main.category_family(fel["Category"].iloc[row]) == family
+                assert (index.per100[row][main.SUBSTITUTE_CAPPED] <= per100[main.SUBSTITUTE_CAPPED]).all()
+                for reason in reasons:
+                    col = main.SUBSTITUTE_FEATURES.index(main.SUBSTITUTE_REASONS[reason])
+                    assert index.per100[row][col] < per100[col]
+    assert found
@@ -0,0 +1,76 @@
+import copy
+import json
+import pickle
+
+import numpy as np
+import pytest
+
+import main
+from main import MicroVector
+
+
+def test_parse_legacy_string():
+    v = MicroVector.parse("Fiber: 1.2g, Sodium: 300mg, Unknown: 5mg, Iron: -1mg")
+    assert isinstance(v, MicroVector)
+    assert len(v) == len(main.MICRO_NUTRIENTS)
+    assert v.as_dict() == {"Fiber": 1.2, "Sodium": 300.0, "Vit C": 0.0, "Vit A": 0.0, "Calcium": 0.0,
+                           "Iron": 0.0, "Potassium": 0.0, "Cholesterol": 0.0}
+
+
+def test_from_named_is_case_insensitive():
+    assert MicroVector.from_named({"sodium": 12, "VIT C": "3.5"}).as_dict()["Vit C"] == 3.5
+    assert MicroVector.from_named({"sodium": 12})[main.MICRO_INDEX["sodium"]] == 12
+
+
+def test_scaled_and_added_stay_vectors():
+    a = MicroVector.parse("Fiber: 2g, Sodium: 100mg")
+    b = MicroVector.parse("Sodium: 50mg, Calcium: 20mg")
+    scaled = a.scaled(1.5)
+    total = a + b
+    assert isinstance(scaled, MicroVector) and isinstance(total, MicroVector)
+    assert scaled.as_dict()["Fiber"] == 3.0
+    assert scaled.as_dict()["Sodium"] == 150.0
+    assert total.as_dict()["Sodium"] == 150.0
+    assert total.as_dict()["Calcium"] == 20.0
+    assert a.as_dict()["Sodium"] == 100.0  # operands untouched
+    assert isinstance(total.values, np.ndarray) and total.values.dtype == np.float64
+
+
+def test_sum_from_empty_vector():
+    vectors = [MicroVector.parse("Iron: 1.5mg"), MicroVector.parse("Iron: 2mg"), MicroVector()]
+    total = sum(vectors, MicroVector())
+    assert isinstance(total, MicroVector)
+    assert total.as_dict()["Iron"] == pytest.approx(3.5)
+
+
+def test_string_rendering_order_and_threshold():
+    v = MicroVector.from_named({"Cholesterol": 10, "Fiber": 1.25, "Sodium": 0.05, "Vit A": 0.1})
+    # MICRO_NUTRIENTS order, one decimal, values under MICRO_RENDER_MIN omitted
+    assert v.to_json() == "Fiber: 1.2g, Vit A: 0.1mcg, Cholesterol: 10.0mg"
+    assert str(v) == v.to_json()
+    assert MicroVector().to_json() == ""
+    assert not MicroVector.from_named({"Sodium": 0.05})
+    assert v
+
+
+def test_string_round_trip():
+    v = MicroVector.parse("Fiber: 1.2g, Sodium: 300.0mg, Potassium: 45.5mg")
+    assert MicroVector.parse(v.to_json()) == v
+
+
+def test_json_renders_legacy_string():
+    v = MicroVector.parse("Fiber: 1.2g, Sodium: 300.0mg")
+    with main.app.app_context():
+        rendered = json.loads(main.app.json.dumps({"MicroNutrients": v, "total": [v + v]}))
+    assert rendered == {"MicroNutrients": "Fiber: 1.2g, Sodium: 300.0mg",
+                        "total": ["Fiber: 2.4g, Sodium: 600.0mg"]}
+
+
+@pytest.mark.parametrize("clone", [copy.copy, copy.deepcopy, lambda v: pickle.loads(pickle.dumps(v))])
+def test_copies_keep_the_type(clone):
+    v = MicroVector.parse("Calcium: 12mg")
+    c = clone(v)
+    assert type(c) is MicroVector
+    assert c == v
+    c[0] = 9.0
+    assert v[0] == 0.0
@@ -0,0 +1,71 @@
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("text, name, quantity, unit, grams, source", [
+    ("200g adobo", "adobo", 200, "g", 200.0, "mass"),
+    ("1 kg lechon", "lechon", 1, "kg", 1000.0, "mass"),
+    ("1.5 oz shrimp", "shrimp", 1.5, "oz", 42.5, "mass"),
+    ("2 cups rice", "rice", 2, "cups", 316.8, "volume"),            # 2 * 240 ml * 0.66 g/ml
+    ("1 1/2 cups milk", "milk", 1.5, "cups", 370.8, "volume"),      # mixed number
+    ("½ cup rice", "rice", 0.5, "cup", 79.2, "volume"),             # unicode fraction
+    ("a glass of milk", "milk", 1, "glass", 257.5, "volume"),
+    ("3 pieces lumpia", "lumpia", 3, "pieces", 90.0, "piece"),
+    ("2 eggs", "egg", 2, "piece", 100.0, "piece"),                  # bare count of a countable food
+    ("half a mango", "mango", 0.5, "piece", 100.0, "piece"),
+    ("banana 2", "banana", 2, "piece", 180.0, "piece"),             # trailing quantity
+    ("adobo x 2", "adobo", 2, "serving", 240.0, "serving"),
+    ("2 servings pancit canton", "pancit canton", 2, "servings", 400.0, "serving"),
+    ("coke 1 can", "coke", 1, "can", 343.2, "volume"),             # trailing quantity and unit
+    ("rice 2 cups", "rice", 2, "cups", 316.8, "volume"),
+    ("250ml milk", "milk", 250, "ml", 257.5, "volume"),             # unit joined to the number
+])
+def test_quantity_and_unit(text, name, quantity, unit, grams, source):
+    parsed = main.parse_meal_segment(text)
+    assert parsed == {"name": name, "quantity": quantity, "unit": unit, "grams": grams, "portionSource": source}
+
+
+def test_food_starting_with_a_number_word_is_not_split():
+    # "adobo" must not read as "a" + "dobo"
+    parsed = main.parse_meal_segment("adobo")
+    assert parsed["name"] == "adobo"
+    assert parsed["quantity"] == 1
+    assert parsed["unit"] == "serving"
+
+
+@pytest.mark.parametrize("text", ["7up", "2 7up"])
+def test_digits_joined_to_a_non_unit_stay_in_the_name(text):
+    parsed = main.parse_meal_segment(text)
+    assert parsed["name"] == "7up"
+    assert parsed["unit"] == "serving"
+    assert parsed["quantity"] == (2 if text.startswith("2 ") else 1)
+
+
+@pytest.mark.parametrize("text", ["", "  . ", "0 g rice", "0 cups milk"])
+def test_empty_or_zero_quantity_is_rejected(text):
+    assert main.parse_meal_segment(text) is None
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("", 1.0), ("a", 1.0), ("half", 0.5), ("dozen", 12.0), ("3", 3.0), ("2.5", 2.5),
+    ("3/4", 0.75), ("1 1/2", 1.5), ("1/0", 0.0),
+])
+def test_parse_quantity(text, expected):
+    assert main.parse_quantity(text) == pytest.approx(expected)
+
+
+def test_parse_meal_text_splits_segments():
+    parsed, unparsed = main.parse_meal_text("2 cups rice, 1 adobo and half a mango")
+    assert [p["name"] for p in parsed] == ["rice", "adobo", "mango"]
+    assert [p["text"] for p in parsed] == ["2 cups rice", "1 adobo", "half a mango"]
+    assert unparsed == []
+
+
+def test_parse_meal_text_leaves_lookups_to_the_batch(monkeypatch):
+    def no_lookup(_):
+        raise AssertionError("FEL lookup during text parsing")
+
+    monkeypatch.setattr(main, "lookup_fel", no_lookup)
+    parsed, _ = main.parse_meal_text("coke 1 can, 200g adobo")
+    assert [(p["name"], p["quantity"], p["unit"]) for p in parsed] == [("coke", 1, "can"), ("adobo", 200, "g")]